@@ -1,15 +1,22 @@
-import os
-import json
+import queue
 import random
+import threading
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import pypdf
-from main import calculate_grayscale_coverage , calculate_color_coverage,get_pdf_page_count
+from document_index import document_index, paper_sizes
+from main import CoverageJob, JobCancelled, setup_logger
+from catalog import Catalog
+from render_backend import shutdown_rasterizer
+from pricing import coverage_usage, document_paper_cost, ink_cost, printers_for_mode, sheets_by_size, unpriced_sizes
+
+# How often the GUI checks the catalog for changes made by other processes
+catalog_poll_ms = 1000
 
 class PrinterTab:
-    def __init__(self, parent):
+    def __init__(self, parent, catalog):
         self.parent = parent
-        self.printers = self.load_printers()
+        self.catalog = catalog
 
         # Printer selection UI components
         self.printer_listbox = tk.Listbox(parent, height=10, width=20)
@@ -56,8 +63,9 @@ class PrinterTab:
         # Initially hide color fields
         self.toggle_color_fields()
 
-        # Load existing printers into listbox
+        # Load existing printers into listbox, and again whenever the catalog changes
         self.refresh_printer_listbox()
+        self.catalog.subscribe(lambda catalog: self.refresh_printer_listbox())
 
     def on_printer_select(self, event):
         """Handle listbox selection and display selected printer details."""
@@ -70,7 +78,10 @@ class PrinterTab:
 
     def display_printer_details(self, printer_name):
         """Display the details of the selected printer."""
-        printer_info = self.printers[printer_name]
+        printer_info = self.catalog.printer(printer_name)
+        if printer_info is None:
+            self.clear_fields()
+            return
         self.printer_name_var.set(printer_name)
         self.is_color_var.set(printer_info['is_color'])
 
@@ -113,29 +124,22 @@ class PrinterTab:
             messagebox.showerror("Error", "Printer name is required.")
             return
 
-        if printer_name in self.printers:
-            messagebox.showerror("Error", "Printer already exists.")
-            return
-
         # Collect ink data
         ink_data = {color: {
             'price': float(self.ink_vars[color]['price'].get()) if self.ink_vars[color]['price'].get() else 0,
             'yield': int(self.ink_vars[color]['yield'].get()) if self.ink_vars[color]['yield'].get() else 0
         } for color in self.ink_vars}
 
-        # Add the printer
-        self.printers[printer_name] = {'is_color': is_color, 'inks': ink_data}
-        self.save_printers()
-        self.refresh_printer_listbox()
+        # Add the printer; the catalog refreshes the listbox
+        if not self.catalog.add_printer(printer_name, is_color, ink_data):
+            messagebox.showerror("Error", "Printer already exists.")
 
     def delete_printer(self):
         """Delete the selected printer."""
         selected = self.printer_listbox.curselection()
         if selected:
             printer_name = self.printer_listbox.get(selected[0])
-            del self.printers[printer_name]
-            self.save_printers()
-            self.refresh_printer_listbox()
+            self.catalog.delete_printer(printer_name)
             self.clear_fields()
         else:
             messagebox.showerror("Error", "No printer selected.")
@@ -157,44 +161,33 @@ class PrinterTab:
         } for color in self.ink_vars}
 
         # Update the printer
-        self.printers[printer_name] = {'is_color': is_color, 'inks': ink_data}
-        self.save_printers()
-        self.refresh_printer_listbox()
-
-    def load_printers(self):
-        """Load printers from a JSON file."""
-        if os.path.exists('printers.json'):
-            with open('printers.json', 'r') as file:
-                return json.load(file)
-        return {}
-
-    def save_printers(self):
-        """Save printers to a JSON file."""
-        with open('printers.json', 'w') as file:
-            json.dump(self.printers, file, indent=4)
+        self.catalog.put_printer(printer_name, is_color, ink_data)
 
     def refresh_printer_listbox(self):
         """Refresh the printer listbox with current printers."""
         self.printer_listbox.delete(0, tk.END)
-        for printer in self.printers:
+        for printer in self.catalog.printer_names():
             self.printer_listbox.insert(tk.END, printer)
 
 class PaperTab:
-    def __init__(self, parent):
+    def __init__(self, parent, catalog):
         self.parent = parent
-        self.papers = self.load_papers()
+        self.catalog = catalog
 
-        # Predefined paper sizes
-        self.predefined_papers = ['A4', 'A5']
+        # Every paper size pages are matched to
+        self.predefined_papers = list(paper_sizes)
         self.prices_vars = {paper: tk.StringVar() for paper in self.predefined_papers}
+        # Field values as last loaded from the catalog; fields that differ were edited here
+        self.loaded_prices = {}
 
         # Paper price fields
         for idx, paper in enumerate(self.predefined_papers):
             ttk.Label(parent, text=f"{paper} Price:").grid(row=idx, column=1, padx=5, pady=5, sticky=tk.W)
             ttk.Entry(parent, textvariable=self.prices_vars[paper], width=10).grid(row=idx, column=2, padx=(0, 5), pady=2)
 
-        # Load prices into entry fields
+        # Load prices into entry fields, and refresh the fields not being edited when the catalog changes
         self.load_prices()
+        self.catalog.subscribe(lambda catalog: self.refresh_prices())
 
         # Buttons for save prices
         ttk.Button(parent, text="Save Prices", command=self.save_prices).grid(row=0, column=5, padx=10)
@@ -202,42 +195,51 @@ class PaperTab:
 
     def load_prices(self):
         """Load predefined paper prices into entry fields."""
+        papers = self.catalog.papers()
+        for paper in self.predefined_papers:
+            self.loaded_prices[paper] = str(papers.get(paper, ''))
+            self.prices_vars[paper].set(self.loaded_prices[paper])
+
+    def refresh_prices(self):
+        """Shows catalog changes in the fields the user has not edited."""
+        papers = self.catalog.papers()
         for paper in self.predefined_papers:
-            self.prices_vars[paper].set(self.papers.get(paper, ''))
+            if self.prices_vars[paper].get() == self.loaded_prices.get(paper):
+                self.loaded_prices[paper] = str(papers.get(paper, ''))
+                self.prices_vars[paper].set(self.loaded_prices[paper])
 
     def save_prices(self):
-        """Save prices of predefined paper sizes."""
+        """Save the edited paper prices; sizes left empty keep no price.
+
+        Only fields changed since they were loaded are saved, so prices
+        another process changed meanwhile are not written back.
+        """
+        prices = {}
         for paper in self.predefined_papers:
+            value = self.prices_vars[paper].get().strip()
+            if not value or value == self.loaded_prices.get(paper):
+                continue
             try:
-                price = float(self.prices_vars[paper].get())
+                price = float(value)
                 if price < 0:
                     raise ValueError("Price must be non-negative.")
-                self.papers[paper] = price
+                prices[paper] = price
             except ValueError:
                 messagebox.showerror("Error", f"Invalid price for {paper}. Please enter a valid number.")
                 return
 
-        # Save to JSON
-        self.save_papers()
+        # All prices are saved together or not at all
+        self.catalog.set_paper_prices(prices)
+        self.load_prices()
         messagebox.showinfo("Success", "Paper prices saved successfully.")
 
-    def load_papers(self):
-        """Load papers from a JSON file."""
-        if os.path.exists('papers.json'):
-            with open('papers.json', 'r') as file:
-                return json.load(file)
-        return {}
-
-    def save_papers(self):
-        """Save papers to a JSON file."""
-        with open('papers.json', 'w') as file:
-            json.dump(self.papers, file, indent=4)
-
 class CostTab:
-    def __init__(self, parent):
+    def __init__(self, parent, catalog):
         self.parent = parent
-        self.printers = self.load_printers()
-        self.paper = self.load_paper()
+        self.catalog = catalog
+        # Catalog views taken when a quote starts, so one quote uses one set of prices
+        self.printers = catalog.printers()
+        self.paper = catalog.papers()
 
         # PDF file path
         self.pdf_path_var = tk.StringVar()
@@ -255,12 +257,28 @@ class CostTab:
         ttk.Label(parent, text="Print Mode:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=5)
         ttk.Radiobutton(parent, text="double", variable=self.print_double, value="double").grid(row=2, column=1,sticky=tk.W,padx=5, pady=5)
 
+        # Quick estimate renders a sample of the pages at low resolution
+        self.estimate_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(parent, text="Quick estimate", variable=self.estimate_var).grid(row=2, column=2, sticky=tk.W, padx=5, pady=5)
+
         # Calculate Cost Button
-        ttk.Button(parent, text="Calculate Cost", command=self.show_costs).grid(row=1, column=3, padx=5, pady=5)
+        self.calculate_button = ttk.Button(parent, text="Calculate Cost", command=self.show_costs)
+        self.calculate_button.grid(row=1, column=3, padx=5, pady=5)
+        self.cancel_button = ttk.Button(parent, text="Cancel", command=self.cancel_costs, state="disabled")
+        self.cancel_button.grid(row=2, column=3, padx=5, pady=5)
 
         # Printer cost output
         self.cost_text = tk.Text(parent, height=15, width=60, state="disabled")
         self.cost_text.grid(row=3, column=0, columnspan=4, padx=10, pady=10)
+        self.progress_bar = ttk.Progressbar(parent, orient="horizontal", mode="determinate")
+        self.progress_bar.grid(row=4, column=0, columnspan=4, sticky=tk.EW, padx=10, pady=5)
+
+        # The coverage runs on a worker thread; it reports back through this queue
+        self.job = None
+        self.messages = queue.Queue()
+        self.paper_cost = 0
+        self.paper_sheets = {}
+        self.unpriced_paper = []
 
     def browse_pdf(self):
         """Allow the user to select a PDF file."""
@@ -269,89 +287,160 @@ class CostTab:
             self.pdf_path_var.set(file_path)
 
     def show_costs(self):
-        """Calculate and display the cost for each printer based on the selected mode."""
+        """Start calculating the cost for each printer in the background."""
         pdf_path = self.pdf_path_var.get()
         if not pdf_path:
             messagebox.showerror("Error", "Please select a PDF file.")
             return
-
-        # Clear the text area
-        self.cost_text.configure(state="normal")
-        self.cost_text.delete(1.0, tk.END)
+        if self.job is not None:
+            return
 
         print_mode = self.print_mode_var.get()
-        if print_mode == "color":
-            coverage_function = self.calculate_color_coverage
-        else:
-            coverage_function = self.calculate_grayscale_coverage
-
         page_mode = self.print_double.get()
-        pages = get_pdf_page_count(pdf_path)
-        if page_mode == "double":
-            cost_page = (-1*(-1*pages // 2)) * self.paper.get("A4")
+        try:
+            index = document_index(pdf_path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not read the PDF: {e}")
+            return
+        # Quote with the current catalog, including edits made since the tab opened
+        self.printers = self.catalog.printers()
+        self.paper = self.catalog.papers()
+        # Every page is priced on its own paper size (A4, A5, ...)
+        pages = index.page_count
+        page_sizes = index.page_sizes()
+        self.paper_cost = document_paper_cost(page_sizes, self.paper, page_mode == "double")
+        self.paper_sheets = sheets_by_size(page_sizes, page_mode == "double")
+        self.unpriced_paper = unpriced_sizes(page_sizes, self.paper)
+
+        self.job = CoverageJob(pdf_path)
+        thread = threading.Thread(
+            target=self.run_job, args=(self.job, print_mode, self.estimate_var.get()), daemon=True
+        )
+        self.calculate_button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+        self.progress_bar.configure(maximum=pages, value=0)
+        self.write_costs(print_mode, None, note="calculating...")
+        thread.start()
+        self.parent.after(100, self.poll_job, print_mode)
+
+    def run_job(self, job, print_mode, estimate):
+        """Compute the ink usage on a worker thread and post the outcome to the GUI."""
+        def progress(pages_done, page_count, coverage):
+            self.messages.put(("progress", pages_done, page_count, coverage_usage(coverage)))
+
+        try:
+            if estimate:
+                usage, error = self.estimate_coverage(job, print_mode)
+            elif print_mode == "color":
+                usage, error = self.calculate_color_coverage(job, progress), None
+            else:
+                usage, error = self.calculate_grayscale_coverage(job, progress), None
+            flagged = job.flagged_pages()
+            # Pages that failed or ran out of time are priced at the average coverage of the others
+            note = f"{len(flagged)} pages could not be measured, estimated from the others" if flagged else None
+            self.messages.put(("done", usage, error, note))
+        except JobCancelled:
+            self.messages.put(("cancelled",))
+        except Exception as e:
+            self.messages.put(("failed", str(e)))
+        finally:
+            job.close()
+
+    def poll_job(self, print_mode):
+        """Show the messages of the running job; Tk widgets are only touched from here."""
+        finished = False
+        while True:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            kind = message[0]
+            if kind == "progress":
+                _, pages_done, page_count, usage = message
+                self.progress_bar.configure(value=pages_done)
+                self.write_costs(print_mode, usage, note=f"{pages_done}/{page_count} pages")
+            elif kind == "done":
+                _, usage, error, note = message
+                self.progress_bar.configure(value=self.progress_bar["maximum"])
+                self.write_costs(print_mode, usage, error, note)
+                finished = True
+            elif kind == "cancelled":
+                self.write_costs(print_mode, None, note="cancelled")
+                finished = True
+            else:
+                self.write_costs(print_mode, None, note="failed")
+                messagebox.showerror("Error", f"Could not calculate the cost: {message[1]}")
+                finished = True
+
+        if finished:
+            self.job = None
+            self.calculate_button.configure(state="normal")
+            self.cancel_button.configure(state="disabled")
         else:
-            cost_page = pages * self.paper.get("A4")
+            self.parent.after(100, self.poll_job, print_mode)
 
-        cost = cost_page
-        self.cost_text.insert(tk.END, f"Printer: paper cost\n")
-        self.cost_text.insert(tk.END, f"Estimated Cost: {cost:.2f}\n\n")
+    def cancel_costs(self):
+        """Stop the running calculation."""
+        if self.job is not None:
+            self.cancel_button.configure(state="disabled")
+            self.job.cancel()
 
-        # Display costs for each printer
-        for printer_name, printer_info in self.printers.items():
-            if print_mode == "color" and not printer_info["is_color"]:
-                continue  # Skip grayscale printers if color is selected
-
-            coverage = coverage_function(pdf_path)
-            cost = self.calculate_cost(printer_info, coverage)
+    def write_costs(self, print_mode, usage, error=None, note=None):
+        """Display the paper cost and the cost for each printer; usage None leaves printer costs blank."""
+        self.cost_text.configure(state="normal")
+        self.cost_text.delete(1.0, tk.END)
+        sheets = ", ".join(f"{count} {size}" for size, count in self.paper_sheets.items())
+        self.cost_text.insert(tk.END, f"Printer: paper cost ({sheets} sheets)\n")
+        self.cost_text.insert(tk.END, f"Estimated Cost: {self.paper_cost:.2f}\n")
+        if self.unpriced_paper:
+            # Their sheets are not in the paper cost
+            self.cost_text.insert(tk.END, f"No price for {', '.join(self.unpriced_paper)} paper (see the paper tab)\n")
+        self.cost_text.insert(tk.END, "\n")
+
+        suffix = f" ({note})" if note else ""
+        # Grayscale printers are skipped if color is selected
+        for printer_name, printer_info in printers_for_mode(self.printers, print_mode).items():
             self.cost_text.insert(tk.END, f"Printer: {printer_name}\n")
-            self.cost_text.insert(tk.END, f"Estimated Cost: {cost:.2f}\n\n")
+            if usage is None:
+                self.cost_text.insert(tk.END, f"Estimated Cost:{suffix}\n\n")
+                continue
+            cost = self.calculate_cost(printer_info, usage)
+            if error is not None:
+                cost_error = self.calculate_cost(printer_info, error)
+                self.cost_text.insert(tk.END, f"Estimated Cost: {cost:.2f} ± {cost_error:.2f}{suffix}\n\n")
+            else:
+                self.cost_text.insert(tk.END, f"Estimated Cost: {cost:.2f}{suffix}\n\n")
 
         self.cost_text.configure(state="disabled")
 
-    def calculate_color_coverage(self, pdf_path):
-        """Calculate color coverage for the entire PDF (stub function)."""
-        # Stub: Return an arbitrary coverage value (in percentages) for demonstration.
-        x = calculate_color_coverage(pdf_path)
-        for color , cov in x.items():
-            x[color] = cov/5
-        return x
-
-    def calculate_grayscale_coverage(self, pdf_path):
-        """Calculate grayscale coverage for the entire PDF (stub function)."""
-        # Stub: Return an arbitrary coverage value (in percentage) for demonstration.
-        x = calculate_grayscale_coverage(pdf_path)
-        x /= 5
-        return {"Black" : x}
+    def calculate_color_coverage(self, job, progress=None):
+        """Calculate color ink usage for the entire PDF in rated pages."""
+        return coverage_usage(job.color_coverage(progress))
+
+    def calculate_grayscale_coverage(self, job, progress=None):
+        """Calculate black ink usage for the entire PDF in rated pages."""
+        return coverage_usage(job.grayscale_coverage(progress))
+
+    def estimate_coverage(self, job, print_mode):
+        """Quickly estimate the ink usage and its expected error for the entire PDF."""
+        estimate = job.estimate(print_mode)
+        return coverage_usage(estimate["coverage"]), coverage_usage(estimate["error"])
 
     def calculate_cost(self, printer_info, coverage):
         """Calculate the estimated printing cost based on coverage and printer ink yields."""
-        total_cost = 0
-        for color, usage in coverage.items():
-            ink = printer_info["inks"].get(color)
-            if ink and ink["yield"] > 0:  # Avoid division by zero
-                cost_per_page = ink["price"] / ink["yield"]
-                cost = cost_per_page * usage
-                total_cost += cost
-        return total_cost
-
-    def load_printers(self):
-        """Load printers from a JSON file."""
-        if os.path.exists("printers.json"):
-            with open("printers.json", "r") as file:
-                return json.load(file)
-        return {}
-
-    def load_paper(self):
-        """Load paper from a JSON file."""
-        if os.path.exists("papers.json"):
-            with open("papers.json", "r") as file:
-                return json.load(file)
-        return {}
+        return ink_cost(printer_info, coverage)
 
 # Main GUI Setup
 def main_gui():
+    setup_logger()
     root = tk.Tk()
     root.title("Printer Manager")
+    catalog = Catalog()
+
+    def poll_catalog():
+        # Picks up catalog changes made by other processes
+        catalog.poll()
+        root.after(catalog_poll_ms, poll_catalog)
 
     tab_control = ttk.Notebook(root)
 
@@ -364,11 +453,14 @@ def main_gui():
     tab_control.add(cost_tab, text="cost")
     tab_control.pack(expand=1, fill='both')
 
-    app = PrinterTab(printer_tab)
-    PaperTab(paper_tab)
-    CostTab(cost_tab)
+    app = PrinterTab(printer_tab, catalog)
+    PaperTab(paper_tab, catalog)
+    CostTab(cost_tab, catalog)
 
+    poll_catalog()
     root.mainloop()
+    catalog.close()
+    shutdown_rasterizer()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,199 @@
+"""Headless batch quoting: cost a directory or list of PDFs against every printer.
+
+Example:
+    python batch.py incoming/ --mode color --double --output report.csv
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+import scheduler
+from catalog import Catalog
+from document_index import document_index
+import main as main_module
+from main import CoverageJob, logger, setup_logger
+from pricing import coverage_usage, document_paper_cost, ink_cost, printers_for_mode, unpriced_sizes
+from render_backend import shutdown_rasterizer
+from spool import Spool
+
+report_fields = [
+    "file", "pages", "mode", "double_sided", "printer",
+    "ink_cost", "paper_cost", "total_cost", "coverage", "flagged_pages", "unpriced_paper", "seconds", "error",
+]
+
+
+def find_pdfs(paths):
+    """Expands directories into the PDF files they contain, in a stable order."""
+    pdf_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, file_names in sorted(os.walk(path)):
+                pdf_paths.extend(
+                    os.path.join(folder, file_name) for file_name in sorted(file_names)
+                    if file_name.lower().endswith(".pdf")
+                )
+        else:
+            pdf_paths.append(path)
+    return pdf_paths
+
+
+def quote_document(pdf_path, printers, papers, mode="color", double_sided=False, resolution=None):
+    """Quotes one PDF and returns one report row per printer that can print the mode."""
+    started = time.perf_counter()
+    rows = []
+    try:
+        index = document_index(pdf_path)
+        pages = index.page_count
+        with CoverageJob(pdf_path, resolution) as job:
+            coverage = job.color_coverage() if mode == "color" else job.grayscale_coverage()
+            flagged = job.flagged_pages()
+        usage = coverage_usage(coverage)
+        paper = document_paper_cost(index.page_sizes(), papers, double_sided)
+        # Sheets of these sizes are not in paper_cost
+        unpriced = unpriced_sizes(index.page_sizes(), papers)
+        if unpriced:
+            logger.warning(f"No paper price for {', '.join(unpriced)} in {pdf_path}")
+        for printer_name, printer_info in printers_for_mode(printers, mode).items():
+            ink = ink_cost(printer_info, usage)
+            rows.append({
+                "file": pdf_path, "pages": pages, "mode": mode, "double_sided": double_sided,
+                "printer": printer_name, "ink_cost": round(ink, 4), "paper_cost": round(paper, 4),
+                "total_cost": round(ink + paper, 4), "coverage": coverage, "flagged_pages": flagged,
+                "unpriced_paper": unpriced,
+                "error": None,
+            })
+    except Exception as e:
+        logger.error(f"Error quoting {pdf_path}: {e}")
+        rows = [{"file": pdf_path, "pages": 0, "mode": mode, "double_sided": double_sided, "error": str(e)}]
+
+    seconds = round(time.perf_counter() - started, 3)
+    for row in rows:
+        row["seconds"] = seconds
+    return rows
+
+
+def quote_documents(pdf_paths, printers, papers, mode="color", double_sided=False,
+                    resolution=None, documents=None, processes=None):
+    """Quotes many PDFs and yields report rows as each document finishes.
+
+    Up to documents PDFs are costed at once. Their page ranges share one
+    pool of at most processes Ghostscript processes (scheduler.process_limit).
+    """
+    processes = processes or os.cpu_count() or 1
+    documents = documents or processes
+    previous_limit = scheduler.process_limit
+    scheduler.set_process_limit(processes)
+    try:
+        with ThreadPoolExecutor(max_workers=documents) as executor:
+            futures = [
+                executor.submit(quote_document, pdf_path, printers, papers, mode, double_sided, resolution)
+                for pdf_path in pdf_paths
+            ]
+            for future in as_completed(futures):
+                yield from future.result()
+    finally:
+        scheduler.set_process_limit(previous_limit)
+
+
+class ReportWriter:
+    """Writes report rows as JSON Lines or CSV, flushing after every document."""
+
+    def __init__(self, file, report_format):
+        self.file = file
+        self.report_format = report_format
+        self.csv_writer = None
+        if report_format == "csv":
+            self.csv_writer = csv.DictWriter(file, fieldnames=report_fields, extrasaction="ignore")
+            self.csv_writer.writeheader()
+
+    def write(self, row):
+        if self.csv_writer is not None:
+            row = dict(row)
+            row["coverage"] = json.dumps(row.get("coverage"))
+            row["flagged_pages"] = json.dumps(row.get("flagged_pages"))
+            row["unpriced_paper"] = json.dumps(row.get("unpriced_paper"))
+            self.csv_writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + "\n")
+        self.file.flush()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Quote the printing cost of many PDFs without the GUI.")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories of PDF files")
+    parser.add_argument("--mode", choices=["color", "grayscale"], default="grayscale")
+    parser.add_argument("--double", action="store_true", help="price double sided printing")
+    parser.add_argument("--catalog", help="printer and paper catalog (default: catalog.db)")
+    parser.add_argument("--printers", help="import the printers of this JSON file into the catalog first")
+    parser.add_argument("--papers", help="import the paper prices of this JSON file into the catalog first")
+    parser.add_argument("--resolution", type=int, help="render resolution in dpi")
+    parser.add_argument("--backend", choices=sorted(main_module.range_renderers), help="renderer (default: Ghostscript if installed)")
+    parser.add_argument("--output", help="report file (default: standard output)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="report format (default: from --output)")
+    parser.add_argument("--documents", type=int, help="documents costed at once")
+    parser.add_argument("--processes", type=int, help="Ghostscript processes shared by all documents")
+    parser.add_argument("--spool", help="render through spool workers using this shared spool database")
+    parser.add_argument("--metrics", help="write a JSON snapshot of the stage timings to this file")
+    parser.add_argument("--profile", help="profile the decode and reduce stages into .prof files in this directory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logger()
+    report_format = args.format or ("csv" if args.output and args.output.lower().endswith(".csv") else "jsonl")
+    catalog = Catalog(args.catalog)
+    if args.printers or args.papers:
+        catalog.import_json(args.printers, args.papers)
+    # One set of prices for the whole run
+    printers, papers = catalog.printers(), catalog.papers()
+    catalog.close()
+    pdf_paths = find_pdfs(args.paths)
+    profiler = metrics.enable_profiling() if args.profile else None
+    if args.backend:
+        main_module.default_render_backend = args.backend
+    if args.spool:
+        main_module.default_spool = Spool(args.spool)
+
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    started = time.perf_counter()
+    total_pages = 0
+    failed = 0
+    # Documents with pages that could not be measured; their costs are estimates
+    partial = 0
+    quoted = set()
+    try:
+        writer = ReportWriter(output, report_format)
+        for row in quote_documents(pdf_paths, printers, papers, args.mode, args.double,
+                                   args.resolution, args.documents, args.processes):
+            writer.write(row)
+            if row["file"] not in quoted:
+                quoted.add(row["file"])
+                total_pages += row["pages"]
+                failed += row["error"] is not None
+                partial += bool(row.get("flagged_pages"))
+    finally:
+        shutdown_rasterizer()
+        if output is not sys.stdout:
+            output.close()
+        if profiler is not None:
+            metrics.disable_profiling()
+            profiler.dump(args.profile)
+        if args.metrics:
+            metrics.write_snapshot(args.metrics)
+
+    elapsed = time.perf_counter() - started
+    summary = (f"Quoted {len(quoted)} documents ({failed} failed, {partial} partially measured), "
+               f"{total_pages} pages in {elapsed:.1f}s: {total_pages / elapsed if elapsed > 0 else 0:.1f} pages/s")
+    logger.info(summary)
+    print(summary, file=sys.stderr)
+    return 1 if failed or partial else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+"""Coverage benchmark on synthetic PDFs, timed stage by stage.
+
+Example:
+    python bench.py                     # all documents, results appended to bench_results.jsonl
+    python bench.py --documents text color --scale 0.5
+
+The documents are generated locally and deterministically (text only, full
+bleed color, large images, many pages and large format pages), so runs on
+different versions of the code measure the same work. Each run is compared
+with the latest stored run of a different git revision and stages that got
+slower by more than regression_threshold are reported.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+import main as main_module
+from main import CoverageJob, flagged_statuses, get_pdf_page_count, logger, setup_logger
+from metrics import directory_bytes
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+results_file = "bench_results.jsonl"
+pdf_dir = "bench_pdfs"
+# A stage slower than its previous time by this factor is reported as a regression
+regression_threshold = 1.15
+# Smaller slowdowns than this are timing noise
+regression_min_seconds = 0.05
+# Seconds between samples of memory use and workspace size
+sample_interval = 0.02
+# Page sizes in points
+a4 = (595, 842)
+a0 = (2384, 3370)
+
+
+def pdf_bytes(pages, seed):
+    """Builds a PDF from [(width, height, content, images)], images being [(width, height, rgb)]."""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_refs = []
+    pages_object = add(None)
+    for width, height, content, images in pages:
+        xobjects = []
+        for index, (image_width, image_height, rgb) in enumerate(images):
+            data = zlib.compress(rgb, 1)
+            image = add(
+                b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB "
+                b"/BitsPerComponent 8 /Filter /FlateDecode /Length %d >>\nstream\n" % (image_width, image_height, len(data))
+                + data + b"\nendstream"
+            )
+            xobjects.append(b"/Im%d %d 0 R" % (index, image))
+        stream = add(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        resources = b"<< /Font << /F1 %d 0 R >> /XObject << %s >> >>" % (font, b" ".join(xobjects))
+        page_refs.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources %s /Contents %d 0 R >>"
+            % (pages_object, width, height, resources, stream)
+        ))
+    objects[pages_object - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % ref for ref in page_refs), len(page_refs)
+    )
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_object)
+
+    output = bytearray(b"%PDF-1.4\n% synthetic benchmark document " + str(seed).encode("ascii") + b"\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(output)
+
+
+def text_page(generator, size=a4, lines=60):
+    words = ["coverage", "toner", "page", "printer", "paper", "cyan", "magenta", "yellow", "black", "quote"]
+    content = [b"BT /F1 10 Tf 0 0 0 rg 50 %d Td 12 TL" % (size[1] - 60)]
+    for _ in range(lines):
+        line = " ".join(generator.choice(words) for _ in range(12))
+        content.append(b"(%s) '" % line.encode("ascii"))
+    content.append(b"ET")
+    return size[0], size[1], b"\n".join(content), []
+
+
+def color_page(generator, size=a4, bands=24):
+    """Full bleed CMYK bands, different on every page so none are deduplicated."""
+    content = []
+    band_height = size[1] / bands
+    for band in range(bands):
+        cmyk = " ".join(f"{generator.random():.3f}" for _ in range(4))
+        content.append(f"{cmyk} k 0 {band * band_height:.2f} {size[0]} {band_height:.2f} re f".encode("ascii"))
+    return size[0], size[1], b"\n".join(content), []
+
+
+def image_page(generator, size=a4, pixels=1200):
+    rgb = generator.randbytes(pixels * pixels * 3)
+    content = b"q %d 0 0 %d 0 0 cm /Im0 Do Q" % size
+    return size[0], size[1], content, [(pixels, pixels, rgb)]
+
+
+def synthetic_documents(scale=1.0):
+    """Benchmark documents as {name: (builder, page count)}, with page counts multiplied by scale."""
+    def count(pages):
+        return max(1, round(pages * scale))
+    return {
+        "text": (text_page, count(20)),
+        "color": (color_page, count(20)),
+        "images": (image_page, count(6)),
+        "many_pages": (lambda generator: text_page(generator, lines=8), count(400)),
+        "large_format": (lambda generator: color_page(generator, size=a0), count(4)),
+    }
+
+
+def make_pdf(name, builder, page_count, directory):
+    """Writes the synthetic document unless an identical one already exists and returns its path."""
+    path = os.path.join(directory, f"{name}_{page_count}.pdf")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        generator = random.Random(f"{name}-{page_count}")
+        data = pdf_bytes([builder(generator) for _ in range(page_count)], name)
+        with open(path + ".tmp", "wb") as file:
+            file.write(data)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def current_rss():
+    """Resident memory of this process in bytes, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def max_rss(who):
+    """Peak resident memory in bytes of this process ("self") or its largest finished child ("children")."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN).ru_maxrss
+    # getrusage reports kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageSampler:
+    """Samples memory use and the size of a workspace while a stage runs."""
+
+    def __init__(self, workspace):
+        self.workspace = workspace
+        self.peak_rss = current_rss()
+        self.peak_disk = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(sample_interval):
+            self.sample()
+
+    def sample(self):
+        rss = current_rss()
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, rss)
+        if self.workspace is not None:
+            self.peak_disk = max(self.peak_disk, directory_bytes(self.workspace))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+
+def time_stage(stages, name, pages, workspace, function, *args):
+    """Runs one stage and records its time, throughput, memory and temporary disk use."""
+    started = time.perf_counter()
+    with StageSampler(workspace) as sampler:
+        result = function(*args)
+    seconds = time.perf_counter() - started
+    stages[name] = {
+        "seconds": round(seconds, 4),
+        "pages_per_second": round(pages / seconds, 2) if seconds > 0 else None,
+        # Without /proc only the peak of the whole run is known
+        "peak_rss_bytes": sampler.peak_rss if sampler.peak_rss is not None else max_rss("self"),
+        "temp_disk_peak_bytes": sampler.peak_disk,
+    }
+    return result
+
+
+def unmeasured_pages(job, page_count):
+    """Returns {page: status} of the pages the job flagged or never reached ("missing")."""
+    statuses = dict(job.page_status)
+    return {page: statuses.get(page, "missing") for page in range(1, page_count + 1)
+            if statuses.get(page, "missing") in flagged_statuses + ("missing",)}
+
+
+def bench_document(pdf_path, mode, resolution=None):
+    """Times every coverage stage of one document.
+
+    Returns (pages, stages, job_metrics, backends, failures): the stage
+    measurements, the instrumentation of both jobs (Ghostscript, decode and
+    reduce times), the renderer each job used and a message for every stage
+    that did not measure all pages. Timings of a failed stage are not
+    comparable with a full run.
+    """
+    stages = {}
+    failures = []
+    pages = time_stage(stages, "get_pdf_page_count", 1, None, get_pdf_page_count, pdf_path)
+    stages["get_pdf_page_count"]["pages_per_second"] = None
+
+    # The tiff mode always renders with Ghostscript
+    backends = {"tiff": "ghostscript"}
+    job_metrics = {}
+    with CoverageJob(pdf_path, resolution, render_mode="tiff") as job:
+        workspace = job.workspace
+        try:
+            source, source_pages = pdf_path, None
+            if mode == "grayscale":
+                source, source_pages = time_stage(stages, "make_grayscale", pages, workspace, job.make_grayscale)
+                if not os.path.exists(source):
+                    raise RuntimeError("no grayscale PDF was written")
+            # split_page organizes the separations itself; time both steps apart
+            original_organize = job.organize_tiff
+            job.organize_tiff = lambda: None
+            try:
+                blank_pixels, file_weights = time_stage(
+                    stages, "split_page", pages, workspace, job.split_page, source, source_pages
+                )
+            finally:
+                job.organize_tiff = original_organize
+            unmeasured = unmeasured_pages(job, pages)
+            if unmeasured:
+                raise RuntimeError(f"pages not rendered: {unmeasured}")
+            time_stage(stages, "organize_tiff", pages, workspace, job.organize_tiff)
+            time_stage(stages, "calculate_all_color", pages, workspace, job.calculate_all_color,
+                       blank_pixels, file_weights)
+        except Exception as e:
+            failures.append(f"tiff: {e}")
+        job_metrics["tiff"] = job.metrics.snapshot()
+
+    with CoverageJob(pdf_path, resolution) as job:
+        backends["pipe"] = job.backend
+        try:
+            time_stage(stages, "stream_all_color", pages, None, job.stream_all_color, mode)
+            unmeasured = unmeasured_pages(job, pages)
+            if unmeasured:
+                raise RuntimeError(f"pages not rendered: {unmeasured}")
+        except Exception as e:
+            failures.append(f"pipe: {e}")
+        job_metrics["pipe"] = job.metrics.snapshot()
+    return pages, stages, job_metrics, backends, failures
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def find_regressions(result, previous_results):
+    """Compares a result with the latest stored one for the same document from another revision.
+
+    Only complete runs with the same renderers are compared; failed runs are
+    never used as the baseline.
+    """
+    if result.get("failures"):
+        return []
+    previous = next(
+        (
+            old for old in reversed(previous_results)
+            if old["document"] == result["document"] and old["mode"] == result["mode"]
+            and old["resolution"] == result["resolution"] and old["revision"] != result["revision"]
+            and old.get("backends") == result["backends"] and not old.get("failures")
+        ),
+        None,
+    )
+    if previous is None:
+        return []
+    regressions = []
+    for stage, measurements in result["stages"].items():
+        old = previous["stages"].get(stage)
+        if old is None:
+            continue
+        slowdown = measurements["seconds"] - old["seconds"]
+        if measurements["seconds"] > old["seconds"] * regression_threshold and slowdown > regression_min_seconds:
+            regressions.append(
+                f"{result['document']} {stage}: {old['seconds']:.3f}s -> {measurements['seconds']:.3f}s "
+                f"(revision {previous['revision']} -> {result['revision']})"
+            )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark coverage stages on synthetic PDFs.")
+    parser.add_argument("--documents", nargs="+", help="documents to run (default: all)")
+    parser.add_argument("--mode", choices=["color", "grayscale"], default="color")
+    parser.add_argument("--resolution", type=int, help="render resolution in dpi")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the page count of every document")
+    parser.add_argument("--pdf-dir", default=pdf_dir)
+    parser.add_argument("--output", default=results_file, help="JSON Lines file the results are appended to")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logger()
+    # Pages must be rendered on every run, not read back from a previous one
+    main_module.use_page_store = False
+    documents = synthetic_documents(args.scale)
+    names = args.documents or list(documents)
+    unknown = [name for name in names if name not in documents]
+    if unknown:
+        print(f"Unknown documents: {', '.join(unknown)} (choose from {', '.join(documents)})", file=sys.stderr)
+        return 2
+
+    previous_results = load_results(args.output)
+    revision = git_revision()
+    regressions = []
+    failed = []
+    for name in names:
+        builder, page_count = documents[name]
+        pdf_path = make_pdf(name, builder, page_count, args.pdf_dir)
+        logger.info(f"Benchmarking {pdf_path}")
+        pages, stages, job_metrics, backends, failures = bench_document(pdf_path, args.mode, args.resolution)
+        result = {
+            "document": name, "pages": pages, "file_bytes": os.path.getsize(pdf_path),
+            "mode": args.mode, "resolution": args.resolution, "revision": revision,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "children_peak_rss_bytes": max_rss("children"),
+            "backends": backends, "failures": failures, "stages": stages, "job_metrics": job_metrics,
+        }
+        with open(args.output, "a") as file:
+            file.write(json.dumps(result) + "\n")
+        regressions.extend(find_regressions(result, previous_results))
+
+        print(f"{name} ({pages} pages, pipe backend {backends['pipe']})")
+        for stage, measurements in stages.items():
+            rate = measurements["pages_per_second"]
+            rss = measurements["peak_rss_bytes"]
+            print(
+                f"  {stage:<20} {measurements['seconds']:>9.3f}s "
+                f"{(f'{rate:.1f} pages/s' if rate else ''):>16} "
+                f"{(f'{rss / 2 ** 20:.0f} MB RSS' if rss else ''):>12} "
+                f"{measurements['temp_disk_peak_bytes'] / 2 ** 20:>9.1f} MB temp"
+            )
+        for failure in failures:
+            print(f"  FAILED {failure}")
+            failed.append(f"{name} {failure}")
+
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    if failed:
+        print(f"{len(failed)} failed stages; their results are not used as a baseline", file=sys.stderr)
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
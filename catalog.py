@@ -0,0 +1,263 @@
+"""Printer and paper catalog in SQLite: atomic updates, indexed lookups and change notification.
+
+Every change is one transaction, so readers in other processes never see a
+half-written catalog. Each Catalog keeps an in-memory view of the printers
+and papers in the printers.json / papers.json format the pricing code
+uses, and rebuilds it only after a change. Changes made through the same
+Catalog notify its listeners at once; poll() notices commits of other
+processes through PRAGMA data_version without reading the tables.
+
+A new catalog starts with the contents of printers.json and papers.json
+when they exist; export_json writes the same files back. The GUI, batch,
+the service and the cost engine all read the catalog, so an edit in one
+reaches the others without going through the JSON files.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from pricing import load_papers, load_printers, papers_file, printers_file
+
+logger = logging.getLogger('GhostscriptLogger')
+
+catalog_path = "catalog.db"
+
+schema = """
+CREATE TABLE IF NOT EXISTS printers (name TEXT PRIMARY KEY, is_color INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS printers_by_color ON printers (is_color, name);
+CREATE TABLE IF NOT EXISTS inks (
+    printer TEXT NOT NULL REFERENCES printers (name) ON DELETE CASCADE, color TEXT NOT NULL,
+    price REAL NOT NULL, yield INTEGER NOT NULL, PRIMARY KEY (printer, color)
+);
+CREATE INDEX IF NOT EXISTS inks_by_color ON inks (color, yield, printer);
+CREATE TABLE IF NOT EXISTS papers (size TEXT PRIMARY KEY, price REAL NOT NULL);
+"""
+# PRAGMA user_version of a catalog that has been filled from the JSON files once
+seeded_version = 1
+
+
+class Catalog:
+    """Printers and paper prices of one catalog file, shared by every tab and thread of a process."""
+
+    def __init__(self, path=None):
+        self.path = path or catalog_path
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.executescript(schema)
+        self._listeners = []
+        self._data_version = self._read_data_version()
+        self._printers = None
+        self._papers = None
+        # Only a new catalog is filled from the JSON files; one emptied later stays empty
+        if self._connection.execute("PRAGMA user_version").fetchone()[0] < seeded_version:
+            if self.is_empty():
+                self.import_json(printers_file, papers_file)
+            self._connection.execute(f"PRAGMA user_version = {seeded_version}")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _read_data_version(self):
+        return self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def transaction(self, changes):
+        """Runs changes(connection) in one write transaction; if it changed rows, refreshes the view and notifies listeners."""
+        with self._lock:
+            before = self._connection.total_changes
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = changes(self._connection)
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+            changed = self._connection.total_changes != before
+            if changed:
+                self._printers = self._papers = None
+        if changed:
+            self._notify()
+        return result
+
+    # Listeners
+
+    def subscribe(self, listener):
+        """Calls listener(catalog) after every change, on the thread that made or polled it.
+
+        Returns a function that unsubscribes the listener.
+        """
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
+
+    def poll(self):
+        """Notifies listeners if another process changed the catalog; returns True when it did."""
+        with self._lock:
+            version = self._read_data_version()
+            if version == self._data_version:
+                return False
+            self._data_version = version
+            self._printers = self._papers = None
+        logger.info(f"Catalog {self.path} changed by another process")
+        self._notify()
+        return True
+
+    def _notify(self):
+        for listener in list(self._listeners):
+            try:
+                listener(self)
+            except Exception as e:
+                logger.error(f"Error in catalog listener: {e}")
+
+    # Reading
+
+    def is_empty(self):
+        with self._lock:
+            return not any(
+                self._connection.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone()
+                for table in ("printers", "papers")
+            )
+
+    def printers(self):
+        """Returns {name: {"is_color", "inks": {color: {"price", "yield"}}}} in name order.
+
+        The dict is the catalog's shared view; change printers through
+        put_printer and delete_printer, never by editing it.
+        """
+        with self._lock:
+            if self._printers is None:
+                printers = {
+                    name: {"is_color": bool(is_color), "inks": {}}
+                    for name, is_color in self._connection.execute(
+                        "SELECT name, is_color FROM printers ORDER BY name"
+                    )
+                }
+                for name, color, price, ink_yield in self._connection.execute(
+                    "SELECT printer, color, price, yield FROM inks"
+                ):
+                    printers[name]["inks"][color] = {"price": price, "yield": ink_yield}
+                self._printers = printers
+            return self._printers
+
+    def printer(self, name):
+        """Returns one printer in the printers() format, or None."""
+        return self.printers().get(name)
+
+    def printer_names(self, is_color=None):
+        """Returns printer names in order, only color (or only grayscale) printers when is_color is given."""
+        with self._lock:
+            if is_color is None:
+                rows = self._connection.execute("SELECT name FROM printers ORDER BY name")
+            else:
+                rows = self._connection.execute(
+                    "SELECT name FROM printers WHERE is_color = ? ORDER BY name", (int(is_color),)
+                )
+            return [name for (name,) in rows]
+
+    def printers_with_ink(self, color):
+        """Returns the names of the printers that have a cartridge of the color (a yield above zero)."""
+        with self._lock:
+            return [
+                name for (name,) in self._connection.execute(
+                    "SELECT printer FROM inks WHERE color = ? AND yield > 0 ORDER BY printer", (color,)
+                )
+            ]
+
+    def papers(self):
+        """Returns {paper size: price per sheet}; the same shared view rules as printers() apply."""
+        with self._lock:
+            if self._papers is None:
+                self._papers = dict(self._connection.execute("SELECT size, price FROM papers ORDER BY size"))
+            return self._papers
+
+    # Writing
+
+    def put_printer(self, name, is_color, inks):
+        """Adds or replaces a printer; inks is {color: {"price", "yield"}}."""
+        def changes(connection):
+            connection.execute(
+                "INSERT INTO printers (name, is_color) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET is_color = excluded.is_color",
+                (name, int(bool(is_color))),
+            )
+            connection.execute("DELETE FROM inks WHERE printer = ?", (name,))
+            connection.executemany(
+                "INSERT INTO inks (printer, color, price, yield) VALUES (?, ?, ?, ?)",
+                [(name, color, info.get("price") or 0, info.get("yield") or 0) for color, info in inks.items()],
+            )
+        self.transaction(changes)
+
+    def add_printer(self, name, is_color, inks):
+        """Adds a printer; returns False, changing nothing, when the name is taken."""
+        def changes(connection):
+            if connection.execute("SELECT 1 FROM printers WHERE name = ?", (name,)).fetchone():
+                return False
+            connection.execute("INSERT INTO printers (name, is_color) VALUES (?, ?)", (name, int(bool(is_color))))
+            connection.executemany(
+                "INSERT INTO inks (printer, color, price, yield) VALUES (?, ?, ?, ?)",
+                [(name, color, info.get("price") or 0, info.get("yield") or 0) for color, info in inks.items()],
+            )
+            return True
+        return self.transaction(changes)
+
+    def delete_printer(self, name):
+        self.transaction(lambda connection: connection.execute("DELETE FROM printers WHERE name = ?", (name,)))
+
+    def set_paper_prices(self, prices):
+        """Sets the price of each {paper size: price} at once."""
+        self.transaction(lambda connection: connection.executemany(
+            "INSERT INTO papers (size, price) VALUES (?, ?) ON CONFLICT (size) DO UPDATE SET price = excluded.price",
+            list(prices.items()),
+        ))
+
+    # JSON import and export
+
+    def import_json(self, printers_path=None, papers_path=None, replace=True):
+        """Loads printers.json / papers.json style files in one transaction.
+
+        With replace, printers and papers missing from a file are removed;
+        a path of a file that does not exist is skipped.
+        """
+        printers = load_printers(printers_path) if printers_path and os.path.exists(printers_path) else None
+        papers = load_papers(papers_path) if papers_path and os.path.exists(papers_path) else None
+        if printers is None and papers is None:
+            return
+
+        def changes(connection):
+            if printers is not None:
+                if replace:
+                    connection.execute("DELETE FROM printers")
+                for name, info in printers.items():
+                    connection.execute(
+                        "INSERT INTO printers (name, is_color) VALUES (?, ?) "
+                        "ON CONFLICT (name) DO UPDATE SET is_color = excluded.is_color",
+                        (name, int(bool(info.get("is_color")))),
+                    )
+                    connection.execute("DELETE FROM inks WHERE printer = ?", (name,))
+                    connection.executemany(
+                        "INSERT INTO inks (printer, color, price, yield) VALUES (?, ?, ?, ?)",
+                        [(name, color, ink.get("price") or 0, ink.get("yield") or 0)
+                         for color, ink in (info.get("inks") or {}).items()],
+                    )
+            if papers is not None:
+                if replace:
+                    connection.execute("DELETE FROM papers")
+                connection.executemany(
+                    "INSERT INTO papers (size, price) VALUES (?, ?) ON CONFLICT (size) DO UPDATE SET price = excluded.price",
+                    list(papers.items()),
+                )
+        self.transaction(changes)
+        logger.info(f"Catalog {self.path} imported from {printers_path} and {papers_path}")
+
+    def export_json(self, printers_path=None, papers_path=None):
+        """Writes the catalog as printers.json / papers.json style files, each replaced atomically."""
+        for path, value in ((printers_path, self.printers()), (papers_path, self.papers())):
+            if not path:
+                continue
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as file:
+                json.dump(value, file, indent=4)
+            os.replace(temp_path, path)
@@ -0,0 +1,223 @@
+"""Batched what-if costing: every printer, mode, side setting, page range and copy count at once.
+
+Ink prices and yields become a printers × channels matrix of cost per rated
+page, and the per-page coverage of a document a pages × channels matrix, so
+a whole grid of scenarios is a few matrix products instead of Python loops
+over printers and colors. Coverage is measured once per mode and reused for
+every scenario.
+
+Example:
+    python cost_engine.py order.pdf --printers office.json shop.json --copies 1 50 1000 --ranges 1-4 5-
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from catalog import Catalog
+from main import CoverageJob, color_channels, page_area_weights, setup_logger
+from document_index import document_index
+from pricing import document_paper_cost, load_printers, unpriced_sizes, yield_coverage
+
+modes = ("color", "grayscale")
+
+
+def printer_matrix(printers, channels=None):
+    """Returns (names, cost_per_rated_page, is_color) for the printers.
+
+    cost_per_rated_page is a printers × channels array of ink price / yield,
+    zero where a printer has no such ink or no yield, as in pricing.ink_cost.
+    """
+    channels = channels or color_channels
+    names = list(printers)
+    prices = np.array(
+        [[(info["inks"].get(color) or {}).get("price", 0) for color in channels] for info in printers.values()],
+        dtype=np.float64,
+    ).reshape(len(names), len(channels))
+    yields = np.array(
+        [[(info["inks"].get(color) or {}).get("yield", 0) for color in channels] for info in printers.values()],
+        dtype=np.float64,
+    ).reshape(len(names), len(channels))
+    cost = np.divide(prices, yields, out=np.zeros_like(prices), where=yields > 0)
+    is_color = np.array([bool(info["is_color"]) for info in printers.values()], dtype=bool)
+    return names, cost, is_color
+
+
+def range_matrix(page_ranges, page_count):
+    """Returns a ranges × pages 0/1 array selecting the pages of each (first, last) range.
+
+    Pages are 1-based and inclusive; last None means the end of the document.
+    """
+    selection = np.zeros((len(page_ranges), page_count), dtype=np.float64)
+    for index, (first, last) in enumerate(page_ranges):
+        last = page_count if last is None else min(last, page_count)
+        selection[index, max(first, 1) - 1:last] = 1
+    return selection
+
+
+class CostTable:
+    """Costs of a grid of scenarios, indexed [mode, double_sided, range, copies, printer].
+
+    ink, paper and total hold the cost of all copies. Printers that cannot
+    print a mode (grayscale printers for color) are NaN.
+    """
+
+    def __init__(self, modes, double_sided, page_ranges, copies, printers, pages, ink, paper):
+        self.modes = list(modes)
+        self.double_sided = list(double_sided)
+        self.page_ranges = list(page_ranges)
+        self.copies = list(copies)
+        self.printers = list(printers)
+        self.pages = pages
+        self.ink = ink
+        self.paper = paper
+        self.total = ink + paper
+
+    def rows(self):
+        """Yields one dict per scenario, skipping printers that cannot print the mode."""
+        for index in np.ndindex(self.total.shape):
+            mode, side, page_range, copies, printer = index
+            if np.isnan(self.total[index]):
+                continue
+            first, last = self.page_ranges[page_range]
+            yield {
+                "mode": self.modes[mode], "double_sided": self.double_sided[side],
+                "first_page": first, "last_page": last, "pages": int(self.pages[page_range]),
+                "copies": self.copies[copies], "printer": self.printers[printer],
+                "ink_cost": round(float(self.ink[index]), 4), "paper_cost": round(float(self.paper[index]), 4),
+                "total_cost": round(float(self.total[index]), 4),
+            }
+
+    def cheapest(self):
+        """Returns the cheapest printer name for every scenario as a [mode, side, range, copies] array."""
+        best = np.full(self.total.shape[:-1], None, dtype=object)
+        printable = ~np.all(np.isnan(self.total), axis=-1)
+        choice = np.argmin(np.where(np.isnan(self.total), np.inf, self.total), axis=-1)
+        best[printable] = np.array(self.printers, dtype=object)[choice[printable]]
+        return best
+
+
+def evaluate_costs(printers, page_coverage, papers, page_ranges=None, copies=(1,),
+                   double_sided=(False, True), paper_size=None, page_weights=None, page_sizes=None):
+    """Prices every combination of mode, side setting, page range, copy count and printer.
+
+    page_coverage maps each mode to its pages × channels coverage array in
+    percent (CoverageJob.page_coverage). page_weights (page_area_weights)
+    scale each page by its area so the whole document matches
+    calculate_color_coverage. page_sizes (DocumentIndex.page_sizes) prices
+    every page on its own paper; without it all pages use paper_size (A4
+    by default). A given paper_size also prices pages whose size has no
+    price; otherwise their sheets are left out (pricing.unpriced_sizes).
+    page_ranges are (first, last) pairs, the whole document by default.
+    Copies are printed one after another, so duplex sheets are rounded up
+    per copy.
+    """
+    names, cost_per_page, is_color = printer_matrix(printers)
+    mode_names = [mode for mode in modes if mode in page_coverage]
+    coverage = np.stack([np.asarray(page_coverage[mode], dtype=np.float64) for mode in mode_names])
+    page_count = coverage.shape[1]
+    page_ranges = list(page_ranges or [(1, page_count)])
+    selection = range_matrix(page_ranges, page_count)
+    weights = np.ones(page_count) if page_weights is None else np.asarray(page_weights, dtype=np.float64)
+    copies = np.asarray(copies, dtype=np.float64)
+    sides = np.asarray(double_sided, dtype=bool)
+
+    # [mode, range, channel] ink in rated pages for one copy, then [mode, range, printer] cost
+    usage = np.einsum("rp,p,mpc->mrc", selection, weights, coverage) / yield_coverage
+    ink = usage @ cost_per_page.T
+    # Grayscale printers cannot print color jobs
+    printable = np.array([is_color if mode == "color" else np.ones_like(is_color) for mode in mode_names])
+    ink = np.where(printable[:, None, :], ink, np.nan)
+
+    pages = selection.sum(axis=1)
+    # Paper depends only on the range and side setting, so it is priced once per pair
+    page_sizes = list(page_sizes) if page_sizes is not None else [paper_size or "A4"] * page_count
+    paper = np.array([
+        [
+            document_paper_cost([page_sizes[page] for page in np.flatnonzero(row)], papers, side, paper_size)
+            for row in selection
+        ]
+        for side in sides.tolist()
+    ]).reshape(len(sides), len(page_ranges))
+
+    shape = (len(mode_names), len(sides), len(page_ranges), len(copies), len(names))
+    ink_total = np.broadcast_to(ink[:, None, :, None, :] * copies[None, None, None, :, None], shape)
+    paper_total = np.broadcast_to(paper[None, :, :, None, None] * copies[None, None, None, :, None], shape)
+    # Keep NaN for printers that cannot print the mode in the paper cost too
+    paper_total = np.where(np.isnan(ink_total), np.nan, paper_total)
+    return CostTable(mode_names, sides.tolist(), page_ranges, copies.astype(int).tolist(), names, pages,
+                     ink_total, paper_total)
+
+
+def load_printer_configs(paths):
+    """Merges printer files; with several files, names are prefixed with the file name."""
+    if len(paths) == 1:
+        return load_printers(paths[0])
+    printers = {}
+    for path in paths:
+        prefix = os.path.splitext(os.path.basename(path))[0]
+        for name, info in load_printers(path).items():
+            printers[f"{prefix}:{name}"] = info
+    return printers
+
+
+def parse_range(text):
+    """Parses a page range such as 3, 1-4 or 5- into (first, last)."""
+    first, dash, last = text.partition("-")
+    if not dash:
+        return int(first), int(first)
+    return int(first or 1), int(last) if last else None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare printing costs across printers and scenarios.")
+    parser.add_argument("pdf", help="PDF file to cost")
+    parser.add_argument("--catalog", help="printer and paper catalog (default: catalog.db)")
+    parser.add_argument("--printers", nargs="+", help="compare the printers of these JSON files instead of the catalog's")
+    parser.add_argument("--papers", help="import the paper prices of this JSON file into the catalog first")
+    parser.add_argument("--paper-size", help="price pages of unknown or unpriced size as this paper "
+                                             "(default: leave them out and report them)")
+    parser.add_argument("--modes", nargs="+", choices=modes, default=list(modes))
+    parser.add_argument("--copies", nargs="+", type=int, default=[1])
+    parser.add_argument("--ranges", nargs="+", type=parse_range, help="page ranges such as 1-4 or 5- (default: all)")
+    parser.add_argument("--resolution", type=int, help="render resolution in dpi")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logger()
+    page_coverage = {}
+    flagged = {}
+    with CoverageJob(args.pdf, args.resolution) as job:
+        for mode in args.modes:
+            page_coverage[mode] = job.page_coverage(mode)
+            if job.flagged_pages():
+                flagged[mode] = job.flagged_pages()
+    for mode, pages in flagged.items():
+        print(f"{len(pages)} pages could not be measured in {mode} and are priced at the average coverage: "
+              f"{json.dumps(pages)}", file=sys.stderr)
+    catalog = Catalog(args.catalog)
+    if args.papers:
+        catalog.import_json(papers_path=args.papers)
+    printers = load_printer_configs(args.printers) if args.printers else catalog.printers()
+    papers = catalog.papers()
+    catalog.close()
+    page_sizes = document_index(args.pdf).page_sizes()
+    unpriced = unpriced_sizes(page_sizes, papers, args.paper_size)
+    if unpriced:
+        print(f"No paper price for {', '.join(unpriced)}; those sheets are not in paper_cost", file=sys.stderr)
+    table = evaluate_costs(
+        printers, page_coverage, papers,
+        args.ranges, args.copies, paper_size=args.paper_size, page_weights=page_area_weights(args.pdf),
+        page_sizes=page_sizes,
+    )
+    for row in table.rows():
+        print(json.dumps(row))
+    return 1 if flagged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('GhostscriptLogger')
+
+
+def hash_file(pdf_path, block_size=1 << 20):
+    """Returns the sha256 hex digest of the file content."""
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CoverageCache:
+    """Coverage results keyed by PDF content hash, color mode and render settings.
+
+    Entries live in an in-memory LRU and are persisted as small JSON files in
+    cache_dir. The directory is kept under max_bytes by removing the least
+    recently used files (a hit refreshes the file's mtime).
+    """
+
+    def __init__(self, cache_dir, max_bytes=16 * 1024 * 1024, max_memory_entries=256):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, pdf_path, mode, settings):
+        """Builds the cache key for a PDF file, color mode and render settings."""
+        settings_text = json.dumps(settings, sort_keys=True)
+        raw = f"{hash_file(pdf_path)}|{mode}|{settings_text}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Returns a copy of the cached coverage or None if it is not cached."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return json.loads(self._memory[key])
+
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, "r") as f:
+                text = f.read()
+            value = json.loads(text)
+            # Touch the entry so eviction sees it as recently used
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            return None
+
+        self._remember(key, text)
+        return value
+
+    def put(self, key, value):
+        """Stores coverage in memory and on disk, then evicts old entries."""
+        text = json.dumps(value)
+        self._remember(key, text)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            entry_path = self._entry_path(key)
+            temp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w") as f:
+                f.write(text)
+            os.replace(temp_path, entry_path)
+            self._evict()
+        except OSError as e:
+            logger.error(f"Error writing coverage cache entry {key}: {e}")
+
+    def clear(self):
+        """Removes every entry from memory and disk."""
+        with self._lock:
+            self._memory.clear()
+        for path, _, _ in self._disk_entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _remember(self, key, text):
+        with self._lock:
+            self._memory[key] = text
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _evict(self):
+        entries = self._disk_entries()
+        total = sum(size for _, _, size in entries)
+        # Oldest first
+        for path, _, size in sorted(entries, key=lambda entry: entry[1]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,149 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+import pypdf
+
+from page_analysis import find_blank_pages, page_fingerprints
+
+# Paper sizes in millimetres (portrait); PaperTab prices them by these names
+paper_sizes = {
+    "A0": (841, 1189),
+    "A1": (594, 841),
+    "A2": (420, 594),
+    "A3": (297, 420),
+    "A4": (210, 297),
+    "A5": (148, 210),
+    "A6": (105, 148),
+    "Letter": (215.9, 279.4),
+    "Legal": (215.9, 355.6),
+}
+# A page within this many millimetres of a paper size is printed on it
+size_tolerance_mm = 3
+# Documents whose index is kept in memory
+max_indexed_documents = 16
+points_per_mm = 72 / 25.4
+# One page of a document: boxes in points, paper_size from the TrimBox (None when nothing fits)
+PageInfo = namedtuple("PageInfo", ["number", "media_width", "media_height", "trim_width", "trim_height", "paper_size"])
+
+
+def paper_size_name(width, height):
+    """Returns the paper a page of width × height points is printed on.
+
+    A page that matches a known size (in either orientation) uses it; other
+    pages use the smallest known paper they fit on, or None if none is large
+    enough.
+    """
+    short, long = sorted((width / points_per_mm, height / points_per_mm))
+    for name, (paper_short, paper_long) in paper_sizes.items():
+        if abs(short - paper_short) <= size_tolerance_mm and abs(long - paper_long) <= size_tolerance_mm:
+            return name
+    fitting = [
+        (paper_short * paper_long, name) for name, (paper_short, paper_long) in paper_sizes.items()
+        if short <= paper_short + size_tolerance_mm and long <= paper_long + size_tolerance_mm
+    ]
+    return min(fitting)[1] if fitting else None
+
+
+class DocumentIndex:
+    """Page count, page boxes and paper sizes of a PDF, read with a single parse.
+
+    Only this metadata is kept, plus the blank flags and fingerprints of the
+    pages inspected so far; page content is inspected with a reader opened
+    for the call, so an index holds neither the file nor decoded streams.
+    """
+
+    def __init__(self, pdf_path):
+        self.pdf_path = pdf_path
+        # Guards the inspection results; jobs on the same PDF inspect one at a time
+        self.lock = threading.Lock()
+        self.pages = []
+        self._blank = {}
+        self._fingerprints = {}
+        with self.open_reader() as reader:
+            for number, page in enumerate(reader.pages, 1):
+                media_width, media_height = float(page.mediabox.width), float(page.mediabox.height)
+                # trimbox falls back to the CropBox and then the MediaBox when it is not set
+                trim_width, trim_height = float(page.trimbox.width), float(page.trimbox.height)
+                self.pages.append(PageInfo(
+                    number, media_width, media_height, trim_width, trim_height,
+                    paper_size_name(trim_width, trim_height),
+                ))
+
+    @contextmanager
+    def open_reader(self):
+        """Opens a reader over the file; the objects it parsed are released on exit."""
+        with open(self.pdf_path, "rb") as file:
+            reader = pypdf.PdfReader(file)
+            try:
+                yield reader
+            finally:
+                # Parsed objects refer back to the reader, so they would otherwise wait for the cycle collector
+                reader.resolved_objects.clear()
+
+    @property
+    def page_count(self):
+        return len(self.pages)
+
+    def page_sizes(self, pages=None):
+        """Returns the paper size of each page (all pages by default), in page order."""
+        numbers = range(1, self.page_count + 1) if pages is None else pages
+        return [self.pages[number - 1].paper_size for number in numbers]
+
+    def page_areas(self):
+        """Returns the MediaBox area of every page in square points."""
+        return [page.media_width * page.media_height for page in self.pages]
+
+    def pixel_count(self, page, resolution):
+        """Returns the number of pixels a renderer produces for the page's MediaBox at the resolution."""
+        info = self.pages[page - 1]
+        return round(info.media_width * resolution / 72) * round(info.media_height * resolution / 72)
+
+    def blank_pages(self, pages):
+        """Returns the set of blank pages among pages (see page_analysis.find_blank_pages)."""
+        with self.lock:
+            missing = [page for page in pages if page not in self._blank]
+            if missing:
+                with self.open_reader() as reader:
+                    blank = find_blank_pages(reader, missing)
+                self._blank.update((page, page in blank) for page in missing)
+            return {page for page in pages if self._blank[page]}
+
+    def fingerprints(self, pages):
+        """Returns {page: fingerprint} for the pages (see page_analysis.page_fingerprints)."""
+        with self.lock:
+            missing = [page for page in pages if page not in self._fingerprints]
+            if missing:
+                with self.open_reader() as reader:
+                    self._fingerprints.update(page_fingerprints(reader, missing))
+            return {page: self._fingerprints[page] for page in pages}
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def document_index(pdf_path):
+    """Returns the DocumentIndex of the PDF, parsing it only when the file is new or has changed."""
+    stat = os.stat(pdf_path)
+    key = (os.path.realpath(pdf_path), stat.st_mtime_ns, stat.st_size)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    index = DocumentIndex(pdf_path)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > max_indexed_documents:
+            _indexes.popitem(last=False)
+    return index
+
+
+def forget_document(pdf_path):
+    """Drops every index of the PDF, for files that are about to be removed."""
+    path = os.path.realpath(pdf_path)
+    with _indexes_lock:
+        for key in [key for key in _indexes if key[0] == path]:
+            del _indexes[key]
@@ -1,42 +1,131 @@
+import json
 import logging
+import logging.handlers
 import os
 import shutil
 import subprocess
-from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import threading
+import time
+import weakref
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
-import pypdf
-from PIL import Image
 
-split_path = r"images"
+from coverage_cache import CoverageCache
+from document_index import document_index
+from metrics import Metrics, count, timed
+from page_analysis import group_duplicate_pages
+from page_store import PageStore
+from raster import default_band_size, iter_raster_sums, tiff_ink_sum
+from render_backend import (
+    default_backend, find_ghostscript, rasterizer_band_bytes, rasterizer_pool,
+)
+from scheduler import iter_page_chunks, page_range_arguments, run_page_chunks
+
 # List of possible color channels in tiffsep output
 color_channels = ["Cyan", "Magenta", "Yellow", "Black"]
+# Ghostscript raster devices used by the pipe mode and the channels they produce
+pipe_devices = {
+    "color": ("pamcmyk32", color_channels),
+    "grayscale": ("pgmraw", ["Black"]),
+}
+# Worker processes that decode and reduce tiffsep files (None uses the CPU count)
+reduce_workers = None
+# Jobs with fewer separation files than this are reduced in-process
+process_pool_min_files = 16
+# Render resolution in dpi (72 is Ghostscript's default for the raster devices)
+default_resolution = 72
+# Quick estimates render at a low resolution and optionally only a sample of the pages
+estimate_resolution = 18
+estimate_sample_pages = 16
+# Pages that would render without ink get zero coverage without a Ghostscript call
+skip_blank_pages = True
+# Identical pages are rendered once and their coverage is reused for every copy
+deduplicate_pages = True
+# Log file of the entry points (see setup_logger); spool workers log to log.txt.worker-<pid>
 log_file = r"log.txt"
+# The log is appended to across runs and rotated to log.txt.1, log.txt.2, ... at this size
+log_max_bytes = 5 * 1024 * 1024
+log_backups = 3
+# Coverage of one page in percent, as yielded by iter_page_coverage
+PageCoverage = namedtuple("PageCoverage", ["page", "cyan", "magenta", "yellow", "black"])
+# Which pages to render: blank is [(page, pixel_count)], duplicates maps a rendered page to its copies,
+# fingerprints maps every non-blank page to its content fingerprint (None when it has none)
+PagePlan = namedtuple("PagePlan", ["render", "blank", "duplicates", "fingerprints"])
+# Coverage results are cached per PDF content, mode and render settings
+cache_path = r"coverage_cache"
+# Per-page render results are kept by page fingerprint, so revised documents only render changed pages
+use_page_store = True
+page_store_path = r"page_store.db"
+page_store_max_entries = 100000
+# "pipe" streams CMYK rasters from Ghostscript straight into the reduction,
+# "tiff" writes tiffsep separations to the job workspace and reads them back
+default_render_mode = "pipe"
+# Job workspaces are created here (None uses the system temporary directory)
+workspace_root = None
+# Ghostscript renders pages whose bitmap is larger than ghostscript_max_bitmap in bands
+# through a ghostscript_buffer_space band buffer, so large-format pages use bounded memory
+ghostscript_max_bitmap = 64 * 1024 * 1024
+ghostscript_buffer_space = 16 * 1024 * 1024
+# A spool.Spool to hand the pipe mode's page ranges to worker processes (None renders here)
+default_spool = None
+# Time budgets in seconds (None disables them): a page range may render for page_timeout
+# per page and a whole measurement for job_timeout. A page that runs out of time is retried
+# on its own at retry_resolution_factor of the resolution, down to min_retry_resolution
+page_timeout = 120
+job_timeout = 1800
+retry_resolution_factor = 0.5
+min_retry_resolution = 18
+# Statuses in CoverageJob.page_status; pages that end "failed" or "timeout" have no coverage of
+# their own, so the document totals count them at the average coverage of the measured pages with
+# ink (blank pages left out). Results with such pages are not cached, and a document where no page
+# with ink was measured raises NoPagesMeasured
+page_statuses = ("ok", "blank", "stored", "reduced", "failed", "timeout")
+measured_statuses = ("ok", "stored", "reduced")
+flagged_statuses = ("failed", "timeout")
+# Renderer of the pipe mode: "ghostscript" or the in-process "pymupdf" rasterizer
+# (None uses Ghostscript when it is installed); the tiff mode always uses Ghostscript
+default_render_backend = None
 
-def setup_logger():
-    if os.path.exists(log_file):
-        os.remove(log_file)
-    with open(log_file, "a") as f:
-        f.write("file is Created\n")
+def setup_logger(path=None):
+    """Adds the rotating log file (log_file unless path is given) to the logger.
 
+    Only entry points call this, so worker processes that import this module
+    never rotate a log file another process writes to.
+    """
     logger_new = logging.getLogger('GhostscriptLogger')
     logger_new.setLevel(logging.INFO)
 
-    # File handler for logging
-    handler = logging.FileHandler(log_file, mode='a')
+    # File handler for logging; earlier runs are kept, not deleted
+    handler = logging.handlers.RotatingFileHandler(path or log_file, maxBytes=log_max_bytes,
+                                                   backupCount=log_backups)
     handler.setLevel(logging.INFO)
 
     # Formatter for the logs
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     handler.setFormatter(formatter)
-    logger_new.info("logger started")
 
     # Add handler to logger
     if not logger_new.hasHandlers():
         logger_new.addHandler(handler)
+    logger_new.info("logger started")
 
     return logger_new
-logger = setup_logger()
+logger = logging.getLogger('GhostscriptLogger')
+logger.setLevel(logging.INFO)
+coverage_cache = CoverageCache(cache_path)
+page_store = PageStore(page_store_path, page_store_max_entries)
+
+class JobCancelled(Exception):
+    """Raised by a CoverageJob that was cancelled while it was running."""
+
+class RenderTimeout(Exception):
+    """Raised when a renderer runs past its time budget and was stopped."""
+
+class NoPagesMeasured(Exception):
+    """Raised when pages could not be measured and no page with ink was, so there is no coverage to quote."""
 
 def clear_path(path_clear):
     # remove the whole Dictionary
@@ -45,104 +134,227 @@ def clear_path(path_clear):
     # make the Dictionary in the place with same name
     os.mkdir(path_clear)
 
-def organize_tiff():
-    # Create color-specific folders and move files
-    for color in color_channels:
-        # Create a directory for each color if it doesn’t already exist
-        color_folder = os.path.join(split_path, color)
-        os.makedirs(color_folder, exist_ok=True)
-
-        # Move files that match the color channel to the respective folder
-        for file_name in os.listdir(split_path):
-            if color in file_name:
-                shutil.move(os.path.join(split_path, file_name), color_folder)
-
-def split_page(pdf_path):
-    """Splits each page of the PDF into separate color-separated images."""
-    # Clear the dictionary for storing images
-    clear_path(split_path)
-    logger.info(f"Started splitting for {pdf_path}")
-    try:
-        # Get the total number of pages
-        page_count = get_pdf_page_count(pdf_path)
-        # Use parallel processing to run Ghostscript for each page
-        with ThreadPoolExecutor() as executor:
-            futures = [executor.submit(split_single_page, pdf_path, page) for page in range(1, page_count + 1)]
-            for future in futures:
-                future.result()  # Ensure all tasks complete
-        logger.info("Split Tiffs successfully created")
-    except Exception as e:
-        logger.error(f"Error splitting pdf {pdf_path}: {e}")
-    finally:
-        # Organize the TIFF files into separate folders by color
-        organize_tiff()
-        logger.info("Split completed and organized successfully.")
-
 def get_pdf_page_count(pdf_path):
-    """Returns the number of pages in the PDF."""
-    pdf_reader = pypdf.PdfReader(pdf_path)
-    return len(pdf_reader.pages)
+    """Returns the number of pages in the PDF; the file is only parsed once (see document_index)."""
+    return document_index(pdf_path).page_count
+
+def job_metrics(job):
+    """Returns the Metrics of the job, or None when work runs outside a CoverageJob."""
+    return job.metrics if job is not None else None
+
+def plan_pages(pdf_path, resolution=None, pages=None, metrics=None):
+    """Returns a PagePlan that leaves blank pages and copies of identical pages out of rendering."""
+    index = document_index(pdf_path)
+    if pages is None:
+        pages = range(1, index.page_count + 1)
+    pages = list(pages)
+
+    blank_pages = []
+    if skip_blank_pages:
+        blank = index.blank_pages(pages)
+        if blank:
+            logger.info(f"Skipping {len(blank)} blank pages of {len(pages)} in {pdf_path}")
+        resolution = resolution or default_resolution
+        blank_pages = [(page, index.pixel_count(page, resolution)) for page in sorted(blank)]
+        pages = [page for page in pages if page not in blank]
+
+    fingerprints = {}
+    if deduplicate_pages or use_page_store:
+        fingerprints = index.fingerprints(pages)
+    duplicates = {}
+    if deduplicate_pages and len(pages) > 1:
+        groups = group_duplicate_pages(pages, fingerprints)
+        duplicates = {page: copies for page, copies in groups.items() if copies}
+        logger.info(f"Deduplicated {len(pages)} pages of {pdf_path} to {len(groups)} unique pages to render "
+                    f"(dedup ratio {len(pages) / len(groups):.2f}x)")
+        pages = sorted(groups)
+    count("pages_rendered", len(pages), metrics)
+    count("pages_blank", len(blank_pages), metrics)
+    count("pages_duplicate", sum(len(copies) for copies in duplicates.values()), metrics)
+    return PagePlan(pages, blank_pages, duplicates, fingerprints)
+
+def run_ghostscript(command, job=None, timeout=None):
+    """Runs a Ghostscript command to completion; the job can kill it while it runs.
 
-def split_single_page(pdf_path, page):
-    """Processes a single page by splitting it into color-separated TIFF images."""
-    command = fr'gswin64c -q -sDEVICE=tiffsep -dFirstPage={page} -dLastPage={page} -o {split_path}\p_{page}_%%c.tiff -f {pdf_path}'
+    A process still running after timeout seconds is killed and RenderTimeout raised.
+    """
+    with timed("ghostscript", job_metrics(job)), \
+            subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as process:
+        if job is not None:
+            job.track(process)
+        try:
+            returncode = process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            raise RenderTimeout(f"Ghostscript ran longer than {timeout:.0f}s")
+        finally:
+            if job is not None:
+                job.untrack(process)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
 
+def lower_resolution(resolution):
+    """Returns the resolution to retry a page that ran out of time at, or None below min_retry_resolution."""
+    lower = max(min_retry_resolution, int(resolution * retry_resolution_factor))
+    return lower if lower < resolution else None
+
+def ghostscript_memory_arguments():
+    """Ghostscript options that band large pages instead of allocating their whole bitmap."""
+    return [f"-dMaxBitmap={ghostscript_max_bitmap}", f"-dBufferSpace={ghostscript_buffer_space}"]
+
+def range_memory(pdf_path, pages, resolution, channels, cap):
+    """Estimates the raster bytes a renderer holds for a range of pages.
+
+    Pages are rendered one at a time, so this is the bitmap of the largest
+    page (from its MediaBox), at most cap once the renderer bands it.
+    """
+    index = document_index(pdf_path)
+    largest = max(index.pages[page - 1].media_width * index.pages[page - 1].media_height for page in pages)
+    return min(int(largest * (resolution / 72) ** 2 * channels), cap)
+
+def split_page_range(pdf_path, pages, output_dir, resolution=None, job=None):
+    """Splits a range of pages into color-separated TIFF images with a single Ghostscript process.
+
+    Returns the status of the range's pages: "ok", or "failed" or "timeout"
+    when no separations of the range were kept.
+    """
+    # %d is the page index inside this process, so prefix it with the first page of the range
+    output_path = os.path.join(output_dir, f"p_{pages[0]}_%d.tiff")
+    range_files = lambda: [
+        os.path.join(output_dir, file_name) for file_name in os.listdir(output_dir)
+        if file_name.startswith(f"p_{pages[0]}_")
+    ]
+    status = "ok"
     try:
-        # Execute the Ghostscript command and capture the output
-        os.system(command)
+        # Uncompressed separations are memory-mapped by tiff_ink_sum instead of decoded whole
+        command = ([find_ghostscript(), "-q", "-sDEVICE=tiffsep", "-sCompression=none",
+                    f"-r{resolution or default_resolution}"] + ghostscript_memory_arguments()
+                   + page_range_arguments(pages) + ["-o", output_path, "-f", pdf_path])
+        # Execute the Ghostscript command
+        run_ghostscript(command, job, job.range_timeout(len(pages)) if job is not None else None)
+        count("workspace_bytes", sum(os.path.getsize(path) for path in range_files()), job_metrics(job))
         # Log success after command completes
-        logger.info(f"Page {page} split into tiff successfully.")
-    except Exception as e:
+        logger.info(f"Pages {pages[0]}-{pages[-1]} split into tiff successfully.")
+    except (OSError, subprocess.CalledProcessError, RenderTimeout) as e:
         # Log any exceptions that occur
-        logger.error(f"Error processing page {page}: {e}")
-
-def calculate_all_color():
-    colo = {}
-    # process each color separately
-    for color in color_channels:
-        # use the calculate_coverage_for_color to get the average ink usage in all pages
-        colo.update({color: float(calculate_coverage_for_color(os.path.join(split_path, color)))})
-        logger.info(f"Color {color} calculated successfully with a coverage of {colo[color]}")
-    clear_path(split_path)
-    return colo
-
-def calculate_coverage_for_color(path_images):
-    total_intensity = 0
-    max_intensity = 0
-
-    for file_path in os.listdir(path_images):
-        with Image.open(os.path.join(path_images, file_path)) as img:
-            # Convert the image to a numpy array for efficient processing
-            img_data = np.array(img)
-            # Theoretical maximum intensity if all pixels were at maximum color (0 intensity)
-            max_intensity += img_data.size * 255
-            # Calculate the color intensity (inverse of pixel brightness)
-            total_intensity += np.sum(255 - img_data)  # 255 - pixel value gives "color intensity"
+        logger.error(f"Error processing pages {pages[0]}-{pages[-1]}: {e}")
+        status = "timeout" if isinstance(e, RenderTimeout) else "failed"
+        # Separations of a failed range may be partial, so none of them are counted
+        for path in range_files():
+            os.remove(path)
+    return status
 
+def reduce_tiff_files(paths, metrics=None):
+    """Returns (total_intensity, max_intensity) for each separation file, in the same order.
+
+    Large jobs are decoded and reduced in a process pool so the work is not
+    bound to one core; small jobs run in-process to skip the pool startup.
+    """
+    paths = list(paths)
+    workers = reduce_workers or os.cpu_count() or 1
+    with timed("reduce_tiff", metrics):
+        if workers == 1 or len(paths) < process_pool_min_files:
+            return [tiff_ink_sum(path) for path in paths]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(tiff_ink_sum, paths, chunksize=max(1, len(paths) // (workers * 4))))
+
+def format_coverage(total_intensity, max_intensity):
     # Calculate coverage as a percentage of the total intensity to max possible intensity
     # and format it into float number with 2 decimal place
     return "{:0.2f}".format((total_intensity / max_intensity) * 100 if max_intensity > 0 else 0)
 
-def convert_page_to_grayscale(pdf_path, page_number, output_dir):
-    """Converts a single page to grayscale and saves it as a separate PDF."""
-    temp_pdf_path = os.path.join(output_dir, f"page_{page_number}.pdf")
-    gs_command = [
-        "gswin64c", "-sDEVICE=pdfwrite", "-dNOPAUSE", "-dBATCH",
-        "-sColorConversionStrategy=Gray", "-dProcessColorModel=/DeviceGray",
-        "-dDownsampleColorImages=true", "-dColorImageResolution=600",
-        f"-dFirstPage={page_number}", f"-dLastPage={page_number}",
-        f"-sOutputFile={temp_pdf_path}", pdf_path
-    ]
+def iter_range_sums(pdf_path, pages, mode="color", resolution=None, job=None, timeout=None):
+    """Renders a range of pages to rasters on stdout and yields (page, channel_sums, pixel_count) per page.
+
+    Ghostscript is killed after timeout seconds and RenderTimeout raised;
+    pages finished before that have been yielded already.
+    """
+    device, _ = pipe_devices[mode]
+    command = ([find_ghostscript(), "-q", "-sstdout=%stderr", f"-sDEVICE={device}",
+                f"-r{resolution or default_resolution}"] + ghostscript_memory_arguments()
+               + page_range_arguments(pages) + ["-o", "-", "-f", pdf_path])
+    expired = threading.Event()
+
+    def expire(process):
+        expired.set()
+        process.kill()
 
+    with timed("ghostscript", job_metrics(job)), \
+            subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        if job is not None:
+            job.track(process)
+        timer = threading.Timer(timeout, expire, (process,)) if timeout is not None else None
+        if timer is not None:
+            timer.daemon = True
+            timer.start()
+        try:
+            # Ghostscript writes the selected pages in order, one raster per page
+            rasters = iter_raster_sums(process.stdout, metrics=job_metrics(job))
+            for page, (sums, pixels) in zip(pages, rasters):
+                yield page, sums, pixels
+        except (OSError, ValueError):
+            # A killed process leaves a truncated raster behind
+            if not expired.is_set():
+                raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if job is not None:
+                job.untrack(process)
+    if expired.is_set():
+        raise RenderTimeout(f"Ghostscript ran longer than {timeout:.0f}s")
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    logger.info(f"Pages {pages[0]}-{pages[-1]} rendered through pipe successfully.")
+
+def iter_range_sums_in_process(pdf_path, pages, mode="color", resolution=None, job=None, timeout=None):
+    """Renders a range of pages with the in-process rasterizer and yields (page, channel_sums, pixel_count).
+
+    timeout counts from when a rasterizer worker starts the range, not while
+    it waits for a free worker. Past it that worker is killed and
+    RenderTimeout raised; pages finished before that have been yielded already.
+    """
+    if job is not None and job.cancelled.is_set():
+        return
+    with timed("rasterize", job_metrics(job)):
+        try:
+            for result in rasterizer_pool().render(pdf_path, pages, mode, resolution or default_resolution, timeout):
+                yield result
+                # Leaving the range early stops its worker
+                if job is not None and job.cancelled.is_set():
+                    return
+        except TimeoutError as e:
+            raise RenderTimeout(str(e))
+    logger.info(f"Pages {pages[0]}-{pages[-1]} rendered in process successfully.")
+
+# Pipe mode renderers by backend name, all yielding (page, channel_sums, pixel_count) and raising
+# RenderTimeout or another exception when they fail; CoverageJob.render_pages handles both
+range_renderers = {
+    "ghostscript": iter_range_sums,
+    "pymupdf": iter_range_sums_in_process,
+}
+
+def convert_page_to_grayscale(pdf_path, pages, output_dir, job=None):
+    """Converts a range of pages to grayscale and saves them as a separate PDF."""
+    page_number = pages[0]
+    temp_pdf_path = os.path.join(output_dir, f"page_{page_number}.pdf")
     try:
-        subprocess.run(gs_command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        logger.info(f"Page {page_number} grayscale successfully.")
-        return page_number, temp_pdf_path  # Return the page number to keep track of order
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Error converting page {page_number} to grayscale: {e}")
+        gs_command = [
+            find_ghostscript(), "-sDEVICE=pdfwrite", "-dNOPAUSE", "-dBATCH",
+            "-sColorConversionStrategy=Gray", "-dProcessColorModel=/DeviceGray",
+            "-dDownsampleColorImages=true", "-dColorImageResolution=600",
+        ] + page_range_arguments(pages) + [f"-sOutputFile={temp_pdf_path}", pdf_path]
+        run_ghostscript(gs_command, job, job.range_timeout(len(pages)) if job is not None else None)
+        count("workspace_bytes", os.path.getsize(temp_pdf_path), job_metrics(job))
+        logger.info(f"Pages {page_number}-{pages[-1]} grayscale successfully.")
+        return page_number, temp_pdf_path  # Return the first page number to keep track of order
+    except (OSError, subprocess.CalledProcessError, RenderTimeout) as e:
+        logger.error(f"Error converting pages {page_number}-{pages[-1]} to grayscale: {e}")
+        if job is not None:
+            job.set_page_status(pages, "timeout" if isinstance(e, RenderTimeout) else "failed")
         return page_number, None
 
-def combine_pdfs(page_paths, output_pdf_path):
+def combine_pdfs(page_paths, output_pdf_path, job=None):
     """Combines all individual page PDFs into a single PDF."""
     try:
         valid_paths = [path_pdf for _, path_pdf in sorted(page_paths) if path_pdf is not None]
@@ -150,68 +362,703 @@ def combine_pdfs(page_paths, output_pdf_path):
             logger.error(f"No valid paths were found for page {page_paths}")
             return
 
-        gs_command = ["gswin64c", "-sDEVICE=pdfwrite", "-dNOPAUSE", "-dBATCH",
+        gs_command = [find_ghostscript(), "-sDEVICE=pdfwrite", "-dNOPAUSE", "-dBATCH",
                       "-sOutputFile=" + output_pdf_path] + valid_paths
-        subprocess.run(gs_command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        run_ghostscript(gs_command, job)
+        count("workspace_bytes", os.path.getsize(output_pdf_path), job_metrics(job))
         logger.info("page PDFs successfully combined.")
     except Exception as e:
         logger.error(f"Error combining page PDFs: {e}")
 
-def make_grayscale(pdf_path):
-    # Create output directory for temporary grayscale pages
-    output_dir = "grayscale_pages"
-    os.makedirs(output_dir, exist_ok=True)
+def sample_pages(page_count, sample_size):
+    """Returns up to sample_size pages spread evenly over the document."""
+    if not sample_size or sample_size >= page_count:
+        return list(range(1, page_count + 1))
+    step = page_count / sample_size
+    return sorted({int(index * step + step / 2) + 1 for index in range(sample_size)})
 
-    logger.info(f"Started grayscale conversion for {pdf_path}")
-    try:
-        # Get total number of pages using Ghostscript
-        total_pages = get_pdf_page_count(pdf_path)
+class CoverageJob:
+    """One coverage run over a PDF with its own settings and workspace.
+
+    Settings are copied from the module defaults when the job is created, so
+    jobs with different settings can run side by side in one process. Files
+    are only written by the tiff render mode and its pdfwrite grayscale round
+    trip; they go to a private temporary workspace that close() (or leaving
+    the with block) removes. The pipe render mode never creates a workspace.
+    cancel() may be called from another thread to stop a running job.
+    Rendering is bounded by page_timeout and job_timeout; page_status tells
+    which pages were measured and which could not be.
+    """
+
+    def __init__(self, pdf_path, resolution=None, render_mode=None, workspace_dir=None, backend=None, spool=None):
+        self.pdf_path = pdf_path
+        self.resolution = resolution or default_resolution
+        self.render_mode = render_mode or default_render_mode
+        self.backend = backend or default_render_backend or default_backend()
+        self.workspace_dir = workspace_dir or workspace_root
+        self.spool = spool or default_spool
+        self._workspace = None
+        self._cleanup = None
+        # Stage timings of this job; every stage is also added to metrics.registry
+        self.metrics = Metrics()
+        self.cancelled = threading.Event()
+        self._processes = set()
+        self._processes_lock = threading.Lock()
+        self.page_timeout = page_timeout
+        self.job_timeout = job_timeout
+        self.deadline = None
+        # Outcome of every page of the latest measurement, one of page_statuses
+        self.page_status = {}
+        self._status_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def workspace(self):
+        """Returns the job's private working directory, creating it on first use."""
+        if self._workspace is None:
+            self._workspace = tempfile.mkdtemp(prefix="pdf2printcost_", dir=self.workspace_dir)
+            # Removes the workspace even if close() is never called
+            self._cleanup = weakref.finalize(self, shutil.rmtree, self._workspace, True)
+        return self._workspace
+
+    @property
+    def split_path(self):
+        return os.path.join(self.workspace, "images")
+
+    def close(self):
+        """Removes the workspace and everything in it."""
+        if self._cleanup is not None:
+            self._cleanup()
+        self._workspace = None
+        self._cleanup = None
+
+    def track(self, process):
+        """Registers a running Ghostscript process so cancel() can kill it."""
+        with self._processes_lock:
+            self._processes.add(process)
+        if self.cancelled.is_set():
+            process.kill()
+
+    def untrack(self, process):
+        with self._processes_lock:
+            self._processes.discard(process)
+
+    def cancel(self):
+        """Stops the job: no new page ranges start, running Ghostscript processes are killed
+        and the workspace is removed right away."""
+        self.cancelled.set()
+        with self._processes_lock:
+            processes = list(self._processes)
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+        logger.info(f"Job for {self.pdf_path} cancelled, killed {len(processes)} Ghostscript processes")
+        self.close()
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise JobCancelled(self.pdf_path)
+
+    def start_clock(self):
+        """Starts the job's time budget on its first render; later calls keep the first deadline."""
+        if self.deadline is None and self.job_timeout is not None:
+            self.deadline = time.monotonic() + self.job_timeout
+
+    def range_timeout(self, page_count):
+        """Seconds a range of page_count pages may render for, within the page and job budgets (None is unlimited)."""
+        budgets = []
+        if self.page_timeout is not None:
+            budgets.append(self.page_timeout * page_count)
+        if self.deadline is not None:
+            budgets.append(max(0.0, self.deadline - time.monotonic()))
+        return min(budgets) if budgets else None
+
+    def set_page_status(self, pages, status):
+        """Records the status of pages; a page flagged by an earlier step stays flagged."""
+        with self._status_lock:
+            for page in pages:
+                if status == "ok" and self.page_status.get(page) in flagged_statuses:
+                    continue
+                self.page_status[page] = status
+        if status in ("reduced",) + flagged_statuses:
+            count(f"pages_{status}", len(pages), self.metrics)
+
+    def flagged_pages(self):
+        """Returns {page: status} of the pages that could not be measured."""
+        with self._status_lock:
+            return {page: status for page, status in sorted(self.page_status.items()) if status in flagged_statuses}
+
+    def check_measured(self):
+        """Raises NoPagesMeasured when pages could not be measured and no page with ink was,
+        so there is no average coverage to count them at."""
+        with self._status_lock:
+            statuses = dict(self.page_status)
+        flagged = {page: status for page, status in sorted(statuses.items()) if status in flagged_statuses}
+        if flagged and not any(status in measured_statuses for status in statuses.values()):
+            raise NoPagesMeasured(f"No page of {self.pdf_path} with ink could be measured: {flagged}")
+
+    def flagged_pixels(self, resolution=None):
+        """Returns the total pixel count of the flagged pages at the resolution (the job's by default)."""
+        index = document_index(self.pdf_path)
+        return sum(index.pixel_count(page, resolution or self.resolution) for page in self.flagged_pages())
+
+    def settings(self):
+        """Returns the render settings that change coverage results, used as part of the cache key."""
+        settings = {"render_mode": self.render_mode, "resolution": self.resolution}
+        if self.render_mode != "tiff":
+            settings["backend"] = self.backend
+        return settings
+
+    def organize_tiff(self):
+        # Create color-specific folders and move files
+        for color in color_channels:
+            # Create a directory for each color if it doesn’t already exist
+            color_folder = os.path.join(self.split_path, color)
+            os.makedirs(color_folder, exist_ok=True)
+
+            # Move files that match the color channel to the respective folder
+            for file_name in os.listdir(self.split_path):
+                if color in file_name:
+                    shutil.move(os.path.join(self.split_path, file_name), color_folder)
 
-        # Use limited parallel processing to convert each page to grayscale
-        grayscale_page_paths = []
-        with ThreadPoolExecutor() as executor:  # Adjust worker count as needed
-            futures = [
-                executor.submit(convert_page_to_grayscale, pdf_path, page_num + 1, output_dir)
-                for page_num in range(total_pages)
-            ]
+    def split_page(self, pdf_path=None, source_pages=None):
+        """Splits each page of the PDF into separate color-separated images.
+
+        Blank pages and copies of identical pages are not rendered. Page
+        statuses use the page numbers of the job's PDF: source_pages lists the
+        job's page each page of pdf_path stands for (the grayscale PDF leaves
+        out pages that could not be converted). Pages the split did not reach
+        because of an error are flagged "failed". Returns (blank_pixels,
+        file_weights): the total pixel count of the blank pages, so the
+        coverage average still includes their area, and how many pages each
+        rendered separation file stands for.
+        """
+        pdf_path = pdf_path or self.pdf_path
+        source = (lambda pages: [source_pages[page - 1] for page in pages]) if source_pages else list
+        # Clear the dictionary for storing images
+        clear_path(self.split_path)
+        logger.info(f"Started splitting for {pdf_path}")
+        blank_pixels = 0
+        file_weights = {}
+        try:
+            plan = plan_pages(pdf_path, self.resolution, metrics=self.metrics)
+            blank_pixels = sum(pixels for _, pixels in plan.blank)
+            self.set_page_status(source([page for page, _ in plan.blank]), "blank")
+            # Run one Ghostscript process per page range
+            chunks = run_page_chunks(
+                plan.render, lambda chunk: split_page_range(pdf_path, chunk, self.split_path, self.resolution, self),
+                stop_event=self.cancelled, metrics=self.metrics,
+                chunk_memory=lambda chunk: range_memory(
+                    pdf_path, chunk, self.resolution, len(color_channels),
+                    ghostscript_max_bitmap + ghostscript_buffer_space,
+                ),
+            )
+            # Separation files are named after the first page of their range and their index in it
+            for chunk, status in chunks:
+                for index, page in enumerate(chunk, 1):
+                    copies = plan.duplicates.get(page, [])
+                    self.set_page_status(source([page] + copies), status)
+                    if status == "ok":
+                        file_weights[f"p_{chunk[0]}_{index}"] = 1 + len(copies)
+            logger.info("Split Tiffs successfully created")
+        except Exception as e:
+            logger.error(f"Error splitting pdf {pdf_path}: {e}")
+            with self._status_lock:
+                unreached = [page for page in range(1, get_pdf_page_count(self.pdf_path) + 1)
+                             if page not in self.page_status]
+            self.set_page_status(unreached, "failed")
+        finally:
+            # Organize the TIFF files into separate folders by color
+            self.organize_tiff()
+            logger.info("Split completed and organized successfully.")
+        return blank_pixels, file_weights
+
+    def calculate_all_color(self, blank_pixels=0, file_weights=None):
+        colo = {}
+        # One task per page and color channel, merged back into per-color totals
+        color_files = {}
+        for color in color_channels:
+            color_folder = os.path.join(self.split_path, color)
+            color_files[color] = [os.path.join(color_folder, file_name) for file_name in os.listdir(color_folder)]
+        all_files = [path for color in color_channels for path in color_files[color]]
+        partial_sums = dict(zip(all_files, reduce_tiff_files(all_files, self.metrics)))
+        if file_weights:
+            # A rendered page stands in for its identical copies too
+            for path, (total_intensity, max_intensity) in partial_sums.items():
+                weight = file_weights.get(os.path.basename(path).split("(")[0].split(".")[0], 1)
+                partial_sums[path] = (total_intensity * weight, max_intensity * weight)
+
+        flagged_pixels = self.flagged_pixels()
+        for color in color_channels:
+            total_intensity = sum(partial_sums[path][0] for path in color_files[color])
+            rendered_intensity = sum(partial_sums[path][1] for path in color_files[color])
+            if flagged_pixels and rendered_intensity > 0:
+                # Pages that could not be split count at the average coverage of the rendered pages
+                total_intensity += total_intensity / rendered_intensity * flagged_pixels * 255
+                rendered_intensity += flagged_pixels * 255
+            # Blank pages were not rendered but still count towards the page area
+            max_intensity = rendered_intensity + blank_pixels * 255
+            colo.update({color: float(format_coverage(total_intensity, max_intensity))})
+            logger.info(f"Color {color} calculated successfully with a coverage of {colo[color]}")
+        shutil.rmtree(self.split_path, ignore_errors=True)
+        return colo
+
+    def make_grayscale(self, pdf_path=None):
+        """Converts the PDF to grayscale with pdfwrite.
+
+        Returns (path, source_pages): the path of the grayscale PDF and the
+        page of the PDF each of its pages comes from. Pages that could not be
+        converted are left out of it and flagged.
+        """
+        pdf_path = pdf_path or self.pdf_path
+        # Create output directory for temporary grayscale pages
+        output_dir = os.path.join(self.workspace, "grayscale_pages")
+        os.makedirs(output_dir, exist_ok=True)
+        output_pdf_path = os.path.join(self.workspace, "gray.pdf")
+        if os.path.exists(output_pdf_path):
+            os.remove(output_pdf_path)
+        source_pages = []
+
+        logger.info(f"Started grayscale conversion for {pdf_path}")
+        try:
+            # Get total number of pages using Ghostscript
+            total_pages = get_pdf_page_count(pdf_path)
+
+            # Convert page ranges to grayscale with one Ghostscript process per range
+            grayscale_page_paths = []
+            chunks = run_page_chunks(
+                range(1, total_pages + 1), lambda pages: convert_page_to_grayscale(pdf_path, pages, output_dir, self),
+                stop_event=self.cancelled, metrics=self.metrics,
+            )
 
             # Collect the results and maintain the page order
-            for future in futures:
-                page_number, result = future.result()
+            for pages, (page_number, result) in chunks:
                 if result is not None:
                     grayscale_page_paths.append((page_number, result))
+                    source_pages.extend(pages)
                 else:
                     logger.error(f"Error converting page {page_number} to grayscale.")
 
-        # Combine all grayscale pages into a single PDF, ordered by page number
-        output_pdf_path = os.path.join("grayscale", "gray.pdf")
-        os.makedirs("grayscale", exist_ok=True)
-        combine_pdfs(grayscale_page_paths, output_pdf_path)
+            # Combine all grayscale pages into a single PDF, ordered by page number
+            combine_pdfs(grayscale_page_paths, output_pdf_path, self)
 
-        logger.info(f"Grayscale PDF successfully created: {output_pdf_path}")
+            logger.info(f"Grayscale PDF successfully created: {output_pdf_path}")
 
-    except Exception as e:
-        logger.error(f"Error during grayscale conversion: {e}")
-
-    finally:
-        # Clean up temporary files
-        clear_path(r"grayscale_pages")
-        logger.info("Grayscale conversion completed and temporary files cleaned up.")
-
-def calculate_color_coverage(pdf_path):
-    split_page(pdf_path)
-    color = calculate_all_color()
-    page = get_pdf_page_count(pdf_path)
-    for colo in color.keys():
-        color[colo] = float("{:0.2f}".format(color[colo] * page))
-    logger.info(f"PDF color Coverage calculated successfully.\nCoverage : {color}")
-    return color
-
-def calculate_grayscale_coverage(pdf_path):
-    make_grayscale(pdf_path)
-    split_page(r"grayscale/gray.pdf")
-    black = calculate_all_color()
-    page = get_pdf_page_count(pdf_path)
-    black = black["Black"] * page
-    logger.info(f"PDF grayscale Coverage calculated successfully.\nCoverage : {black}")
-    return black
\ No newline at end of file
+        except Exception as e:
+            logger.error(f"Error during grayscale conversion: {e}")
+
+        finally:
+            # Clean up temporary files
+            shutil.rmtree(output_dir, ignore_errors=True)
+            logger.info("Grayscale conversion completed and temporary files cleaned up.")
+        return output_pdf_path, sorted(source_pages)
+
+    def page_store_keys(self, plan, mode, resolution):
+        """Returns {page: page store key} for the pages of the plan to render that have a fingerprint."""
+        if not use_page_store:
+            return {}
+        index = document_index(self.pdf_path)
+        keys = {}
+        for page in plan.render:
+            fingerprint = plan.fingerprints.get(page)
+            if fingerprint is None:
+                continue
+            info = index.pages[page - 1]
+            # Inherited page boxes are not part of the fingerprint, so the size is added here
+            settings = {"backend": self.backend, "resolution": resolution,
+                        "media": [info.media_width, info.media_height]}
+            keys[page] = page_store.make_key(fingerprint, mode, settings)
+        return keys
+
+    def render_pages(self, render_range, pages, mode, resolution):
+        """Renders a range of pages within the time budgets and yields (page, channel_sums, pixel_count, status).
+
+        When the range fails or runs out of time, the pages it did not finish
+        are rendered again one by one (render_alone). channel_sums is None for
+        pages that could not be measured.
+        """
+        timeout = self.range_timeout(len(pages))
+        if timeout is not None and timeout <= 0:
+            for page in pages:
+                yield page, None, 0, "timeout"
+            return
+        done = set()
+        timed_out = False
+        try:
+            for page, sums, pixels in render_range(self.pdf_path, pages, mode, resolution, self, timeout):
+                done.add(page)
+                yield page, sums, pixels, "ok"
+        except Exception as e:
+            if self.cancelled.is_set():
+                return
+            timed_out = isinstance(e, RenderTimeout)
+            logger.error(f"Error rendering pages {pages[0]}-{pages[-1]}: {e}")
+        for page in pages:
+            if page in done or self.cancelled.is_set():
+                continue
+            # A single page that ran out of time goes straight to a lower resolution
+            yield self.render_alone(render_range, page, mode, resolution, timed_out and len(pages) == 1)
+
+    def render_alone(self, render_range, page, mode, resolution, timed_out=False):
+        """Renders one page on its own and returns (page, channel_sums, pixel_count, status).
+
+        Each time the page runs out of time it is tried again at a lower
+        resolution; its sums are then scaled to the pixel count of the
+        requested resolution ("reduced"). A page that fails, or still runs out
+        of time at min_retry_resolution, is flagged "failed" or "timeout".
+        """
+        current = lower_resolution(resolution) if timed_out else resolution
+        while current is not None:
+            timeout = self.range_timeout(1)
+            if timeout is not None and timeout <= 0:
+                break
+            try:
+                results = list(render_range(self.pdf_path, [page], mode, current, self, timeout))
+            except RenderTimeout as e:
+                logger.error(f"Page {page} of {self.pdf_path} ran out of time at {current} dpi: {e}")
+                current = lower_resolution(current)
+                continue
+            except Exception as e:
+                logger.error(f"Error rendering page {page} of {self.pdf_path}: {e}")
+                return page, None, 0, "failed"
+            if not results:
+                logger.error(f"No raster was rendered for page {page} of {self.pdf_path}")
+                return page, None, 0, "failed"
+            _, sums, pixels = results[0]
+            if current == resolution:
+                return page, sums, pixels, "ok"
+            logger.info(f"Page {page} of {self.pdf_path} measured at {current} dpi instead of {resolution}")
+            target = document_index(self.pdf_path).pixel_count(page, resolution)
+            scale = target / pixels if pixels else 0
+            return page, np.round(sums.astype(np.float64) * scale).astype(np.uint64), target, "reduced"
+        return page, None, 0, "timeout"
+
+    def iter_page_sums(self, mode="color", pages=None, resolution=None):
+        """Yields (page, channel_sums, pixel_count) for every page (or the given pages) in the order pages finish.
+
+        Pages found in the page store are yielded first without rendering;
+        newly rendered pages are added to it. Pages that cannot be measured
+        are not yielded; page_status records what happened to every page.
+        """
+        resolution = resolution or self.resolution
+        _, channels = pipe_devices[mode]
+        self.start_clock()
+        with self._status_lock:
+            self.page_status = {}
+        plan = plan_pages(self.pdf_path, resolution, pages, self.metrics)
+        render_range = range_renderers[self.backend]
+        self.set_page_status([page for page, _ in plan.blank], "blank")
+        for page, pixels in plan.blank:
+            yield page, np.zeros(len(channels), dtype=np.uint64), pixels
+
+        store_keys = self.page_store_keys(plan, mode, resolution)
+        stored = page_store.get_many(store_keys.values()) if store_keys else {}
+        to_render = []
+        for page in plan.render:
+            entry = stored.get(store_keys.get(page))
+            if entry is None:
+                to_render.append(page)
+                continue
+            sums, pixels = entry[0][:len(channels)], entry[1]
+            self.set_page_status([page] + plan.duplicates.get(page, []), "stored")
+            yield page, sums, pixels
+            for copy in plan.duplicates.get(page, []):
+                yield copy, sums, pixels
+        if stored:
+            count("pages_stored", len(stored), self.metrics)
+            logger.info(f"Reused {len(stored)} of {len(plan.render)} pages of {self.pdf_path} from the page store")
+
+        if self.backend == "pymupdf":
+            memory_cap = rasterizer_band_bytes
+        else:
+            # Ghostscript's frame buffer plus the band the pipe reduction holds
+            memory_cap = ghostscript_max_bitmap + ghostscript_buffer_space + default_band_size
+        if self.spool is not None:
+            items = self.spool.iter_results(self.pdf_path, to_render, mode, resolution, self.backend, self)
+        else:
+            items = iter_page_chunks(
+                to_render, lambda chunk: self.render_pages(render_range, chunk, mode, resolution),
+                stop_event=self.cancelled, metrics=self.metrics,
+                chunk_memory=lambda chunk: range_memory(
+                    self.pdf_path, chunk, resolution, len(channels), memory_cap,
+                ),
+            )
+        rendered = {}
+        for page, sums, pixels, status in items:
+            self.set_page_status([page] + plan.duplicates.get(page, []), status)
+            if sums is None:
+                continue
+            # Pages measured at a lower resolution are not stored, so a later run can measure them fully
+            if status == "ok" and page in store_keys:
+                rendered[store_keys[page]] = (sums, pixels)
+            yield page, sums, pixels
+            # Fan the coverage out to every identical copy of the page
+            for copy in plan.duplicates.get(page, []):
+                yield copy, sums, pixels
+        # Only pages that finished rendering are stored, also when the job was cancelled
+        page_store.put_many(rendered)
+        self.check_cancelled()
+        flagged = self.flagged_pages()
+        if flagged:
+            logger.error(f"{len(flagged)} pages of {self.pdf_path} could not be measured: {flagged}")
+
+    def iter_page_coverage(self, mode="color"):
+        """Yields a PageCoverage record for each page as soon as the page is rendered.
+
+        Pages arrive in completion order, not page order. In grayscale mode only
+        black is set. Each page is reduced band by band from the Ghostscript
+        pipe, so memory stays flat however long the document is.
+        """
+        _, channels = pipe_devices[mode]
+        for page, sums, pixels in self.iter_page_sums(mode):
+            values = dict.fromkeys(color_channels, 0.0)
+            for index, color in enumerate(channels):
+                values[color] = int(sums[index]) / (pixels * 255) * 100 if pixels > 0 else 0.0
+            yield PageCoverage(page, values["Cyan"], values["Magenta"], values["Yellow"], values["Black"])
+
+    def stream_all_color(self, mode="color", progress=None):
+        """Calculates the coverage of every channel of the mode without writing rasters to disk.
+
+        Grayscale renders each page once to a gray raster, so it needs no
+        pdfwrite conversion of the document beforehand. progress, if given, is
+        called as progress(pages_done, page_count, average_coverage) after
+        every page.
+        """
+        logger.info(f"Started streaming {mode} coverage for {self.pdf_path}")
+        _, channels = pipe_devices[mode]
+        total_sums = np.zeros(len(channels), dtype=np.uint64)
+        total_pixels = 0
+        # Pages with ink, whose average coverage flagged pages are counted at
+        inked_sums = np.zeros(len(channels), dtype=np.uint64)
+        inked_pixels = 0
+        page_count = get_pdf_page_count(self.pdf_path) if progress else 0
+        for pages_done, (page, sums, pixels) in enumerate(self.iter_page_sums(mode), 1):
+            total_sums += sums
+            total_pixels += pixels
+            if self.page_status.get(page) != "blank":
+                inked_sums += sums
+                inked_pixels += pixels
+            if progress:
+                average = {
+                    color: int(total_sums[index]) / (total_pixels * 255) * 100 if total_pixels > 0 else 0.0
+                    for index, color in enumerate(channels)
+                }
+                progress(pages_done, page_count, average)
+
+        totals = total_sums.astype(np.float64)
+        flagged_pixels = self.flagged_pixels()
+        if flagged_pixels and inked_pixels > 0:
+            totals += inked_sums.astype(np.float64) / inked_pixels * flagged_pixels
+            total_pixels += flagged_pixels
+        colo = {}
+        for index, color in enumerate(channels):
+            max_intensity = total_pixels * 255
+            coverage = (totals[index] / max_intensity) * 100 if max_intensity > 0 else 0
+            colo[color] = float("{:0.2f}".format(coverage))
+            logger.info(f"Color {color} calculated successfully with a coverage of {colo[color]}")
+        return colo
+
+    def measure_all_color(self, mode="color", progress=None):
+        """Calculates the coverage of every channel using the job's render mode."""
+        with timed("job", self.metrics):
+            if self.render_mode == "tiff":
+                self.start_clock()
+                with self._status_lock:
+                    self.page_status = {}
+                pdf_path, source_pages = self.pdf_path, None
+                if mode == "grayscale":
+                    pdf_path, source_pages = self.make_grayscale()
+                blank_pixels, file_weights = self.split_page(pdf_path, source_pages)
+                self.check_cancelled()
+                coverage = self.calculate_all_color(blank_pixels, file_weights)
+            else:
+                coverage = self.stream_all_color(mode, progress)
+        self.check_measured()
+        logger.info(f"Job metrics for {self.pdf_path} ({mode}): {json.dumps(self.metrics.snapshot())}")
+        return coverage
+
+    def color_coverage(self, progress=None):
+        """Returns the color coverage of the PDF (percent summed over pages).
+
+        progress, if given, is called as progress(pages_done, page_count,
+        partial_coverage) while pages are rendered, where partial_coverage is
+        the coverage of the pages done so far scaled to the whole document.
+        Pages that could not be measured (flagged_pages) are counted at the
+        average coverage of the others; NoPagesMeasured is raised when there
+        are no others.
+        """
+        cache_key = coverage_cache.make_key(self.pdf_path, "color", self.settings())
+        cached = coverage_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"PDF color Coverage loaded from cache.\nCoverage : {cached}")
+            return cached
+
+        page = get_pdf_page_count(self.pdf_path)
+        color = self.measure_all_color(progress=self.scaled_progress(progress, page))
+        for colo in color.keys():
+            color[colo] = float("{:0.2f}".format(color[colo] * page))
+        logger.info(f"PDF color Coverage calculated successfully.\nCoverage : {color}")
+        self.cache_if_complete(cache_key, color)
+        return color
+
+    def grayscale_coverage(self, progress=None):
+        """Returns the black coverage of the PDF in grayscale; progress works as in color_coverage."""
+        cache_key = coverage_cache.make_key(self.pdf_path, "grayscale", self.settings())
+        cached = coverage_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"PDF grayscale Coverage loaded from cache.\nCoverage : {cached}")
+            return cached
+
+        page = get_pdf_page_count(self.pdf_path)
+        black = self.measure_all_color("grayscale", self.scaled_progress(progress, page))
+        black = black["Black"] * page
+        logger.info(f"PDF grayscale Coverage calculated successfully.\nCoverage : {black}")
+        self.cache_if_complete(cache_key, black)
+        return black
+
+    def page_coverage(self, mode="color"):
+        """Returns the coverage of every page as a pages × channels array in percent.
+
+        Rows are in page order and columns follow color_channels; grayscale
+        only fills the Black column. Pages that could not be measured
+        (flagged_pages) get the average coverage of the measured pages with
+        ink, as in the document totals. The array is cached like the totals, so cost
+        scenarios over page ranges never need a second render.
+        """
+        cache_key = coverage_cache.make_key(self.pdf_path, f"{mode}-pages", self.settings())
+        cached = coverage_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"PDF {mode} page coverage loaded from cache.")
+            return np.array(cached, dtype=np.float64).reshape(-1, len(color_channels))
+
+        _, channels = pipe_devices[mode]
+        columns = [color_channels.index(color) for color in channels]
+        coverage = np.zeros((get_pdf_page_count(self.pdf_path), len(color_channels)), dtype=np.float64)
+        inked_sums = np.zeros(len(channels), dtype=np.uint64)
+        inked_pixels = 0
+        for page, sums, pixels in self.iter_page_sums(mode):
+            if pixels > 0:
+                coverage[page - 1, columns] = sums.astype(np.float64) / (pixels * 255) * 100
+            if self.page_status.get(page) != "blank":
+                inked_sums += sums
+                inked_pixels += pixels
+        self.check_measured()
+        flagged = self.flagged_pages()
+        if flagged and inked_pixels > 0:
+            rows = np.array(list(flagged)) - 1
+            coverage[np.ix_(rows, columns)] = inked_sums.astype(np.float64) / (inked_pixels * 255) * 100
+        logger.info(f"PDF {mode} page coverage calculated for {len(coverage)} pages.")
+        self.cache_if_complete(cache_key, coverage.round(4).tolist())
+        return coverage
+
+    def cache_if_complete(self, cache_key, value):
+        """Caches a result unless pages were left out of it or measured at a lower resolution,
+        so a later run can measure them fully."""
+        with self._status_lock:
+            partial = any(status in ("reduced",) + flagged_statuses for status in self.page_status.values())
+        if partial:
+            logger.info(f"Coverage of {self.pdf_path} not cached: some pages were not fully measured")
+            return
+        coverage_cache.put(cache_key, value)
+
+    @staticmethod
+    def scaled_progress(progress, page_count):
+        """Wraps a progress callback so it receives coverage scaled to the whole document."""
+        if progress is None:
+            return None
+
+        def report(pages_done, total_pages, average):
+            progress(pages_done, total_pages, {color: cov * page_count for color, cov in average.items()})
+        return report
+
+    def estimate(self, mode="color", resolution=None, sample_size=None):
+        """Quickly estimates the coverage of the PDF and the expected error against an exact run.
+
+        The sampled pages are rendered at a low resolution (and once more at half
+        of it). Returns {"coverage": ..., "error": ...} with one value per channel,
+        in the same units as calculate_color_coverage. The error combines the
+        standard error of the page sample with the change between the two
+        resolutions, which bounds how far the low resolution run is from a
+        full resolution one.
+        """
+        resolution = resolution or estimate_resolution
+        sample_size = estimate_sample_pages if sample_size is None else sample_size
+        _, channels = pipe_devices[mode]
+        page_count = get_pdf_page_count(self.pdf_path)
+        pages = sample_pages(page_count, sample_size)
+
+        def page_coverage(render_resolution):
+            # Rows are pages in page order, columns are channels
+            records = sorted(self.iter_page_sums(mode, pages, render_resolution), key=lambda record: record[0])
+            sums = np.array([record[1] for record in records], dtype=np.float64).reshape(-1, len(channels))
+            pixels = np.array([record[2] for record in records], dtype=np.float64)
+            return sums, pixels
+
+        sums, pixels = page_coverage(resolution)
+        coarse_sums, coarse_pixels = page_coverage(max(1, resolution // 2))
+
+        def document_coverage(channel_sums, channel_pixels):
+            if channel_pixels.sum() == 0:
+                return np.zeros(len(channels))
+            return channel_sums.sum(axis=0) / (channel_pixels.sum() * 255) * 100 * page_count
+
+        coverage = document_coverage(sums, pixels)
+        resolution_error = np.abs(coverage - document_coverage(coarse_sums, coarse_pixels))
+
+        # Standard error of the sampled pages, with the finite population correction
+        sampled = len(pixels)
+        if 1 < sampled < page_count:
+            per_page = sums / (np.maximum(pixels, 1)[:, None] * 255) * 100
+            sampling_error = (per_page.std(axis=0, ddof=1) / np.sqrt(sampled)
+                              * np.sqrt(1 - sampled / page_count) * page_count)
+        else:
+            sampling_error = np.zeros(len(channels))
+        error = np.sqrt(resolution_error ** 2 + sampling_error ** 2)
+
+        result = {
+            "coverage": {color: float("{:0.2f}".format(coverage[index])) for index, color in enumerate(channels)},
+            "error": {color: float("{:0.2f}".format(error[index])) for index, color in enumerate(channels)},
+            "pages_sampled": sampled,
+            "resolution": resolution,
+        }
+        logger.info(f"PDF {mode} Coverage estimated.\nEstimate : {result}")
+        return result
+
+def iter_page_coverage(pdf_path, mode="color", resolution=None):
+    """Yields a PageCoverage record for each page of the PDF as soon as the page is rendered."""
+    with CoverageJob(pdf_path, resolution) as job:
+        yield from job.iter_page_coverage(mode)
+
+def calculate_color_coverage(pdf_path, resolution=None, progress=None):
+    with CoverageJob(pdf_path, resolution) as job:
+        return job.color_coverage(progress)
+
+def page_area_weights(pdf_path):
+    """Returns each page's area divided by the mean page area of the PDF.
+
+    Document totals average coverage over the area of all pages, so per-page
+    coverage times these weights sums to the same totals.
+    """
+    areas = np.array(document_index(pdf_path).page_areas())
+    return areas / areas.mean() if len(areas) and areas.mean() > 0 else np.ones(len(areas))
+
+def calculate_page_coverage(pdf_path, mode="color", resolution=None):
+    """Returns the pages × channels coverage array of the PDF; see CoverageJob.page_coverage."""
+    with CoverageJob(pdf_path, resolution) as job:
+        return job.page_coverage(mode)
+
+def calculate_grayscale_coverage(pdf_path, resolution=None, progress=None):
+    with CoverageJob(pdf_path, resolution) as job:
+        return job.grayscale_coverage(progress)
+
+def estimate_coverage(pdf_path, mode="color", resolution=None, sample_size=None):
+    """Quickly estimates the coverage of the PDF; see CoverageJob.estimate."""
+    with CoverageJob(pdf_path) as job:
+        return job.estimate(mode, resolution, sample_size)
@@ -0,0 +1,182 @@
+"""Timings and sizes of the coverage stages, with an optional profiling hook.
+
+Every timed stage is recorded in the process-wide registry and, when one is
+given, in the Metrics of the job it belongs to. Stages:
+    ghostscript   wall time of one Ghostscript process (one page range)
+    queue_wait    time a page range waited for a slot of the shared process limit or memory budget
+    decode        reading raster data from Ghostscript's output
+    reduce        summing raster data into channel totals
+    reduce_tiff   decoding and reducing tiffsep separation files
+    rasterize     rendering and reducing one page range with the in-process rasterizer
+    job           one whole coverage measurement
+    job_queue_wait  time a quote waited in the service queue
+Counters: pages_rendered, pages_blank, pages_duplicate, workspace_bytes, pages_stored
+(pages planned for rendering that were read from the page store instead), and
+pages_reduced, pages_failed, pages_timeout (see CoverageJob.page_status).
+"""
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Called as profile_hook(stage) around every timed stage; returns a context manager
+profile_hook = None
+# Prefix of the metric names in export_text
+metric_prefix = "pdf2printcost"
+# Stages profiled by enable_profiling unless others are named: the Python hot loops
+hot_stages = ("decode", "reduce", "reduce_tiff")
+
+
+class Metrics:
+    """Totals of timed stages and counters; safe to update from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            totals = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            totals["max_seconds"] = max(totals["max_seconds"], seconds)
+
+    def add(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def snapshot(self):
+        """Returns {"stages": {stage: {"count", "seconds", "max_seconds"}}, "counters": {...}}."""
+        with self._lock:
+            return {
+                "stages": {
+                    stage: {
+                        "count": totals["count"], "seconds": round(totals["seconds"], 6),
+                        "max_seconds": round(totals["max_seconds"], 6),
+                    }
+                    for stage, totals in self.stages.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+
+
+registry = Metrics()
+
+
+@contextmanager
+def timed(stage, metrics=None):
+    """Times the block as one observation of stage, in the registry and in metrics if given."""
+    hook = profile_hook(stage) if profile_hook is not None else nullcontext()
+    started = time.perf_counter()
+    try:
+        with hook:
+            yield
+    finally:
+        seconds = time.perf_counter() - started
+        registry.observe(stage, seconds)
+        if metrics is not None:
+            metrics.observe(stage, seconds)
+
+
+def count(counter, value=1, metrics=None):
+    """Adds value to a counter in the registry and in metrics if given."""
+    registry.add(counter, value)
+    if metrics is not None:
+        metrics.add(counter, value)
+
+
+def directory_bytes(path):
+    """Total size of the files below path."""
+    total = 0
+    for folder, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(folder, file_name))
+            except OSError:
+                pass
+    return total
+
+
+def export_text(snapshot=None):
+    """Formats a snapshot (the registry by default) in the Prometheus text format."""
+    snapshot = snapshot or registry.snapshot()
+    lines = []
+    for name, field, kind in (
+        ("stage_calls_total", "count", "counter"),
+        ("stage_seconds_total", "seconds", "counter"),
+        ("stage_max_seconds", "max_seconds", "gauge"),
+    ):
+        lines.append(f"# TYPE {metric_prefix}_{name} {kind}")
+        for stage, totals in sorted(snapshot["stages"].items()):
+            lines.append(f'{metric_prefix}_{name}{{stage="{stage}"}} {totals[field]}')
+    for counter, value in sorted(snapshot["counters"].items()):
+        lines.append(f"# TYPE {metric_prefix}_{counter}_total counter")
+        lines.append(f"{metric_prefix}_{counter}_total {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_snapshot(path, metrics=None):
+    """Writes a JSON snapshot of metrics (the registry by default) to path."""
+    snapshot = (metrics or registry).snapshot()
+    snapshot["time"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    with open(path, "w") as file:
+        json.dump(snapshot, file, indent=4)
+
+
+class StageProfiler:
+    """Profiling hook that runs cProfile around the chosen stages.
+
+    Only one stage is profiled at a time; stages running on other threads
+    meanwhile are timed but not profiled. dump() writes one .prof file per
+    stage, readable with pstats or snakeviz.
+    """
+
+    def __init__(self, stages=None):
+        self.stages = set(stages or hot_stages)
+        self.profiles = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, stage):
+        if stage not in self.stages:
+            return nullcontext()
+        return self.profile(stage)
+
+    @contextmanager
+    def profile(self, stage):
+        if not self._lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            profile = self.profiles.setdefault(stage, cProfile.Profile())
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+        finally:
+            self._lock.release()
+
+    def dump(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for stage, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(directory, f"{stage}.prof"))
+
+
+def enable_profiling(stages=None):
+    """Profiles the given stages (hot_stages by default) from now on and returns the StageProfiler."""
+    global profile_hook
+    profile_hook = StageProfiler(stages)
+    return profile_hook
+
+
+def disable_profiling():
+    global profile_hook
+    profile_hook = None
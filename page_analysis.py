@@ -0,0 +1,176 @@
+import hashlib
+import logging
+
+from pypdf.generic import ArrayObject, ContentStream, DictionaryObject, IndirectObject, StreamObject
+
+logger = logging.getLogger('GhostscriptLogger')
+
+# Content stream operators that put marks on the page
+paint_operators = {b"S", b"s", b"f", b"F", b"f*", b"B", b"B*", b"b", b"b*", b"sh", b"INLINE IMAGE"}
+text_operators = {b"Tj", b"TJ", b"'", b'"'}
+# Form XObjects nested deeper than this are assumed to paint something
+max_form_depth = 8
+
+
+def is_white(operator, operands):
+    """Returns True when a color operator sets white."""
+    values = [float(value) for value in operands]
+    if operator in (b"g", b"G"):
+        return values == [1]
+    if operator in (b"rg", b"RG"):
+        return values == [1, 1, 1]
+    if operator in (b"k", b"K"):
+        return values == [0, 0, 0, 0]
+    return False
+
+
+def content_is_blank(content, resources, reader, depth=0):
+    """Returns True when a content stream draws nothing but white or invisible marks.
+
+    Anything the check does not understand (images, shadings, pattern or
+    named color spaces) counts as a mark, so a page is only called blank
+    when rendering it could not put ink on paper.
+    """
+    if content is None:
+        return True
+    if depth > max_form_depth:
+        return False
+
+    # Graphics state that matters here: white fill, white stroke, invisible text
+    state = {"fill_white": False, "stroke_white": False, "invisible_text": False}
+    stack = []
+    for operands, operator in ContentStream(content, reader).operations:
+        if operator == b"q":
+            stack.append(dict(state))
+        elif operator == b"Q":
+            if stack:
+                state = stack.pop()
+        elif operator in (b"g", b"rg", b"k"):
+            state["fill_white"] = is_white(operator, operands)
+        elif operator in (b"G", b"RG", b"K"):
+            state["stroke_white"] = is_white(operator, operands)
+        elif operator in (b"cs", b"sc", b"scn"):
+            state["fill_white"] = False
+        elif operator in (b"CS", b"SC", b"SCN"):
+            state["stroke_white"] = False
+        elif operator == b"Tr":
+            state["invisible_text"] = int(operands[0]) == 3
+        elif operator in text_operators:
+            if not state["invisible_text"]:
+                return False
+        elif operator in (b"f", b"F", b"f*"):
+            if not state["fill_white"]:
+                return False
+        elif operator in (b"S", b"s"):
+            if not state["stroke_white"]:
+                return False
+        elif operator in (b"B", b"B*", b"b", b"b*"):
+            if not (state["fill_white"] and state["stroke_white"]):
+                return False
+        elif operator in paint_operators:
+            return False
+        elif operator == b"Do":
+            if not xobject_is_blank(operands[0], resources, reader, depth):
+                return False
+    return True
+
+
+def xobject_is_blank(name, resources, reader, depth):
+    """Returns True when the named XObject is a form that draws nothing."""
+    try:
+        xobject = resources["/XObject"][name].get_object()
+    except (KeyError, TypeError):
+        return False
+    if xobject.get("/Subtype") != "/Form":
+        return False
+    form_resources = xobject.get("/Resources")
+    form_resources = form_resources.get_object() if form_resources is not None else resources
+    return content_is_blank(xobject, form_resources, reader, depth + 1)
+
+
+def is_blank_page(page, reader):
+    """Returns True when the page would render without any ink."""
+    try:
+        for annotation in page.get("/Annots") or []:
+            if "/AP" in annotation.get_object():
+                return False
+        resources = page.get("/Resources")
+        resources = resources.get_object() if resources is not None else {}
+        return content_is_blank(page.get_contents(), resources, reader)
+    except Exception as e:
+        # Anything unexpected is left to the renderer
+        logger.info(f"Could not inspect page content, rendering it: {e}")
+        return False
+
+
+def find_blank_pages(reader, pages):
+    """Returns the set of page numbers (1-based) among pages that are blank."""
+    return {page for page in pages if is_blank_page(reader.pages[page - 1], reader)}
+
+
+def object_digest(obj, memo, stack=()):
+    """Returns a digest of a PDF object with indirect references resolved.
+
+    Digests of indirect objects are memoized, so fonts and images shared by
+    many pages are only hashed once per document. Streams are hashed as
+    stored in the file, without decoding them.
+    """
+    if isinstance(obj, IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key in memo:
+            return memo[key]
+        if key in stack:
+            # Reference cycle: identify it by position only
+            return hashlib.sha256(b"cycle").digest()
+        value = object_digest(obj.get_object(), memo, stack + (key,))
+        memo[key] = value
+        return value
+
+    digest = hashlib.sha256(type(obj).__name__.encode("ascii"))
+    if isinstance(obj, DictionaryObject):
+        for name in sorted(obj.keys()):
+            # Back links to the page tree differ between otherwise identical objects
+            if name in ("/Parent", "/P"):
+                continue
+            digest.update(name.encode("utf-8", "replace"))
+            digest.update(object_digest(obj.raw_get(name), memo, stack))
+        if isinstance(obj, StreamObject):
+            # /Filter and /DecodeParms are among the keys above, so the encoded bytes identify the data
+            digest.update(obj._data)
+    elif isinstance(obj, ArrayObject):
+        for item in obj:
+            digest.update(object_digest(item, memo, stack))
+    else:
+        digest.update(repr(obj).encode("utf-8", "replace"))
+    return digest.digest()
+
+
+def page_fingerprint(page, memo):
+    """Returns a hex fingerprint of everything that affects how the page renders."""
+    digest = hashlib.sha256()
+    for name in ("/Contents", "/Resources", "/MediaBox", "/CropBox", "/Rotate", "/Annots"):
+        digest.update(name.encode("ascii"))
+        if name in page:
+            digest.update(object_digest(page.raw_get(name), memo))
+    return digest.hexdigest()
+
+
+def page_fingerprints(reader, pages):
+    """Returns {page: fingerprint} for the pages; pages that cannot be fingerprinted map to None."""
+    memo = {}
+    fingerprints = {}
+    for page in pages:
+        try:
+            fingerprints[page] = page_fingerprint(reader.pages[page - 1], memo)
+        except Exception as e:
+            logger.info(f"Could not fingerprint page {page}, rendering it: {e}")
+            fingerprints[page] = None
+    return fingerprints
+
+
+def group_duplicate_pages(pages, fingerprints):
+    """Groups identical pages by their fingerprints and returns {first_page: [duplicate pages]} in page order."""
+    groups = {}
+    for page in pages:
+        groups.setdefault(fingerprints[page] or f"page-{page}", []).append(page)
+    return {group[0]: group[1:] for group in groups.values()}
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger('GhostscriptLogger')
+
+# Channel sums kept per page; grayscale pages use the first column only
+store_channels = 4
+# A read saves the last-use time of an entry when it is older than this many seconds,
+# so LRU order survives restarts without a write on every quote
+touch_interval = 3600
+# Seconds a transaction waits for another process to release the store
+busy_timeout = 30
+# Keys looked up per query, below SQLite's limit on query parameters
+lookup_batch = 500
+
+schema = """
+CREATE TABLE IF NOT EXISTS pages (
+    key BLOB PRIMARY KEY, sums BLOB NOT NULL, pixels INTEGER NOT NULL, used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_by_use ON pages (used);
+"""
+
+
+class PageStore:
+    """Render results of single pages, keyed by page fingerprint and render settings.
+
+    Revised versions of a document share most of their pages, so a re-quote
+    only renders the pages whose fingerprint is new. Entries are rows of one
+    SQLite file (key digest, channel sums, pixel count, last use), so a quote
+    writes only its new pages and several processes can share the store;
+    every write is one transaction. Past max_entries the least recently used
+    entries are dropped.
+    """
+
+    def __init__(self, path, max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._ready = False
+
+    def make_key(self, fingerprint, mode, settings):
+        """Builds the key of a page fingerprint rendered in a mode with the given settings."""
+        settings_text = json.dumps(settings, sort_keys=True)
+        return hashlib.sha256(f"{fingerprint}|{mode}|{settings_text}".encode("utf-8")).digest()
+
+    @contextmanager
+    def connect(self, write=True):
+        """Opens a connection for one transaction; a write transaction takes the write lock up front."""
+        if not self._ready:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=busy_timeout)
+            try:
+                connection.execute("PRAGMA journal_mode = WAL")
+                connection.executescript(schema)
+            finally:
+                connection.close()
+            self._ready = True
+        connection = sqlite3.connect(self.path, timeout=busy_timeout, isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def get_many(self, keys):
+        """Returns {key: (channel_sums, pixel_count)} for the keys that are stored."""
+        keys = list(keys)
+        found = {}
+        stale = []
+        now = time.time()
+        try:
+            with self.connect(write=False) as connection:
+                for start in range(0, len(keys), lookup_batch):
+                    batch = keys[start:start + lookup_batch]
+                    rows = connection.execute(
+                        f"SELECT key, sums, pixels, used FROM pages WHERE key IN ({', '.join('?' * len(batch))})",
+                        batch,
+                    )
+                    for key, sums, pixels, used in rows:
+                        found[key] = (np.frombuffer(sums, dtype=np.uint64).copy(), pixels)
+                        if used < now - touch_interval:
+                            stale.append(key)
+            if stale:
+                with self.connect() as connection:
+                    connection.executemany("UPDATE pages SET used = ? WHERE key = ?", [(now, key) for key in stale])
+        except sqlite3.Error as e:
+            logger.error(f"Error reading page store {self.path}: {e}")
+        return found
+
+    def put_many(self, entries):
+        """Stores {key: (channel_sums, pixel_count)} and evicts the least recently used entries past max_entries."""
+        if not entries:
+            return
+        now = time.time()
+        rows = []
+        for key, (sums, pixels) in entries.items():
+            padded = np.zeros(store_channels, dtype=np.uint64)
+            padded[:len(sums)] = sums
+            rows.append((bytes(key), padded.tobytes(), int(pixels), now))
+        try:
+            with self.connect() as connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO pages (key, sums, pixels, used) VALUES (?, ?, ?, ?)", rows
+                )
+                excess = connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    connection.execute(
+                        "DELETE FROM pages WHERE key IN (SELECT key FROM pages ORDER BY used LIMIT ?)", (excess,)
+                    )
+                    logger.info(f"Evicted {excess} entries from the page store")
+        except sqlite3.Error as e:
+            logger.error(f"Error writing page store {self.path}: {e}")
+
+    def clear(self):
+        """Removes every entry."""
+        with self.connect() as connection:
+            connection.execute("DELETE FROM pages")
+
+    def __len__(self):
+        with self.connect(write=False) as connection:
+            return connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
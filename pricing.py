@@ -0,0 +1,98 @@
+import json
+import os
+
+printers_file = "printers.json"
+papers_file = "papers.json"
+# Cartridge yields are rated at 5% page coverage, so a coverage total divided
+# by 5 is the number of rated pages the job uses up
+yield_coverage = 5
+# Pages larger than every known paper size (paper_size None) are counted under this name
+oversize_paper = "oversize"
+
+
+def load_printers(path=None):
+    """Load printers from a JSON file."""
+    path = path or printers_file
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            return json.load(file)
+    return {}
+
+
+def load_papers(path=None):
+    """Load paper prices from a JSON file."""
+    path = path or papers_file
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            return json.load(file)
+    return {}
+
+
+def coverage_usage(coverage):
+    """Convert coverage totals (percent summed over pages) into rated pages of each ink."""
+    if not isinstance(coverage, dict):
+        # Grayscale coverage is a single black total
+        coverage = {"Black": coverage}
+    return {color: cov / yield_coverage for color, cov in coverage.items()}
+
+
+def ink_cost(printer_info, usage):
+    """Calculate the estimated printing cost based on usage and printer ink yields."""
+    total_cost = 0
+    for color, pages in usage.items():
+        ink = printer_info["inks"].get(color)
+        if ink and ink["yield"] > 0:  # Avoid division by zero
+            cost_per_page = ink["price"] / ink["yield"]
+            total_cost += cost_per_page * pages
+    return total_cost
+
+
+def sheet_count(pages, double_sided):
+    """Number of sheets needed to print the pages."""
+    return -(-pages // 2) if double_sided else pages
+
+
+def sheets_by_size(page_sizes, double_sided, default_size=None):
+    """Sheets of each paper size needed to print pages of the given sizes in order.
+
+    Double sided printing puts two consecutive pages of the same size on one
+    sheet. Pages of unknown size (None) are printed on default_size when it
+    is given, else counted as oversize_paper.
+    """
+    sheets = {}
+    run_size, run_length = None, 0
+    for size in list(page_sizes) + [object()]:
+        size = (default_size or oversize_paper) if size is None else size
+        if size == run_size:
+            run_length += 1
+            continue
+        if run_length:
+            sheets[run_size] = sheets.get(run_size, 0) + sheet_count(run_length, double_sided)
+        run_size, run_length = size, 1
+    return sheets
+
+
+def document_paper_cost(page_sizes, papers, double_sided, default_size=None):
+    """Calculate the paper cost of pages printed on their own paper sizes.
+
+    A size without a price is priced as default_size when that is given;
+    otherwise its sheets cost nothing here and unpriced_sizes reports them.
+    """
+    total = 0
+    for size, sheets in sheets_by_size(page_sizes, double_sided, default_size).items():
+        if size not in papers:
+            size = default_size
+        total += sheets * (papers.get(size) or 0)
+    return total
+
+
+def unpriced_sizes(page_sizes, papers, default_size=None):
+    """Returns the paper sizes among the pages that have no price, in name order."""
+    if default_size in papers:
+        return []
+    return sorted({oversize_paper if size is None else size for size in page_sizes} - set(papers))
+
+
+def printers_for_mode(printers, mode):
+    """Returns the printers that can print in the mode; color jobs skip grayscale printers."""
+    return {name: info for name, info in printers.items() if mode != "color" or info["is_color"]}
@@ -0,0 +1,140 @@
+import numpy as np
+from PIL import Image
+
+from metrics import timed
+
+# Bytes of raster data reduced at once
+default_band_size = 4 * 1024 * 1024
+
+
+def read_pam_header(stream):
+    """Reads the rest of a PAM header (after the P7 magic) and returns (width, height, depth, maxval)."""
+    fields = {}
+    while True:
+        line = stream.readline()
+        if not line:
+            raise ValueError("Raster stream ended inside a PAM header")
+        line = line.strip()
+        if line == b"ENDHDR":
+            break
+        if not line or line.startswith(b"#"):
+            continue
+        name, _, value = line.partition(b" ")
+        fields[name.decode("ascii")] = value.strip().decode("ascii")
+
+    return int(fields["WIDTH"]), int(fields["HEIGHT"]), int(fields["DEPTH"]), int(fields["MAXVAL"])
+
+
+def read_pnm_header(stream):
+    """Reads the rest of a binary PGM header (after the P5 magic) and returns (width, height, depth, maxval)."""
+    tokens = []
+    token = b""
+    while len(tokens) < 3:
+        char = stream.read(1)
+        if not char:
+            raise ValueError("Raster stream ended inside a PGM header")
+        if char == b"#":
+            stream.readline()
+        elif char.isspace():
+            if token:
+                tokens.append(int(token))
+                token = b""
+        else:
+            token += char
+    # A single whitespace byte after maxval was consumed by the loop above
+    width, height, maxval = tokens
+    return width, height, 1, maxval
+
+
+def read_raster_header(stream):
+    """Reads the next PAM or PGM header and returns (magic, width, height, depth, maxval).
+
+    Returns None when the stream is exhausted.
+    """
+    magic = stream.read(2)
+    if not magic:
+        return None
+    if magic == b"P7":
+        stream.readline()
+        return (magic,) + read_pam_header(stream)
+    if magic == b"P5":
+        return (magic,) + read_pnm_header(stream)
+    raise ValueError(f"Unexpected raster header {magic!r}")
+
+
+def read_exact(stream, size):
+    """Reads exactly size bytes from the stream."""
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError(f"Raster stream ended early ({len(data)} of {size} bytes)")
+    return data
+
+
+def iter_raster_sums(stream, band_size=None, metrics=None):
+    """Yields (channel_sums, pixel_count) for each page of a PAM or PGM stream.
+
+    channel_sums holds the summed 8-bit ink value of each channel, so the
+    coverage of a channel is channel_sums / (pixel_count * 255). CMYK pages
+    (PAM) already carry ink values; gray pages (PGM) carry brightness, so
+    their ink is 255 minus the pixel value. Pages are read band by band, so
+    memory stays at about band_size bytes whatever the page size. Reading
+    and summing are timed as the decode and reduce stages.
+    """
+    band_size = band_size or default_band_size
+    while True:
+        header = read_raster_header(stream)
+        if header is None:
+            return
+        magic, width, height, depth, _ = header
+        row_size = width * depth
+        band_rows = max(1, band_size // max(1, row_size))
+        sums = np.zeros(depth, dtype=np.uint64)
+        for first_row in range(0, height, band_rows):
+            rows = min(band_rows, height - first_row)
+            with timed("decode", metrics):
+                band = np.frombuffer(read_exact(stream, rows * row_size), dtype=np.uint8)
+            with timed("reduce", metrics):
+                sums += band.reshape(-1, depth).sum(axis=0, dtype=np.uint64)
+        if magic == b"P5":
+            sums = np.uint64(width * height * 255) - sums
+        yield sums, width * height
+
+
+def raw_strips(img):
+    """Returns [(offset, rows, stride)] for an uncompressed 8-bit image stored in full-width strips, else None."""
+    width = img.size[0]
+    strips = []
+    for tile in img.tile:
+        codec, (x0, y0, x1, y1), offset, args = tile[0], tile[1], tile[2], tile[3]
+        if img.mode != "L" or codec != "raw" or args[0] != "L" or x0 != 0 or x1 != width:
+            return None
+        strips.append((offset, y1 - y0, args[1] or width))
+    return strips or None
+
+
+def tiff_ink_sum(path, band_size=None):
+    """Returns (total_intensity, max_intensity) of one tiffsep separation file.
+
+    Separation pixels are 0 for full ink, so the intensity of a pixel is 255
+    minus its value. Uncompressed separations (Ghostscript's
+    -sCompression=none) are memory-mapped and summed band by band, so memory
+    stays at about band_size bytes however large the page is; other files
+    are decoded whole.
+    """
+    band_size = band_size or default_band_size
+    with Image.open(path) as img:
+        width, height = img.size
+        max_intensity = width * height * 255
+        strips = raw_strips(img)
+        raw_sum = 0
+        if strips is not None:
+            for offset, rows, stride in strips:
+                strip = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(rows, stride))
+                band_rows = max(1, band_size // stride)
+                for first_row in range(0, rows, band_rows):
+                    raw_sum += int(strip[first_row:first_row + band_rows, :width].sum(dtype=np.uint64))
+                del strip
+        else:
+            # Sum the raw values instead of allocating a second 255 - img_data array
+            raw_sum = int(np.sum(np.asarray(img), dtype=np.uint64))
+    return max_intensity - raw_sum, max_intensity
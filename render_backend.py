@@ -0,0 +1,280 @@
+"""Render backends: locating Ghostscript, and the optional in-process PyMuPDF rasterizer.
+
+The rasterizer runs in a pool of long-lived worker processes. Each worker
+keeps the documents it has seen open and renders pages on demand into CMYK
+(or gray) pixmaps, so a page costs only its render instead of a new
+Ghostscript interpreter. Every worker has a pipe of its own, so a range
+that runs out of time stops only the worker rendering it. MuPDF separates colors with its own CMYK
+conversion, so its coverage differs slightly from Ghostscript's. Like
+Ghostscript it renders the whole MediaBox, whatever the CropBox, so the
+pixel counts of blank pages and the page area weights match both backends.
+"""
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+# Ghostscript executables tried in order; the environment variable overrides them
+ghostscript_names = ["gswin64c", "gswin32c", "gs"]
+ghostscript_variable = "PDF2PRINTCOST_GS"
+# Worker processes of the in-process rasterizer (None uses the CPU count)
+rasterizer_workers = None
+# Documents each rasterizer worker keeps open
+open_documents = 4
+# Pages whose pixmap would be larger than this are rendered in horizontal bands of about this size
+rasterizer_band_bytes = 64 * 1024 * 1024
+
+_ghostscript = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def find_ghostscript():
+    """Returns the Ghostscript executable to run, found once per process."""
+    global _ghostscript
+    if _ghostscript is None:
+        override = os.environ.get(ghostscript_variable)
+        if override:
+            _ghostscript = override
+        else:
+            found = [shutil.which(name) for name in ghostscript_names]
+            found = [path for path in found if path]
+            if not found:
+                raise FileNotFoundError(
+                    f"Ghostscript was not found (tried {', '.join(ghostscript_names)}); "
+                    f"install it or set {ghostscript_variable}"
+                )
+            _ghostscript = found[0]
+    return _ghostscript
+
+
+def available_backends():
+    """Returns the names of the render backends that can run here."""
+    backends = []
+    try:
+        find_ghostscript()
+        backends.append("ghostscript")
+    except FileNotFoundError:
+        pass
+    if pymupdf is not None:
+        backends.append("pymupdf")
+    return backends
+
+
+def default_backend():
+    """Ghostscript when it is installed, else the in-process rasterizer if PyMuPDF is."""
+    backends = available_backends()
+    return backends[0] if backends else "ghostscript"
+
+
+# Worker process side: documents stay open between tasks
+_documents = OrderedDict()
+
+
+def open_document(pdf_path):
+    stat = os.stat(pdf_path)
+    key = (pdf_path, stat.st_mtime_ns, stat.st_size)
+    document = _documents.get(key)
+    if document is None:
+        document = pymupdf.open(pdf_path)
+        _documents[key] = document
+        while len(_documents) > open_documents:
+            _, oldest = _documents.popitem(last=False)
+            oldest.close()
+    else:
+        _documents.move_to_end(key)
+    return document
+
+
+def media_page(document, number):
+    """Returns page number of the document with its CropBox set to the MediaBox (in memory only)."""
+    page = document[number - 1]
+    media = page.mediabox
+    # Written as a raw key: set_cropbox rejects MediaBoxes whose origin is not at zero
+    document.xref_set_key(page.xref, "CropBox", f"[{media.x0:g} {media.y0:g} {media.x1:g} {media.y1:g}]")
+    return document[number - 1]
+
+
+def page_bands(page, resolution, channels):
+    """Splits the page into clip rectangles whose pixmaps stay under rasterizer_band_bytes.
+
+    Band edges fall on whole pixel rows, so bands neither overlap nor leave
+    gaps. Rotated pages are rendered whole (None).
+    """
+    rect = page.rect
+    rows = round(rect.height * resolution / 72)
+    row_bytes = max(1, round(rect.width * resolution / 72) * channels)
+    if page.rotation or rows * row_bytes <= rasterizer_band_bytes:
+        return [None]
+    band_rows = max(1, rasterizer_band_bytes // row_bytes)
+    edges = [rect.y0 + first * 72 / resolution for first in range(0, rows, band_rows)] + [rect.y1]
+    return [pymupdf.Rect(rect.x0, top, rect.x1, bottom) for top, bottom in zip(edges, edges[1:])]
+
+
+def render_page_sums(pdf_path, page, mode, resolution):
+    """Renders one page and returns (page, channel_sums, pixel_count), as raster.iter_raster_sums does."""
+    document = open_document(pdf_path)
+    colorspace = pymupdf.csCMYK if mode == "color" else pymupdf.csGRAY
+    sums = np.zeros(colorspace.n, dtype=np.uint64)
+    pixels = 0
+    pdf_page = media_page(document, page)
+    for clip in page_bands(pdf_page, resolution, colorspace.n):
+        pixmap = pdf_page.get_pixmap(dpi=resolution, colorspace=colorspace, alpha=False, clip=clip)
+        samples = np.frombuffer(pixmap.samples_mv, dtype=np.uint8)
+        sums += samples.reshape(-1, pixmap.n).sum(axis=0, dtype=np.uint64)
+        pixels += pixmap.width * pixmap.height
+        del samples, pixmap
+    if mode != "color":
+        # Gray pixmaps carry brightness; ink is its complement
+        sums = np.uint64(pixels * 255) - sums
+    return page, sums, pixels
+
+
+def render_range_sums(pdf_path, pages, mode, resolution):
+    """Renders pages and returns [(page, channel_sums, pixel_count)], as raster.iter_raster_sums does."""
+    return [render_page_sums(pdf_path, page, mode, resolution) for page in pages]
+
+
+def serve_ranges(connection):
+    """Worker process loop: renders the ranges sent over the connection and answers one message per page."""
+    while True:
+        try:
+            pdf_path, pages, mode, resolution = connection.recv()
+        except EOFError:
+            return
+        try:
+            for page in pages:
+                connection.send(("page",) + render_page_sums(pdf_path, page, mode, resolution))
+        except Exception as e:
+            connection.send(("error", f"{type(e).__name__}: {e}"))
+        else:
+            connection.send(("done",))
+
+
+class RasterizerWorker:
+    """One rasterizer process and the pipe to it."""
+
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=serve_ranges, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def render(self, pdf_path, pages, mode, resolution, timeout=None):
+        """Yields (page, channel_sums, pixel_count) as the worker finishes each page of the range.
+
+        The worker starts the range as soon as it is sent, so timeout counts
+        render time only; TimeoutError is raised once it has passed.
+        """
+        self.connection.send((pdf_path, list(pages), mode, resolution))
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            wait = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            if not self.connection.poll(wait):
+                raise TimeoutError(f"The rasterizer ran longer than {timeout:.0f}s")
+            message = self.connection.recv()
+            if message[0] == "done":
+                return
+            if message[0] == "error":
+                raise RuntimeError(message[1])
+            yield message[1:]
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class RasterizerPool:
+    """Up to workers rasterizer processes, each rendering one range at a time.
+
+    A range waits for a free worker before its time budget starts. A worker
+    that did not finish its range (it ran out of time, failed, or the caller
+    stopped reading) is killed and replaced; the other workers keep running.
+    """
+
+    def __init__(self, workers):
+        self.context = multiprocessing.get_context()
+        self._slots = threading.BoundedSemaphore(workers)
+        self._idle = []
+        self._workers = set()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        try:
+            worker = RasterizerWorker(self.context)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def release(self, worker, reuse):
+        with self._lock:
+            if reuse and worker in self._workers:
+                self._idle.append(worker)
+            else:
+                self._workers.discard(worker)
+                reuse = False
+        if not reuse:
+            worker.kill()
+        self._slots.release()
+
+    def render(self, pdf_path, pages, mode, resolution, timeout=None):
+        """Yields (page, channel_sums, pixel_count) for the range; see RasterizerWorker.render."""
+        worker = self.acquire()
+        finished = False
+        try:
+            yield from worker.render(pdf_path, pages, mode, resolution, timeout)
+            finished = True
+        finally:
+            self.release(worker, finished)
+
+    def close(self):
+        """Kills every worker; ranges still rendering fail."""
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+            self._idle.clear()
+        for worker in workers:
+            worker.kill()
+
+
+def rasterizer_pool():
+    """Returns the shared pool of rasterizer worker processes, starting it on first use."""
+    global _pool
+    if pymupdf is None:
+        raise RuntimeError("The pymupdf render backend needs PyMuPDF (pip install pymupdf)")
+    with _pool_lock:
+        if _pool is None:
+            _pool = RasterizerPool(rasterizer_workers or os.cpu_count() or 1)
+        return _pool
+
+
+def shutdown_rasterizer():
+    """Stops the rasterizer workers.
+
+    Entry points that can exit in the middle of a job (the GUI, batch, the
+    service and spool workers) call it on the way out, so no worker
+    outlives them.
+    """
+    global _pool
+    with _pool_lock:
+        pool = _pool
+        _pool = None
+    if pool is not None:
+        pool.close()
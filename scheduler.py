@@ -0,0 +1,245 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import timed
+
+# Maximum number of Ghostscript processes running at once (None uses the CPU count)
+max_workers = None
+# Smallest page range handed to a single Ghostscript process
+min_chunk_pages = 1
+# Shared cap on Ghostscript processes across every job in this process, set with set_process_limit
+process_limit = None
+_process_slots = None
+# Bytes of page rasters all running chunks may hold at once, set with set_memory_budget
+memory_budget = None
+_memory = None
+
+
+def set_process_limit(limit):
+    """Caps the number of chunks running at once across all jobs (None removes the cap)."""
+    global process_limit, _process_slots
+    process_limit = limit
+    _process_slots = threading.BoundedSemaphore(limit) if limit else None
+
+
+class MemoryBudget:
+    """Counting semaphore over bytes. A request larger than the whole budget waits until it can run alone."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._changed = threading.Condition()
+
+    def acquire(self, amount):
+        """Blocks until amount bytes are free and returns the amount actually reserved."""
+        amount = min(amount, self.limit)
+        with self._changed:
+            self._changed.wait_for(lambda: self.used + amount <= self.limit)
+            self.used += amount
+        return amount
+
+    def release(self, amount):
+        with self._changed:
+            self.used -= amount
+            self._changed.notify_all()
+
+
+def physical_memory():
+    """Returns the installed memory in bytes, or None where it cannot be read."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def set_memory_budget(limit):
+    """Caps the raster memory of all running chunks across all jobs (None removes the cap)."""
+    global memory_budget, _memory
+    memory_budget = limit
+    _memory = MemoryBudget(limit) if limit else None
+
+
+@contextmanager
+def process_slot(metrics=None, memory=0):
+    """Holds one slot of the shared process limit and memory bytes of the budget while a chunk runs.
+
+    Waiting for either is timed as queue_wait. Large pages reserve more of
+    the budget, so fewer of them run at once while small pages keep every
+    slot busy.
+    """
+    slots = _process_slots
+    budget = _memory if memory else None
+    if slots is None and budget is None:
+        yield
+        return
+    reserved = 0
+    with timed("queue_wait", metrics):
+        if slots is not None:
+            slots.acquire()
+        if budget is not None:
+            reserved = budget.acquire(memory)
+    try:
+        yield
+    finally:
+        if budget is not None:
+            budget.release(reserved)
+        if slots is not None:
+            slots.release()
+
+
+# Half of the installed memory by default
+set_memory_budget(physical_memory() // 2 if physical_memory() else None)
+
+
+def worker_count(page_count, workers=None):
+    """Returns how many workers to use for a job with page_count pages."""
+    workers = workers or max_workers or os.cpu_count() or 1
+    return max(1, min(workers, page_count))
+
+
+class PageRangeDispenser:
+    """Hands out contiguous runs of pages to workers.
+
+    Chunk sizes follow guided self-scheduling: each request gets a share of
+    the remaining pages proportional to the worker count, so early chunks are
+    large (few process launches) and the tail is split into small chunks that
+    workers which finish early pick up.
+    """
+
+    def __init__(self, pages, workers, min_chunk=None):
+        self.pages = list(pages)
+        self.workers = max(1, workers)
+        self.min_chunk = max(1, min_chunk or min_chunk_pages)
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def next_chunk(self):
+        """Returns the next list of pages, or None when every page was handed out."""
+        with self._lock:
+            remaining = len(self.pages) - self._position
+            if remaining <= 0:
+                return None
+            size = max(self.min_chunk, -(-remaining // (2 * self.workers)))
+            chunk = self.pages[self._position:self._position + size]
+            self._position += len(chunk)
+            return chunk
+
+
+def run_page_chunks(pages, chunk_function, workers=None, min_chunk=None, stop_event=None, metrics=None,
+                    chunk_memory=None):
+    """Runs chunk_function(chunk_pages) over all pages and returns [(chunk_pages, result)].
+
+    Each worker thread keeps pulling chunks from a shared dispenser until the
+    document is done or stop_event is set. Results are ordered by their first page.
+    Waits for the shared process limit are recorded in metrics.
+    chunk_memory(chunk_pages), if given, estimates the raster bytes of a
+    chunk, which it holds from the shared memory budget while it runs.
+    """
+    pages = list(pages)
+    if not pages:
+        return []
+    workers = worker_count(len(pages), workers)
+    dispenser = PageRangeDispenser(pages, workers, min_chunk)
+
+    def worker():
+        results = []
+        while stop_event is None or not stop_event.is_set():
+            chunk = dispenser.next_chunk()
+            if chunk is None:
+                return results
+            with process_slot(metrics, chunk_memory(chunk) if chunk_memory else 0):
+                results.append((chunk, chunk_function(chunk)))
+        return results
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(worker) for _ in range(workers)]
+        results = [item for future in futures for item in future.result()]
+    return sorted(results, key=lambda item: item[0][0])
+
+
+def iter_page_chunks(pages, chunk_function, workers=None, min_chunk=None, max_pending=64, stop_event=None,
+                     metrics=None, chunk_memory=None):
+    """Runs the generator chunk_function(chunk_pages) over all pages and yields its items as they arrive.
+
+    Items are yielded in completion order. No new chunk is started once
+    stop_event is set. At most max_pending items wait in
+    the queue, so slow consumers hold the workers back instead of letting
+    results pile up in memory. chunk_memory works as in run_page_chunks.
+    """
+    pages = list(pages)
+    if not pages:
+        return
+    workers = worker_count(len(pages), workers)
+    dispenser = PageRangeDispenser(pages, workers, min_chunk)
+    results = queue.Queue(maxsize=max_pending)
+    stopped = threading.Event()
+    finished = object()
+
+    def publish(item):
+        while not stopped.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        try:
+            while not stopped.is_set() and (stop_event is None or not stop_event.is_set()):
+                chunk = dispenser.next_chunk()
+                if chunk is None:
+                    break
+                with process_slot(metrics, chunk_memory(chunk) if chunk_memory else 0):
+                    items = chunk_function(chunk)
+                    try:
+                        for item in items:
+                            if not publish((None, item)):
+                                return
+                    finally:
+                        items.close()
+        except Exception as e:
+            publish((e, None))
+        finally:
+            publish((finished, None))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        running = len(threads)
+        while running:
+            error, item = results.get()
+            if error is finished:
+                running -= 1
+            elif error is not None:
+                raise error
+            else:
+                yield item
+    finally:
+        # Release workers blocked on a full queue when the consumer stops early
+        stopped.set()
+        for thread in threads:
+            thread.join()
+
+
+def page_range_arguments(pages):
+    """Returns the Ghostscript arguments that select the given pages."""
+    pages = sorted(pages)
+    if pages == list(range(pages[0], pages[-1] + 1)):
+        return [f"-dFirstPage={pages[0]}", f"-dLastPage={pages[-1]}"]
+
+    # Compress into a PageList such as 1-3,7,9-12
+    ranges = []
+    start = previous = pages[0]
+    for page in pages[1:] + [None]:
+        if page is not None and page == previous + 1:
+            previous = page
+            continue
+        ranges.append(f"{start}-{previous}" if previous != start else f"{start}")
+        if page is not None:
+            start = previous = page
+    return [f"-sPageList={','.join(ranges)}"]
@@ -0,0 +1,408 @@
+"""Local HTTP quoting service: upload a PDF, poll or stream its progress, read per-printer costs.
+
+Example:
+    python service.py --port 8750
+    curl --data-binary @order.pdf "http://127.0.0.1:8750/jobs?mode=color&double=1"
+    curl http://127.0.0.1:8750/jobs/<id>/events
+    python service.py --spool /shared/spool.db --upload-dir /shared/uploads   # render on spool workers
+
+Endpoints:
+    POST   /jobs?mode=color|grayscale&double=0|1  body is the PDF; returns {"id": ...} (202)
+    GET    /jobs/<id>                             job status, progress and costs
+    GET    /jobs/<id>/events                      JSON Lines stream of status updates until the job ends
+    DELETE /jobs/<id>                             cancels the job
+    GET    /status                                queue depth and worker counts
+    GET    /metrics                               stage timings in the Prometheus text format
+
+Uploads are refused with 503 and a Retry-After header while max_queued_jobs
+jobs are waiting, so a burst of uploads never queues more work than that.
+"""
+import argparse
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import metrics
+import scheduler
+from catalog import Catalog
+from document_index import document_index, forget_document
+import main as main_module
+from main import CoverageJob, JobCancelled, logger, setup_logger
+from pricing import coverage_usage, document_paper_cost, ink_cost, printers_for_mode, unpriced_sizes
+from render_backend import shutdown_rasterizer
+from spool import Spool
+
+# Jobs costed at once; their page ranges share process_limit Ghostscript processes
+job_workers = 2
+process_limit = os.cpu_count() or 1
+# Uploads waiting for a worker; more are refused with 503 until the queue drains
+max_queued_jobs = 16
+max_upload_bytes = 200 * 1024 * 1024
+# Finished jobs kept for status requests, oldest first out
+max_finished_jobs = 256
+# Seconds a client is asked to wait before uploading again when the queue is full
+retry_after = 5
+finished_states = ("done", "failed", "cancelled")
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at max_queued_jobs."""
+
+
+class QuoteJob:
+    """One uploaded PDF and its progress; readers wait on changed for updates."""
+
+    def __init__(self, pdf_path, mode, double_sided):
+        self.id = uuid.uuid4().hex
+        self.pdf_path = pdf_path
+        self.mode = mode
+        self.double_sided = double_sided
+        self.status = "queued"
+        self.pages_done = 0
+        self.page_count = None
+        self.costs = None
+        self.error = None
+        self.metrics = None
+        # Pages that could not be measured and count at the average coverage, {page: "failed" or "timeout"}
+        self.flagged_pages = {}
+        # Paper sizes of the document without a price; their sheets are not in the paper cost
+        self.unpriced_paper = []
+        self.created = time.time()
+        self.coverage_job = None
+        self.cancel_requested = False
+        # Bumped on every update so event streams can tell what they have sent
+        self.version = 0
+        self.changed = threading.Condition()
+
+    def update(self, **fields):
+        with self.changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self.changed.notify_all()
+
+    def wait_for_update(self, version, timeout):
+        """Waits until the job changes past version and returns its current snapshot."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version, self.snapshot()
+
+    def snapshot(self):
+        return {
+            "id": self.id, "status": self.status, "mode": self.mode, "double_sided": self.double_sided,
+            "pages_done": self.pages_done, "page_count": self.page_count,
+            "costs": self.costs, "error": self.error, "metrics": self.metrics,
+            "flagged_pages": self.flagged_pages, "unpriced_paper": self.unpriced_paper,
+        }
+
+
+def printer_costs(printers, mode, usage, paper):
+    """Per-printer cost rows for the ink usage, as shown by the cost tab."""
+    costs = {}
+    for printer_name, printer_info in printers_for_mode(printers, mode).items():
+        ink = ink_cost(printer_info, usage)
+        costs[printer_name] = {
+            "ink_cost": round(ink, 4), "paper_cost": round(paper, 4), "total_cost": round(ink + paper, 4),
+        }
+    return costs
+
+
+class QuoteService:
+    """Bounded queue of quote jobs served by a fixed pool of worker threads."""
+
+    def __init__(self, catalog, workers=None, processes=None, max_queued=None, upload_dir=None):
+        # Prices are read when a job is priced, so catalog edits apply to the next job
+        self.catalog = catalog
+        self.pending = queue.Queue(maxsize=max_queued or max_queued_jobs)
+        self.jobs = {}
+        self.jobs_lock = threading.Lock()
+        self.upload_dir = upload_dir or tempfile.mkdtemp(prefix="pdf2printcost-uploads-")
+        self.stopping = threading.Event()
+        scheduler.set_process_limit(processes or process_limit)
+        self.workers = [
+            threading.Thread(target=self.work, name=f"quote-worker-{index}", daemon=True)
+            for index in range(workers or job_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, upload, size, mode="color", double_sided=False):
+        """Stores size bytes read from the upload file and queues the job. Raises QueueFull."""
+        if self.pending.full():
+            raise QueueFull()
+        fd, pdf_path = tempfile.mkstemp(suffix=".pdf", dir=self.upload_dir)
+        with os.fdopen(fd, "wb") as file:
+            remaining = size
+            while remaining > 0:
+                block = upload.read(min(remaining, 1 << 20))
+                if not block:
+                    break
+                file.write(block)
+                remaining -= len(block)
+        if remaining > 0:
+            os.remove(pdf_path)
+            raise ValueError("upload ended before Content-Length bytes were received")
+
+        job = QuoteJob(pdf_path, mode, double_sided)
+        try:
+            self.pending.put_nowait(job)
+        except queue.Full:
+            os.remove(pdf_path)
+            raise QueueFull()
+        with self.jobs_lock:
+            self.jobs[job.id] = job
+            self.forget_finished()
+        logger.info(f"Quote job {job.id} queued ({mode}, {size} bytes)")
+        return job
+
+    def forget_finished(self):
+        """Drops the oldest finished jobs beyond max_finished_jobs (jobs_lock held)."""
+        finished = [job for job in self.jobs.values() if job.status in finished_states]
+        for job in sorted(finished, key=lambda job: job.created)[:max(0, len(finished) - max_finished_jobs)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id):
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel_requested = True
+        if job.status == "queued":
+            # The worker that picks it up will skip it
+            job.update(status="cancelled")
+        elif job.coverage_job is not None:
+            job.coverage_job.cancel()
+        return job
+
+    def status(self):
+        with self.jobs_lock:
+            running = sum(job.status == "running" for job in self.jobs.values())
+        return {
+            "queued": self.pending.qsize(), "max_queued": self.pending.maxsize,
+            "running": running, "workers": len(self.workers), "processes": scheduler.process_limit,
+        }
+
+    def work(self):
+        while not self.stopping.is_set():
+            try:
+                job = self.pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                if not job.cancel_requested:
+                    self.run(job)
+            finally:
+                if os.path.exists(job.pdf_path):
+                    forget_document(job.pdf_path)
+                    os.remove(job.pdf_path)
+                self.pending.task_done()
+
+    def run(self, job):
+        """Measures the coverage of one job and prices it for every printer."""
+        def progress(pages_done, page_count, coverage):
+            job.update(pages_done=pages_done, page_count=page_count)
+
+        coverage_job = CoverageJob(job.pdf_path)
+        coverage_job.metrics.observe("job_queue_wait", time.time() - job.created)
+        metrics.registry.observe("job_queue_wait", time.time() - job.created)
+        try:
+            index = document_index(job.pdf_path)
+            pages = index.page_count
+            with coverage_job:
+                job.update(status="running", page_count=pages, coverage_job=coverage_job)
+                if job.cancel_requested:
+                    coverage_job.cancel()
+                if job.mode == "color":
+                    coverage = coverage_job.color_coverage(progress)
+                else:
+                    coverage = coverage_job.grayscale_coverage(progress)
+            self.catalog.poll()
+            printers, papers = self.catalog.printers(), self.catalog.papers()
+            paper = document_paper_cost(index.page_sizes(), papers, job.double_sided)
+            costs = printer_costs(printers, job.mode, coverage_usage(coverage), paper)
+            job.update(status="done", pages_done=pages, costs=costs, coverage_job=None,
+                       metrics=coverage_job.metrics.snapshot(), flagged_pages=coverage_job.flagged_pages(),
+                       unpriced_paper=unpriced_sizes(index.page_sizes(), papers))
+            logger.info(f"Quote job {job.id} done")
+        except JobCancelled:
+            job.update(status="cancelled", coverage_job=None, metrics=coverage_job.metrics.snapshot())
+            logger.info(f"Quote job {job.id} cancelled")
+        except Exception as e:
+            logger.error(f"Quote job {job.id} failed: {e}")
+            job.update(status="failed", error=str(e), coverage_job=None, metrics=coverage_job.metrics.snapshot())
+
+    def close(self):
+        """Stops the workers, cancelling running jobs, and removes pending uploads."""
+        self.stopping.set()
+        with self.jobs_lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            self.cancel(job.id)
+        for worker in self.workers:
+            worker.join()
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+
+class QuoteHandler(BaseHTTPRequestHandler):
+    """HTTP front end of a QuoteService, which is set as server.service."""
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def route(self):
+        """Splits the path into its parts, e.g. /jobs/<id>/events -> ["jobs", "<id>", "events"]."""
+        return [part for part in urlparse(self.path).path.split("/") if part]
+
+    def do_POST(self):
+        service = self.server.service
+        if self.route() != ["jobs"]:
+            self.send_json(404, {"error": "not found"})
+            return
+        query = parse_qs(urlparse(self.path).query)
+        mode = query.get("mode", ["grayscale"])[0]
+        double_sided = query.get("double", ["0"])[0] in ("1", "true", "yes")
+        if mode not in ("color", "grayscale"):
+            self.send_json(400, {"error": "mode must be color or grayscale"})
+            return
+        try:
+            size = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self.send_json(411, {"error": "Content-Length is required"})
+            return
+        if size <= 0:
+            self.send_json(400, {"error": "the upload is empty"})
+            return
+        if size > max_upload_bytes:
+            self.send_json(413, {"error": f"upload is larger than {max_upload_bytes} bytes"})
+            self.close_connection = True
+            return
+
+        try:
+            job = service.submit(self.rfile, size, mode, double_sided)
+        except QueueFull:
+            # The body is not read; closing the connection discards it
+            self.close_connection = True
+            self.send_json(503, {"error": "queue is full"}, {"Retry-After": str(retry_after)})
+            return
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(202, job.snapshot(), {"Location": f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        service = self.server.service
+        parts = self.route()
+        if parts == ["status"]:
+            self.send_json(200, service.status())
+            return
+        if parts == ["metrics"]:
+            data = metrics.export_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        job = service.get(parts[1]) if len(parts) in (2, 3) and parts[0] == "jobs" else None
+        if job is None:
+            self.send_json(404, {"error": "not found"})
+        elif len(parts) == 2:
+            self.send_json(200, job.snapshot())
+        elif parts[2] == "events":
+            self.stream_events(job)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def stream_events(self, job):
+        """Writes one JSON line per update until the job is finished, then closes the connection."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        self.close_connection = True
+        version = None
+        try:
+            while True:
+                version, snapshot = job.wait_for_update(version, timeout=15)
+                self.wfile.write(json.dumps(snapshot).encode("utf-8") + b"\n")
+                self.wfile.flush()
+                if snapshot["status"] in finished_states:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_DELETE(self):
+        parts = self.route()
+        job = self.server.service.cancel(parts[1]) if len(parts) == 2 and parts[0] == "jobs" else None
+        if job is None:
+            self.send_json(404, {"error": "not found"})
+        else:
+            self.send_json(202, job.snapshot())
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+def make_server(service, host="127.0.0.1", port=8750):
+    server = ThreadingHTTPServer((host, port), QuoteHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve PDF printing cost quotes over local HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8750)
+    parser.add_argument("--catalog", help="printer and paper catalog (default: catalog.db)")
+    parser.add_argument("--printers", help="import the printers of this JSON file into the catalog first")
+    parser.add_argument("--papers", help="import the paper prices of this JSON file into the catalog first")
+    parser.add_argument("--workers", type=int, help="jobs costed at once")
+    parser.add_argument("--processes", type=int, help="Ghostscript processes shared by all jobs")
+    parser.add_argument("--max-queued", type=int, help="uploads waiting for a worker before 503")
+    parser.add_argument("--spool", help="render through spool workers using this shared spool database")
+    parser.add_argument("--upload-dir", help="keep uploads below this directory (shared storage when spooling)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logger()
+    if args.spool:
+        main_module.default_spool = Spool(args.spool)
+    upload_dir = tempfile.mkdtemp(prefix="pdf2printcost-uploads-", dir=args.upload_dir) if args.upload_dir else None
+    catalog = Catalog(args.catalog)
+    if args.printers or args.papers:
+        catalog.import_json(args.printers, args.papers)
+    service = QuoteService(catalog, args.workers, args.processes, args.max_queued, upload_dir)
+    server = make_server(service, args.host, args.port)
+    logger.info(f"Quote service listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        catalog.close()
+        shutdown_rasterizer()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""Sharded rendering: page ranges go through a SQLite spool to worker processes on any host.
+
+A coordinator (a CoverageJob created with spool=Spool(path)) plans the
+document as usual, puts the pages to render into the spool as page-range
+tasks and reads the per-page records back as workers finish them. Blank
+pages, duplicates, the page store, page statuses and caching all work as
+for a local job. Workers lease one task at a time and keep the lease alive
+while they render. A task whose worker dies is leased again once its lease
+runs out, up to max_attempts times.
+
+The spool file and the PDFs must be on storage every worker can reach
+under the same path, with working file locks, and the hosts' clocks must
+roughly agree (leases are wall clock times).
+
+Example:
+    python spool.py worker /shared/spool.db                    # on every rendering host
+    python spool.py measure order.pdf --spool /shared/spool.db --workers 4   # local test run
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from main import CoverageJob, log_file, logger, pipe_devices, range_renderers, setup_logger
+from render_backend import shutdown_rasterizer
+
+# Pages per spooled task
+task_pages = 4
+# Seconds a leased task stays with its worker without a heartbeat
+lease_seconds = 30
+# Times a task is leased before its pages are flagged "failed"
+max_attempts = 3
+# Seconds between spool polls of idle workers and of the coordinator
+poll_interval = 0.2
+# Seconds a connection waits for another process's write lock
+busy_timeout = 30
+
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY, pdf_path TEXT NOT NULL, mode TEXT NOT NULL, resolution INTEGER NOT NULL,
+    backend TEXT NOT NULL, created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY, job_id TEXT NOT NULL, pages TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', worker TEXT, lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0, error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, lease_until);
+CREATE INDEX IF NOT EXISTS tasks_by_job ON tasks (job_id, status);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY, job_id TEXT NOT NULL, page INTEGER NOT NULL, sums TEXT,
+    pixels INTEGER NOT NULL, status TEXT NOT NULL, UNIQUE (job_id, page)
+);
+"""
+
+
+class Spool:
+    """Task queue and result store in one SQLite file; safe to use from many threads and processes."""
+
+    def __init__(self, path):
+        self.path = path
+        connection = sqlite3.connect(path, timeout=busy_timeout)
+        try:
+            connection.executescript(schema)
+        finally:
+            connection.close()
+
+    @contextmanager
+    def connect(self):
+        """Opens a connection for one transaction; BEGIN IMMEDIATE takes the write lock up front."""
+        connection = sqlite3.connect(self.path, timeout=busy_timeout, isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def submit(self, pdf_path, pages, mode, resolution, backend):
+        """Queues the pages as tasks of task_pages pages and returns the spool job id."""
+        job_id = uuid.uuid4().hex
+        pages = list(pages)
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, pdf_path, mode, resolution, backend, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, os.path.realpath(pdf_path), mode, resolution, backend, time.time()),
+            )
+            connection.executemany(
+                "INSERT INTO tasks (job_id, pages) VALUES (?, ?)",
+                [(job_id, json.dumps(pages[start:start + task_pages])) for start in range(0, len(pages), task_pages)],
+            )
+        return job_id
+
+    def lease(self, worker):
+        """Leases the oldest pending or abandoned task to worker.
+
+        Returns {"id", "pages", "pdf_path", "mode", "resolution", "backend"},
+        or None when there is nothing to do. Abandoned tasks that were
+        leased max_attempts times fail instead.
+        """
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute(
+                "UPDATE tasks SET status = 'failed', error = 'worker lost' "
+                "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, max_attempts),
+            )
+            row = connection.execute(
+                "SELECT tasks.id, tasks.pages, jobs.pdf_path, jobs.mode, jobs.resolution, jobs.backend "
+                "FROM tasks JOIN jobs ON jobs.id = tasks.job_id "
+                "WHERE tasks.status = 'pending' OR (tasks.status = 'leased' AND tasks.lease_until < ?) "
+                "ORDER BY tasks.id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                (worker, now + lease_seconds, row[0]),
+            )
+        task_id, pages, pdf_path, mode, resolution, backend = row
+        return {"id": task_id, "pages": json.loads(pages), "pdf_path": pdf_path, "mode": mode,
+                "resolution": resolution, "backend": backend}
+
+    def heartbeat(self, task_id, worker):
+        """Extends the lease; returns False when the task is no longer this worker's."""
+        with self.connect() as connection:
+            cursor = connection.execute(
+                "UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (time.time() + lease_seconds, task_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, task_id, worker, records):
+        """Stores [(page, channel_sums, pixel_count, status)] and finishes the task in one transaction.
+
+        Records of a worker that lost its lease are dropped; the task's new
+        owner reports them instead.
+        """
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT job_id FROM tasks WHERE id = ? AND worker = ? AND status = 'leased'", (task_id, worker),
+            ).fetchone()
+            if row is None:
+                return False
+            connection.executemany(
+                "INSERT OR REPLACE INTO pages (job_id, page, sums, pixels, status) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (row[0], page, json.dumps([int(value) for value in sums]) if sums is not None else None,
+                     int(pixels), status)
+                    for page, sums, pixels, status in records
+                ],
+            )
+            connection.execute("UPDATE tasks SET status = 'done', error = NULL WHERE id = ?", (task_id,))
+        return True
+
+    def release(self, task_id, worker, error):
+        """Gives a task back after an error; it is retried until it was leased max_attempts times."""
+        with self.connect() as connection:
+            connection.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "worker = NULL, lease_until = NULL, error = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (max_attempts, str(error), task_id, worker),
+            )
+
+    def progress(self, job_id, after=0):
+        """Returns (records, failed_pages, open_tasks) of a job.
+
+        records are [(row id, page, channel_sums, pixel_count, status)] stored
+        after the row id after; failed_pages are the pages of tasks that failed
+        for good.
+        """
+        with self.connect() as connection:
+            records = [
+                (row_id, page, np.array(json.loads(sums), dtype=np.uint64) if sums is not None else None,
+                 pixels, status)
+                for row_id, page, sums, pixels, status in connection.execute(
+                    "SELECT id, page, sums, pixels, status FROM pages WHERE job_id = ? AND id > ? ORDER BY id",
+                    (job_id, after),
+                )
+            ]
+            failed_pages = [
+                page for (pages,) in connection.execute(
+                    "SELECT pages FROM tasks WHERE job_id = ? AND status = 'failed'", (job_id,),
+                )
+                for page in json.loads(pages)
+            ]
+            open_tasks = connection.execute(
+                "SELECT COUNT(*) FROM tasks WHERE job_id = ? AND status IN ('pending', 'leased')", (job_id,),
+            ).fetchone()[0]
+        return records, failed_pages, open_tasks
+
+    def remove(self, job_id):
+        """Deletes a job with its tasks and records; workers drop results of its running tasks."""
+        with self.connect() as connection:
+            connection.execute("DELETE FROM pages WHERE job_id = ?", (job_id,))
+            connection.execute("DELETE FROM tasks WHERE job_id = ?", (job_id,))
+            connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def iter_results(self, pdf_path, pages, mode, resolution, backend, job=None):
+        """Spools the pages and yields (page, channel_sums, pixel_count, status) as workers report them.
+
+        This is the coordinator side, used by CoverageJob.iter_page_sums.
+        Pages of tasks that failed for good are yielded as "failed"; when the
+        job is cancelled or its time budget runs out, the spooled job is
+        removed and the pages still missing are yielded as "timeout" (not at
+        all when cancelled).
+        """
+        pages = list(pages)
+        if not pages:
+            return
+        job_id = self.submit(pdf_path, pages, mode, resolution, backend)
+        logger.info(f"Spooled {len(pages)} pages of {pdf_path} as job {job_id}")
+        missing = set(pages)
+        last_row = 0
+        try:
+            while missing:
+                records, failed_pages, open_tasks = self.progress(job_id, last_row)
+                for row_id, page, sums, pixels, status in records:
+                    last_row = row_id
+                    if page in missing:
+                        missing.discard(page)
+                        yield page, sums, pixels, status
+                for page in failed_pages:
+                    if page in missing:
+                        missing.discard(page)
+                        yield page, None, 0, "failed"
+                if not missing or open_tasks == 0:
+                    break
+                if job is not None:
+                    if job.cancelled.is_set():
+                        return
+                    if job.deadline is not None and time.monotonic() >= job.deadline:
+                        break
+                time.sleep(poll_interval)
+            for page in sorted(missing):
+                yield page, None, 0, "timeout"
+        finally:
+            self.remove(job_id)
+
+
+def render_task(task):
+    """Renders a leased task on this host and returns its page records."""
+    render_range = range_renderers[task["backend"]]
+    with CoverageJob(task["pdf_path"], task["resolution"], backend=task["backend"]) as job:
+        return list(job.render_pages(render_range, task["pages"], task["mode"], task["resolution"]))
+
+
+def run_worker(spool, worker=None, stop_event=None, exit_when_idle=False):
+    """Leases and renders tasks until stop_event is set (or the spool is empty, with exit_when_idle)."""
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    stop_event = stop_event or threading.Event()
+    logger.info(f"Spool worker {worker} started on {spool.path}")
+    while not stop_event.is_set():
+        task = spool.lease(worker)
+        if task is None:
+            if exit_when_idle:
+                break
+            stop_event.wait(poll_interval)
+            continue
+
+        # Keeps the lease alive while the task renders
+        done = threading.Event()
+
+        def keep_alive(task_id=task["id"]):
+            while not done.wait(lease_seconds / 3):
+                if not spool.heartbeat(task_id, worker):
+                    return
+
+        heartbeat = threading.Thread(target=keep_alive, daemon=True)
+        heartbeat.start()
+        try:
+            records = render_task(task)
+            spool.complete(task["id"], worker, records)
+        except Exception as e:
+            logger.error(f"Spool worker {worker} failed on task {task['id']}: {e}")
+            spool.release(task["id"], worker, e)
+        finally:
+            done.set()
+            heartbeat.join()
+    logger.info(f"Spool worker {worker} stopped")
+
+
+def start_local_workers(spool_path, count):
+    """Starts count worker processes on this host, e.g. to try the spool without other machines."""
+    return [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", spool_path])
+        for _ in range(count)
+    ]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render page ranges through a shared SQLite spool.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    worker = commands.add_parser("worker", help="render spooled tasks until stopped")
+    worker.add_argument("spool", help="spool database on shared storage")
+    worker.add_argument("--exit-when-idle", action="store_true", help="stop once no task is waiting")
+    measure = commands.add_parser("measure", help="measure a PDF through the spool")
+    measure.add_argument("pdf")
+    measure.add_argument("--spool", required=True, help="spool database on shared storage")
+    measure.add_argument("--mode", choices=sorted(pipe_devices), default="color")
+    measure.add_argument("--resolution", type=int, help="render resolution in dpi")
+    measure.add_argument("--backend", choices=sorted(range_renderers), help="renderer used by the workers")
+    measure.add_argument("--workers", type=int, default=0, help="local worker processes to start")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "worker":
+        # Every worker process has a log file of its own
+        setup_logger(f"{log_file}.worker-{os.getpid()}")
+        try:
+            run_worker(Spool(args.spool), exit_when_idle=args.exit_when_idle)
+        finally:
+            shutdown_rasterizer()
+        return 0
+
+    setup_logger()
+    spool = Spool(args.spool)
+    workers = start_local_workers(args.spool, args.workers)
+    try:
+        with CoverageJob(args.pdf, args.resolution, backend=args.backend, spool=spool) as job:
+            coverage = job.color_coverage() if args.mode == "color" else job.grayscale_coverage()
+            print(json.dumps({"coverage": coverage, "flagged_pages": job.flagged_pages()}))
+    finally:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The modules keep their log, coverage cache and page store in the working directory
+os.chdir(tempfile.mkdtemp(prefix="pdf2printcost-tests-"))
+
+pymupdf = pytest.importorskip("pymupdf")
+
+import main  # noqa: E402
+from coverage_cache import CoverageCache  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def pymupdf_backend(monkeypatch, tmp_path):
+    """Renders with the in-process rasterizer, so the tests need no Ghostscript, and caches nothing."""
+    monkeypatch.setattr(main, "default_render_backend", "pymupdf")
+    monkeypatch.setattr(main, "use_page_store", False)
+    monkeypatch.setattr(main, "coverage_cache", CoverageCache(str(tmp_path / "coverage_cache")))
+
+
+@pytest.fixture
+def sample_pdf(tmp_path):
+    """Six A4 pages with different ink: full black, half cyan, a magenta band, blank, red text, and a copy of page 1."""
+    path = tmp_path / "sample.pdf"
+    document = pymupdf.open()
+    width, height = pymupdf.paper_size("a4")
+    for number in range(6):
+        page = document.new_page(width=width, height=height)
+        if number in (0, 5):
+            page.draw_rect(page.rect, color=None, fill=(0, 0, 0))
+        elif number == 1:
+            page.draw_rect(pymupdf.Rect(0, 0, width / 2, height), color=None, fill=(0, 1, 1))
+        elif number == 2:
+            page.draw_rect(pymupdf.Rect(0, 100, width, 200), color=None, fill=(1, 0, 1))
+        elif number == 4:
+            page.insert_text((72, 72), "Quote " * 10, fontsize=24, color=(1, 0, 0))
+    document.save(path)
+    document.close()
+    return str(path)
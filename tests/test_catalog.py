@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+
+import catalog
+from catalog import Catalog
+
+inks = {"Black": {"price": 30.0, "yield": 1500}}
+
+
+def test_new_catalog_imports_json_once(monkeypatch, tmp_path):
+    printers_path, papers_path = tmp_path / "printers.json", tmp_path / "papers.json"
+    printers_path.write_text(json.dumps({"Laser": {"is_color": False, "inks": inks}}))
+    papers_path.write_text(json.dumps({"A4": 0.05}))
+    monkeypatch.setattr(catalog, "printers_file", str(printers_path))
+    monkeypatch.setattr(catalog, "papers_file", str(papers_path))
+    path = str(tmp_path / "catalog.db")
+
+    first = Catalog(path)
+    assert first.printers() == {"Laser": {"is_color": False, "inks": inks}}
+    assert first.papers() == {"A4": 0.05}
+    first.delete_printer("Laser")
+    first.close()
+    # The old JSON files do not bring a deleted printer back
+    assert Catalog(path).printers() == {}
+
+
+def test_changes_reach_other_processes(tmp_path):
+    path = str(tmp_path / "catalog.db")
+    shared = Catalog(path)
+    changes = []
+    shared.subscribe(lambda changed: changes.append(sorted(changed.printers())))
+
+    assert shared.add_printer("Laser", False, inks)
+    assert shared.add_printer("Laser", False, inks) is False
+    assert changes == [["Laser"]]
+
+    subprocess.run([sys.executable, "-c", (
+        "import sys; sys.path.insert(0, sys.argv[2]); from catalog import Catalog; "
+        "Catalog(sys.argv[1]).put_printer('New', True, {'Cyan': {'price': 20.0, 'yield': 1000}})"
+    ), path, os.path.dirname(catalog.__file__)], check=True, timeout=60)
+
+    assert shared.poll()
+    assert not shared.poll()
+    assert changes == [["Laser"], ["Laser", "New"]]
+    assert shared.printer_names(is_color=True) == ["New"]
+    assert shared.printers_with_ink("Cyan") == ["New"]
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from cost_engine import evaluate_costs
+from document_index import document_index
+from main import CoverageJob, page_area_weights
+from pricing import coverage_usage, document_paper_cost, ink_cost
+
+printers = {
+    "Laser": {"is_color": False, "inks": {"Black": {"price": 40.0, "yield": 2000}}},
+    "Color": {"is_color": True, "inks": {"Cyan": {"price": 20.0, "yield": 1000},
+                                         "Magenta": {"price": 25.0, "yield": 1200},
+                                         "Yellow": {"price": 15.0, "yield": 0},
+                                         "Black": {"price": 30.0, "yield": 1500}}},
+}
+papers = {"A4": 0.05}
+
+
+@pytest.fixture
+def measured(sample_pdf):
+    with CoverageJob(sample_pdf, 36) as job:
+        page_coverage = {"color": job.page_coverage("color"), "grayscale": job.page_coverage("grayscale")}
+        totals = {"color": job.color_coverage(), "grayscale": job.grayscale_coverage()}
+    return page_coverage, totals
+
+
+def test_costs_match_pricing(sample_pdf, measured):
+    page_coverage, totals = measured
+    ranges = [(1, None), (2, 4), (5, 5)]
+    copies = (1, 3)
+    page_sizes = document_index(sample_pdf).page_sizes()
+    table = evaluate_costs(printers, page_coverage, papers, ranges, copies,
+                           page_weights=page_area_weights(sample_pdf), page_sizes=page_sizes)
+    assert table.modes == ["color", "grayscale"]
+
+    for mode_index, mode in enumerate(table.modes):
+        for range_index, (first, last) in enumerate(ranges):
+            rows = page_coverage[mode][first - 1:last]
+            coverage = dict(zip(["Cyan", "Magenta", "Yellow", "Black"], rows.sum(axis=0)))
+            if mode == "grayscale":
+                coverage = coverage["Black"]
+            for side_index, double_sided in enumerate(table.double_sided):
+                paper = document_paper_cost(page_sizes[first - 1:last], papers, double_sided)
+                for copies_index, count in enumerate(copies):
+                    for printer_index, name in enumerate(table.printers):
+                        index = (mode_index, side_index, range_index, copies_index, printer_index)
+                        if mode == "color" and not printers[name]["is_color"]:
+                            assert np.isnan(table.ink[index]) and np.isnan(table.paper[index])
+                            continue
+                        expected = ink_cost(printers[name], coverage_usage(coverage)) * count
+                        assert table.ink[index] == pytest.approx(expected)
+                        assert table.paper[index] == pytest.approx(paper * count)
+
+    # The whole document matches the totals of the coverage run
+    whole = evaluate_costs(printers, page_coverage, papers, double_sided=(False,))
+    color = whole.ink[0, 0, 0, 0, whole.printers.index("Color")]
+    gray = whole.ink[1, 0, 0, 0, whole.printers.index("Laser")]
+    assert color == pytest.approx(ink_cost(printers["Color"], coverage_usage(totals["color"])), abs=1e-4)
+    assert gray == pytest.approx(ink_cost(printers["Laser"], coverage_usage(totals["grayscale"])), abs=1e-4)
+
+
+def test_duplex_sheets_round_up_per_copy(measured):
+    page_coverage, _ = measured
+    table = evaluate_costs(printers, page_coverage, papers, [(1, 3)], (1, 2), double_sided=(False, True))
+    side = table.double_sided.index(True)
+    # Three pages take two sheets double sided, and every copy starts a new sheet
+    assert table.paper[0, side, 0, :, table.printers.index("Color")] == pytest.approx([0.10, 0.20])
+    assert table.paper[0, 1 - side, 0, :, table.printers.index("Color")] == pytest.approx([0.15, 0.30])
+
+
+def test_grayscale_printers_are_left_out_of_color_rows(measured):
+    page_coverage, _ = measured
+    table = evaluate_costs(printers, page_coverage, papers)
+    laser = table.printers.index("Laser")
+    assert np.isnan(table.total[0, ..., laser]).all()
+    assert not np.isnan(table.total[1, ..., laser]).any()
+    assert {(row["mode"], row["printer"]) for row in table.rows()} == {
+        ("color", "Color"), ("grayscale", "Color"), ("grayscale", "Laser"),
+    }
+    assert (table.cheapest()[0] == "Color").all()
@@ -0,0 +1,28 @@
+import numpy as np
+
+import main
+from main import CoverageJob, plan_pages
+
+
+def test_plan_skips_blank_pages_and_reuses_copies(sample_pdf):
+    plan = plan_pages(sample_pdf, 36)
+    assert plan.render == [1, 2, 3, 5]
+    assert [page for page, _ in plan.blank] == [4]
+    assert plan.duplicates == {1: [6]}
+
+
+def test_plan_matches_coverage_without_skipping(monkeypatch, sample_pdf):
+    with CoverageJob(sample_pdf, 36) as job:
+        planned = job.page_coverage()
+        statuses = dict(job.page_status)
+    assert statuses[4] == "blank"
+    assert statuses[6] == statuses[1] == "ok"
+    assert planned[5, 3] == planned[0, 3] > 80
+
+    monkeypatch.setattr(main, "skip_blank_pages", False)
+    monkeypatch.setattr(main, "deduplicate_pages", False)
+    main.coverage_cache.clear()
+    assert plan_pages(sample_pdf, 36).render == [1, 2, 3, 4, 5, 6]
+    with CoverageJob(sample_pdf, 36) as job:
+        rendered = job.page_coverage()
+    np.testing.assert_allclose(planned, rendered, atol=1e-3)
@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pytest
+
+import main
+import render_backend
+from cost_engine import evaluate_costs
+from main import CoverageJob, NoPagesMeasured
+from pricing import coverage_usage, ink_cost
+
+
+def cached_entries():
+    return os.listdir(main.coverage_cache.cache_dir) if os.path.isdir(main.coverage_cache.cache_dir) else []
+
+
+@pytest.fixture
+def failing_page(monkeypatch):
+    """The in-process renderer fails every range that contains page 3."""
+    render_range = main.range_renderers["pymupdf"]
+
+    def fail_page_3(pdf_path, pages, *args):
+        if 3 in pages:
+            raise RuntimeError("page 3 does not render")
+        yield from render_range(pdf_path, pages, *args)
+
+    monkeypatch.setitem(main.range_renderers, "pymupdf", fail_page_3)
+
+
+@pytest.fixture
+def slow_rasterizer(monkeypatch):
+    """Rasterizer workers that take a second per page; they are forked, so they run the patched renderer."""
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("workers see the patched renderer only when forked")
+    render_page_sums = render_backend.render_page_sums
+
+    def slow_render_page_sums(*args):
+        time.sleep(1)
+        return render_page_sums(*args)
+
+    render_backend.shutdown_rasterizer()
+    monkeypatch.setattr(render_backend, "render_page_sums", slow_render_page_sums)
+    yield
+    render_backend.shutdown_rasterizer()
+
+
+def test_page_timeouts_leave_only_blank_pages(monkeypatch, slow_rasterizer, sample_pdf):
+    monkeypatch.setattr(main, "page_timeout", 0.02)
+    with CoverageJob(sample_pdf, 36) as job:
+        with pytest.raises(NoPagesMeasured):
+            job.color_coverage()
+        assert job.page_status == {1: "timeout", 2: "timeout", 3: "timeout", 4: "blank", 5: "timeout", 6: "timeout"}
+    assert cached_entries() == []
+
+
+def test_check_measured_needs_a_page_with_ink(sample_pdf):
+    with CoverageJob(sample_pdf) as job:
+        job.page_status = {1: "blank", 2: "failed"}
+        with pytest.raises(NoPagesMeasured):
+            job.check_measured()
+        for measured in ("ok", "stored", "reduced"):
+            job.page_status = {1: "blank", 2: "failed", 3: measured}
+            job.check_measured()
+        # A document of blank pages is measured, with zero coverage
+        job.page_status = {1: "blank", 2: "blank"}
+        job.check_measured()
+
+
+def test_failed_pages_are_priced_at_the_average_of_inked_pages(failing_page, sample_pdf):
+    with CoverageJob(sample_pdf, 36) as job:
+        rows = job.page_coverage("color")
+        assert job.flagged_pages() == {3: "failed"}
+        assert job.page_status[4] == "blank"
+        totals = job.color_coverage()
+    assert cached_entries() == []
+
+    # All pages are A4, so the average is the mean of the pages with ink (1, 2, 5 and 6)
+    np.testing.assert_allclose(rows[2], rows[[0, 1, 4, 5]].mean(axis=0))
+    assert rows[3].tolist() == [0, 0, 0, 0]
+    for index, color in enumerate(main.color_channels):
+        assert totals[color] == pytest.approx(rows[:, index].sum(), abs=0.05)
+
+    printer = {"is_color": True, "inks": {color: {"price": 20.0, "yield": 1000} for color in main.color_channels}}
+    table = evaluate_costs({"Color": printer}, {"color": rows}, {"A4": 0.05}, double_sided=(False,))
+    assert table.ink[0, 0, 0, 0, 0] == pytest.approx(ink_cost(printer, coverage_usage(totals)), abs=1e-3)
+
+
+@pytest.mark.parametrize("mode", ["color", "grayscale"])
+def test_tiff_mode_without_ghostscript_fails_every_page(monkeypatch, sample_pdf, mode):
+    monkeypatch.setenv(render_backend.ghostscript_variable, os.path.join(os.sep, "nonexistent", "gs"))
+    monkeypatch.setattr(render_backend, "_ghostscript", None)
+    with CoverageJob(sample_pdf, 36, render_mode="tiff") as job:
+        with pytest.raises(NoPagesMeasured):
+            job.color_coverage() if mode == "color" else job.grayscale_coverage()
+        statuses = dict(job.page_status)
+    assert set(statuses) == {1, 2, 3, 4, 5, 6}
+    assert {page for page, status in statuses.items() if status != "failed"} <= {4}
+    assert cached_entries() == []
@@ -0,0 +1,92 @@
+import multiprocessing
+
+import numpy as np
+import pymupdf
+
+import main
+import page_store
+from main import CoverageJob
+from page_store import PageStore
+
+
+def entry(number):
+    return np.array([number, 2 * number, 3 * number, 4 * number], dtype=np.uint64), 100 + number
+
+
+def key(number):
+    return number.to_bytes(32, "big")
+
+
+def write_document(path, magenta_height):
+    """Four A4 pages; only the magenta band of page 3 changes between revisions."""
+    document = pymupdf.open()
+    width, height = pymupdf.paper_size("a4")
+    for number in range(4):
+        page = document.new_page(width=width, height=height)
+        if number == 0:
+            page.draw_rect(page.rect, color=None, fill=(0, 0, 0))
+        elif number == 1:
+            page.insert_text((72, 72), "Revision", fontsize=24, color=(0, 0, 1))
+        elif number == 2:
+            page.draw_rect(pymupdf.Rect(0, 100, width, 100 + magenta_height), color=None, fill=(1, 0, 1))
+        else:
+            page.draw_rect(pymupdf.Rect(0, 0, width / 3, height), color=None, fill=(0, 1, 0))
+    document.save(path)
+    document.close()
+
+
+def test_revised_document_renders_only_changed_pages(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "use_page_store", True)
+    monkeypatch.setattr(main, "page_store", PageStore(str(tmp_path / "pages.db")))
+    first, revised = str(tmp_path / "first.pdf"), str(tmp_path / "revised.pdf")
+    write_document(first, 100)
+    write_document(revised, 300)
+
+    with CoverageJob(first, 36) as job:
+        job.color_coverage()
+        assert set(job.page_status.values()) == {"ok"}
+    with CoverageJob(revised, 36) as job:
+        stored = job.color_coverage()
+        assert job.page_status == {1: "stored", 2: "stored", 3: "ok", 4: "stored"}
+
+    monkeypatch.setattr(main, "use_page_store", False)
+    main.coverage_cache.clear()
+    with CoverageJob(revised, 36) as job:
+        assert job.color_coverage() == stored
+
+
+def test_least_recently_used_entries_are_evicted(monkeypatch, tmp_path):
+    clock = iter(range(1, 100))
+    monkeypatch.setattr(page_store.time, "time", lambda: next(clock))
+    monkeypatch.setattr(page_store, "touch_interval", 0)
+    store = PageStore(str(tmp_path / "pages.db"), max_entries=3)
+    for number in range(3):
+        store.put_many({key(number): entry(number)})
+    # Reading entry 0 makes entry 1 the least recently used
+    sums, pixels = store.get_many([key(0)])[key(0)]
+    assert sums.tolist() == [0, 0, 0, 0] and pixels == 100
+    store.put_many({key(3): entry(3)})
+    assert len(store) == 3
+    assert set(store.get_many([key(number) for number in range(4)])) == {key(0), key(2), key(3)}
+
+
+def put_range(path, first, count):
+    store = PageStore(path)
+    for number in range(first, first + count):
+        store.put_many({key(number): entry(number)})
+
+
+def test_concurrent_writers_keep_every_entry(tmp_path):
+    path = str(tmp_path / "pages.db")
+    context = multiprocessing.get_context("spawn")
+    writers = [context.Process(target=put_range, args=(path, first, 100)) for first in (0, 1000)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join(60)
+        assert writer.exitcode == 0
+    store = PageStore(path)
+    assert len(store) == 200
+    found = store.get_many([key(number) for number in list(range(100)) + list(range(1000, 1100))])
+    assert len(found) == 200
+    assert found[key(1042)][0].tolist() == entry(1042)[0].tolist()
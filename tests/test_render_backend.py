@@ -0,0 +1,64 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+import render_backend
+from render_backend import RasterizerPool
+
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                                reason="workers see the patched renderer only when forked")
+real_render_page_sums = render_backend.render_page_sums
+
+
+def slow_render_page_sums(pdf_path, page, mode, resolution):
+    # Page 2 hangs and page 3 takes a second; workers are forked, so they run this
+    if page == 2:
+        time.sleep(60)
+    elif page == 3:
+        time.sleep(1)
+    return real_render_page_sums(pdf_path, page, mode, resolution)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(render_backend, "render_page_sums", slow_render_page_sums)
+    pool = RasterizerPool(2)
+    yield pool
+    pool.close()
+
+
+def test_hung_range_stops_only_its_worker(pool, sample_pdf):
+    other = {}
+
+    def render_other():
+        other["results"] = list(pool.render(sample_pdf, [3, 4], "grayscale", 36, timeout=30))
+
+    thread = threading.Thread(target=render_other)
+    thread.start()
+    time.sleep(0.2)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        list(pool.render(sample_pdf, [1, 2], "grayscale", 36, timeout=0.5))
+    assert time.monotonic() - started < 5
+    thread.join(30)
+    # The other range ran on in its own worker while the hung one was killed
+    assert [page for page, _, _ in other["results"]] == [3, 4]
+    assert len(pool._workers) == 1
+    assert [page for page, _, _ in pool.render(sample_pdf, [1], "grayscale", 36, timeout=30)] == [1]
+
+
+def test_time_waiting_for_a_worker_is_not_counted(monkeypatch, sample_pdf):
+    monkeypatch.setattr(render_backend, "render_page_sums", slow_render_page_sums)
+    pool = RasterizerPool(1)
+    try:
+        thread = threading.Thread(target=lambda: list(pool.render(sample_pdf, [3], "grayscale", 36)))
+        thread.start()
+        time.sleep(0.2)
+        # Waits about a second for the busy worker, then renders a fast page within its budget
+        results = list(pool.render(sample_pdf, [4], "grayscale", 36, timeout=0.5))
+        thread.join(30)
+    finally:
+        pool.close()
+    assert [page for page, _, _ in results] == [4]
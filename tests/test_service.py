@@ -0,0 +1,108 @@
+import http.client
+import json
+import threading
+import time
+
+import pytest
+
+import scheduler
+import service
+from catalog import Catalog
+
+printers = {
+    "Laser": {"is_color": False, "inks": {"Black": {"price": 40.0, "yield": 2000}}},
+    "Color": {"is_color": True, "inks": {color: {"price": 20.0, "yield": 1000}
+                                         for color in ("Cyan", "Magenta", "Yellow", "Black")}},
+}
+papers = {"A4": 0.05}
+
+
+@pytest.fixture
+def quote_server(tmp_path):
+    """A service with one worker and room for one queued job; jobs wait until the gate opens."""
+    catalog = Catalog(str(tmp_path / "catalog.db"))
+    for name, info in printers.items():
+        catalog.put_printer(name, info["is_color"], info["inks"])
+    catalog.set_paper_prices(papers)
+    # The service sets the process-wide Ghostscript process limit; other tests run without it
+    previous_limit = scheduler.process_limit
+    quote_service = service.QuoteService(catalog, workers=1, processes=2, max_queued=1)
+    gate = threading.Event()
+    run = quote_service.run
+
+    def gated_run(job):
+        gate.wait(30)
+        run(job)
+
+    quote_service.run = gated_run
+    server = service.make_server(quote_service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1], quote_service, gate
+    gate.set()
+    server.shutdown()
+    server.server_close()
+    quote_service.close()
+    catalog.close()
+    scheduler.set_process_limit(previous_limit)
+
+
+def request(port, method, path, body=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def test_upload_queue_full_and_events(quote_server, sample_pdf):
+    port, quote_service, gate = quote_server
+    with open(sample_pdf, "rb") as file:
+        pdf = file.read()
+
+    status, headers, body = request(port, "POST", "/jobs?mode=color", pdf)
+    assert status == 202
+    first = json.loads(body)
+    assert headers["Location"] == f"/jobs/{first['id']}"
+    # The worker takes the first job and waits at the gate
+    deadline = time.monotonic() + 10
+    while quote_service.pending.qsize() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    status, _, body = request(port, "POST", "/jobs?mode=grayscale", pdf)
+    assert status == 202
+    second = json.loads(body)
+
+    status, headers, _ = request(port, "POST", "/jobs?mode=color", pdf)
+    assert status == 503
+    assert headers["Retry-After"] == str(service.retry_after)
+
+    gate.set()
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    connection.request("GET", f"/jobs/{first['id']}/events")
+    response = connection.getresponse()
+    assert response.status == 200
+    events = [json.loads(line) for line in response.read().splitlines()]
+    connection.close()
+    assert events[-1]["status"] == "done"
+    assert all(event["status"] != "done" for event in events[:-1])
+    assert events[-1]["pages_done"] == events[-1]["page_count"] == 6
+    assert set(events[-1]["costs"]) == {"Color"}
+    assert events[-1]["flagged_pages"] == {}
+
+    deadline = time.monotonic() + 60
+    while quote_service.get(second["id"]).status != "done" and time.monotonic() < deadline:
+        time.sleep(0.05)
+    _, _, body = request(port, "GET", f"/jobs/{second['id']}")
+    assert json.loads(body)["status"] == "done"
+    assert set(json.loads(body)["costs"]) == {"Laser", "Color"}
+
+
+def test_empty_upload_is_rejected(quote_server):
+    port, quote_service, _ = quote_server
+    status, _, body = request(port, "POST", "/jobs?mode=color", b"")
+    assert status == 400
+    assert "empty" in json.loads(body)["error"]
+    assert quote_service.pending.qsize() == 0
@@ -0,0 +1,72 @@
+import subprocess
+import sys
+import time
+
+import main
+import spool
+from main import CoverageJob
+from render_backend import render_range_sums
+from spool import Spool
+
+
+def run_worker_process(db_path, cwd):
+    """Runs one spool worker process until the spool has nothing left to lease."""
+    subprocess.run([sys.executable, spool.__file__, "worker", db_path, "--exit-when-idle"],
+                   cwd=cwd, check=True, timeout=120)
+
+
+def test_expired_lease_is_taken_over_by_another_worker(monkeypatch, tmp_path, sample_pdf):
+    monkeypatch.setattr(spool, "lease_seconds", 0.5)
+    db_path = str(tmp_path / "spool.db")
+    jobs = Spool(db_path)
+    job_id = jobs.submit(sample_pdf, [1, 2, 3], "grayscale", 36, "pymupdf")
+
+    # A worker leases the task and dies without a heartbeat
+    task = jobs.lease("dead-worker")
+    assert task["pages"] == [1, 2, 3]
+    assert jobs.lease("other-worker") is None
+    time.sleep(0.6)
+
+    run_worker_process(db_path, tmp_path)
+
+    records, failed_pages, open_tasks = jobs.progress(job_id)
+    assert (failed_pages, open_tasks) == ([], 0)
+    expected = {page: (sums.tolist(), pixels) for page, sums, pixels in
+                render_range_sums(sample_pdf, [1, 2, 3], "grayscale", 36)}
+    assert {page: (sums.tolist(), pixels) for _, page, sums, pixels, _ in records} == expected
+    assert {status for *_, status in records} == {"ok"}
+    # The first worker's late results and heartbeats are refused
+    assert not jobs.heartbeat(task["id"], "dead-worker")
+    assert not jobs.complete(task["id"], "dead-worker", [(1, [0], 1, "ok")])
+
+
+def test_task_fails_after_max_attempts(monkeypatch, tmp_path, sample_pdf):
+    monkeypatch.setattr(spool, "lease_seconds", 0.1)
+    monkeypatch.setattr(spool, "max_attempts", 1)
+    jobs = Spool(str(tmp_path / "spool.db"))
+    job_id = jobs.submit(sample_pdf, [1, 2], "color", 36, "pymupdf")
+    assert jobs.lease("dead-worker") is not None
+    time.sleep(0.2)
+
+    assert jobs.lease("other-worker") is None
+    assert jobs.progress(job_id) == ([], [1, 2], 0)
+
+
+def test_spooled_job_matches_local_job(tmp_path, sample_pdf):
+    db_path = str(tmp_path / "spool.db")
+    with CoverageJob(sample_pdf) as job:
+        local = job.color_coverage()
+    # The spooled job would read the local result back from the cache
+    main.coverage_cache.clear()
+    workers = spool.start_local_workers(db_path, 2)
+    try:
+        with CoverageJob(sample_pdf, spool=Spool(db_path)) as job:
+            spooled = job.color_coverage()
+            flagged = job.flagged_pages()
+    finally:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.wait()
+    assert flagged == {}
+    assert spooled == local